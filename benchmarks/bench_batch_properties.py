@@ -0,0 +1,81 @@
+"""
+Benchmark batch property reads and writes against per-thing requests.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_batch_properties
+
+400 things with 50 properties each. A dashboard refresh reads every
+property of every thing, either with one GET /things/{id}/properties per
+thing or one POST /things:batchRead. Writes set two properties per thing,
+with PUT /things/{id}/properties or one POST /things:batchWrite.
+"""
+
+import time
+
+from fastapi.testclient import TestClient
+from loguru import logger
+
+from thingtalk import Property, Thing, Value
+from thingtalk.app import ThingTalk
+
+THINGS = 400
+PROPERTIES = 50
+ROUNDS = 3
+
+
+class Sensor(Thing):
+    def __init__(self, index):
+        super().__init__(f"urn:dev:ops:sensor-{index}", f"Sensor {index}")
+        for p in range(PROPERTIES):
+            self.add_property(Property(f"p{p}", Value(p), metadata={
+                "@type": "LevelProperty", "type": "integer", "minimum": 0, "maximum": 1000,
+            }))
+        self.href_prefix = f"/things/{self.id}"
+
+
+def best(fn):
+    fastest = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn()
+        fastest = min(fastest, time.perf_counter() - start)
+    return fastest * 1000
+
+
+def main():
+    logger.remove()
+    servient = ThingTalk()
+    ids = []
+    for index in range(THINGS):
+        sensor = Sensor(index)
+        servient.app.state.things.things[sensor.id] = sensor
+        ids.append(sensor.id)
+    client = TestClient(servient.app)
+
+    def read_each():
+        for thing_id in ids:
+            assert client.get(f"/things/{thing_id}/properties").status_code == 200
+
+    def read_batch():
+        assert client.post("/things:batchRead", json={i: [] for i in ids}).status_code == 200
+
+    def write_each():
+        for thing_id in ids:
+            assert client.put(f"/things/{thing_id}/properties", json={"p0": 1, "p1": 2}).status_code == 200
+
+    def write_batch():
+        body = {i: {"p0": 1, "p1": 2} for i in ids}
+        assert client.post("/things:batchWrite", json=body).status_code == 200
+
+    for name, fn in [
+        ("read, per thing", read_each),
+        ("read, batch", read_batch),
+        ("write, per thing", write_each),
+        ("write, batch", write_batch),
+    ]:
+        print(f"{name:<20} {best(fn):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark "all lights off" across 500 bulbs.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_broadcast
+
+Every bulb takes 2 ms of simulated device I/O to apply a value. The former
+approach subscribed each bulb's dispatch to broadcast/light and awaited
+them one at a time; the container resolves the group through its index
+and dispatches to all bulbs concurrently, bounded by
+broadcast_concurrency.
+"""
+
+import asyncio
+import time
+
+from loguru import logger
+
+from thingtalk.domains.iot import Device
+from thingtalk.models.containers import MultipleThings
+from thingtalk.models.property import Property
+from thingtalk.models.value import Value
+from thingtalk.schema import IntermediateMsg
+
+BULBS = 500
+IO_SECONDS = 0.002
+
+
+class Bulb(Device):
+    type_alias = ["OnOffSwitch", "Light"]
+
+    def __init__(self, index):
+        super().__init__(f"urn:bench:bulb-{index}", f"Bulb {index}")
+        self.add_property(Property("on", Value(True), metadata={"type": "boolean"}))
+
+    async def properties_action(self, properties):
+        await asyncio.sleep(IO_SECONDS)
+
+
+async def main():
+    logger.remove()
+    container = MultipleThings({}, "bench")
+    for index in range(BULBS):
+        await container.add_thing(Bulb(index))
+    bulbs = container.select(group="light")
+    message = IntermediateMsg(topic="broadcast/light", messageType="setProperty", data={"on": False})
+
+    start = time.perf_counter()
+    for bulb in bulbs:
+        await bulb.dispatch(message)
+    sequential = time.perf_counter() - start
+
+    for concurrency in (None, 64):
+        container.broadcast_concurrency = concurrency
+        start = time.perf_counter()
+        await container.handle_broadcast(message)
+        elapsed = time.perf_counter() - start
+        print(f"{'indexed, limit ' + str(concurrency):<24} {elapsed * 1000:8.1f} ms")
+    print(f"{'one at a time':<24} {sequential * 1000:8.1f} ms")
+    container.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""
+Benchmark subscribe and teardown cost of /channel sockets on the event bus.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_event_bus
+
+With 10k things, every socket subscribes to 20 things. The time to attach
+and detach one more socket is measured while 1 .. 500 sockets are already
+subscribed, for the former pyee emitter (3 topics per thing, membership
+checked with `listeners()` on teardown) and the topic trie (one `+`
+subscription per thing, teardown by handle).
+"""
+
+import random
+import time
+
+from pyee.asyncio import AsyncIOEventEmitter
+
+from thingtalk.toolkits.event_bus import EventBus
+
+THINGS = 10_000
+THINGS_PER_SOCKET = 20
+SOCKETS = (1, 50, 100, 250, 500)
+ROUNDS = 50
+
+
+def pick_things(rng):
+    return [f"urn:thing:{rng.randrange(THINGS)}" for _ in range(THINGS_PER_SOCKET)]
+
+
+def socket_listener():
+    def send(data):
+        pass
+    return send
+
+
+def pyee_subscribe(ee, things, send):
+    topics = []
+    for thing_id in things:
+        for topic_type in ["state", "event", "error"]:
+            topic = f"things/{thing_id}/{topic_type}"
+            ee.on(topic, send)
+            topics.append(topic)
+    return topics
+
+
+def pyee_teardown(ee, topics, send):
+    for topic in topics:
+        if send in ee.listeners(topic):
+            ee.remove_listener(topic, send)
+
+
+def trie_subscribe(bus, things, send):
+    return [bus.subscribe(f"things/{thing_id}/+", send) for thing_id in things]
+
+
+def trie_teardown(bus, subscriptions, send):
+    for subscription in subscriptions:
+        bus.unsubscribe(subscription)
+
+
+def measure(bus, subscribe, teardown, sockets):
+    rng = random.Random(sockets)
+    for _ in range(sockets):
+        subscribe(bus, pick_things(rng), socket_listener())
+
+    sub_cost = down_cost = 0.0
+    for _ in range(ROUNDS):
+        things = pick_things(rng)
+        send = socket_listener()
+        start = time.perf_counter()
+        handles = subscribe(bus, things, send)
+        sub_cost += time.perf_counter() - start
+        start = time.perf_counter()
+        teardown(bus, handles, send)
+        down_cost += time.perf_counter() - start
+    return sub_cost / ROUNDS, down_cost / ROUNDS
+
+
+def measure_emit(bus, sockets):
+    for _ in range(sockets):
+        bus.subscribe("things/+/+", socket_listener())
+    topics = [f"things/urn:thing:{i}/state" for i in range(1000)]
+    start = time.perf_counter()
+    for topic in topics:
+        bus.match(topic)
+    return (time.perf_counter() - start) / len(topics)
+
+
+def main():
+    print(f"{THINGS} things, {THINGS_PER_SOCKET} things per socket, µs per socket")
+    print(f"{'sockets':>8} {'pyee sub':>9} {'pyee down':>10} {'trie sub':>9} {'trie down':>10}")
+    for sockets in SOCKETS:
+        pyee_sub, pyee_down = measure(AsyncIOEventEmitter(), pyee_subscribe, pyee_teardown, sockets)
+        trie_sub, trie_down = measure(EventBus(), trie_subscribe, trie_teardown, sockets)
+        print(f"{sockets:>8} {pyee_sub * 1e6:>9.1f} {pyee_down * 1e6:>10.1f} "
+              f"{trie_sub * 1e6:>9.1f} {trie_down * 1e6:>10.1f}")
+
+    print()
+    print("topic match with every socket on things/+/+, µs per emit")
+    for sockets in SOCKETS:
+        print(f"{sockets:>8} {measure_emit(EventBus(), sockets) * 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
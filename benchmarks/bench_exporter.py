@@ -0,0 +1,99 @@
+"""
+Benchmark mirroring the state of a 5,000 device gateway to MQTT.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_exporter
+
+Updates are emitted on things/{id}/state like Thing.property_notify does.
+"per message" encodes and queues a publish for every property of every
+message, the way an overridden property_action does. The exporter only
+records the value, and encodes and queues it once per interval if it
+changed.
+"""
+
+import asyncio
+import random
+import time
+
+from loguru import logger
+
+from thingtalk.schema import OutMsg
+from thingtalk.toolkits.event_bus import ee
+from thingtalk.toolkits.exporter import MqttExporter
+from thingtalk.toolkits.mqtt import Publisher
+
+DEVICES = 5000
+UPDATES = 100000
+INTERVALS = 10
+
+
+class NullClient:
+    properties = {}
+
+    def publish(self, *args, **kwargs):
+        pass
+
+
+class FakeMqtt:
+    def __init__(self):
+        self.publisher = Publisher(NullClient(), max_pending=10 ** 9)
+
+
+def make_updates():
+    rng = random.Random(1)
+    return [
+        OutMsg(
+            topic=f"things/urn:bench:{rng.randrange(DEVICES)}",
+            messageType="propertyStatus",
+            data={"power": rng.randrange(10), "on": True},
+        )
+        for _ in range(UPDATES)
+    ]
+
+
+def per_message(updates) -> tuple:
+    mqtt = FakeMqtt()
+
+    def on_state(message):
+        thing_id = message.topic[len("things/"):]
+        for name, value in message.data.items():
+            mqtt.publisher.put(f"things/{thing_id}/properties/{name}", value, retain=True)
+
+    subscription = ee.subscribe("things/+/state", on_state)
+    started = time.perf_counter()
+    for message in updates:
+        ee.emit(f"{message.topic}/state", message)
+    elapsed = time.perf_counter() - started
+    ee.unsubscribe(subscription)
+    return elapsed, UPDATES * 2
+
+
+async def exported(updates) -> tuple:
+    mqtt = FakeMqtt()
+    exporter = MqttExporter(mqtt, interval=3600)
+    await exporter.start()
+    batch = len(updates) // INTERVALS
+    started = time.perf_counter()
+    for offset in range(0, len(updates), batch):
+        for message in updates[offset:offset + batch]:
+            ee.emit(f"{message.topic}/state", message)
+        exporter.flush()
+    elapsed = time.perf_counter() - started
+    await exporter.stop()
+    return elapsed, exporter.published
+
+
+async def main():
+    logger.remove()
+    updates = make_updates()
+    print(f"{UPDATES} state messages for {DEVICES} devices, {INTERVALS} export intervals")
+    print(f"{'':>12} {'µs/message':>11} {'publishes':>10}")
+    elapsed, queued = per_message(updates)
+    print(f"{'per message':>12} {elapsed / UPDATES * 1e6:>11.2f} {queued:>10}")
+    elapsed, queued = await exported(updates)
+    print(f"{'exporter':>12} {elapsed / UPDATES * 1e6:>11.2f} {queued:>10}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Benchmark WebSocket fan-out of a single propertyStatus message.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_fanout
+
+The serialization cost per message should stay flat as the number of
+subscribers grows, only the (unavoidable) per-socket send remains linear.
+"""
+
+import asyncio
+import json
+import time
+
+from starlette.websockets import WebSocketState
+
+from thingtalk.routers.websockets import send_data
+from thingtalk.schema import OutMsg
+
+SUBSCRIBERS = (1, 10, 100, 200, 500)
+MESSAGES = 200
+
+
+class FakeWebSocket:
+    """A WebSocket stand-in that only counts what it is asked to send."""
+
+    application_state = WebSocketState.CONNECTED
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_bytes(self, data: bytes):
+        self.sent += len(data)
+
+    async def send_json(self, data, mode="text"):
+        # what starlette does for send_json(mode='binary')
+        text = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+        self.sent += len(text.encode("utf-8"))
+
+
+async def send_data_per_subscriber(websocket, data: OutMsg):
+    """The former fan-out path: dict() and JSON-encode per subscriber."""
+    await websocket.send_json(data.dict(), mode="binary")
+
+
+def make_message(i: int) -> OutMsg:
+    return OutMsg(
+        topic="things/urn:dev:ops:my-lamp-1234",
+        messageType="propertyStatus",
+        data={
+            "brightness": i % 100,
+            "on": True,
+            "color": {"x": 0.3127, "y": 0.329},
+            "color_temp": 370,
+        },
+    )
+
+
+async def run(sender, subscribers: int) -> float:
+    sockets = [FakeWebSocket() for _ in range(subscribers)]
+    start = time.process_time()
+    for i in range(MESSAGES):
+        message = make_message(i)
+        for websocket in sockets:
+            await sender(websocket, message)
+    return (time.process_time() - start) / MESSAGES
+
+
+async def main():
+    print(f"{'subscribers':>12} {'before µs/msg':>14} {'after µs/msg':>13} "
+          f"{'before µs/sub':>14} {'after µs/sub':>13}")
+    for subscribers in SUBSCRIBERS:
+        before = await run(send_data_per_subscriber, subscribers)
+        after = await run(send_data, subscribers)
+        print(f"{subscribers:>12} {before * 1e6:>14.1f} {after * 1e6:>13.1f} "
+              f"{before * 1e6 / subscribers:>14.2f} {after * 1e6 / subscribers:>13.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""
+Benchmark querying a week of 1 Hz samples of one property.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_history
+
+604,800 samples are appended to a series, then reduced to min/max/avg
+buckets the way /properties/{name}/history does. "per sample" walks every
+sample in Python; "bucketed" bisects the bucket bounds and reduces the
+value column slice of each bucket with min, max and sum.
+"""
+
+import asyncio
+import math
+import tempfile
+import time
+
+from loguru import logger
+
+from thingtalk.toolkits.history import Series
+
+SAMPLES = 7 * 86400
+START = 1.6e9
+
+
+def per_sample(series: Series, start: float, end: float, step: float) -> int:
+    buckets = {}
+    for segment in series.segments:
+        with segment.columns() as (timestamps, values):
+            for timestamp, value in zip(timestamps, values):
+                if start <= timestamp < end:
+                    bucket = buckets.setdefault(int((timestamp - start) // step), [value, value, 0.0, 0])
+                    bucket[0] = min(bucket[0], value)
+                    bucket[1] = max(bucket[1], value)
+                    bucket[2] += value
+                    bucket[3] += 1
+    return len(buckets)
+
+
+async def main():
+    logger.remove()
+    with tempfile.TemporaryDirectory() as directory:
+        series = Series(directory)
+        started = time.perf_counter()
+        for second in range(SAMPLES):
+            series.append(START + second, math.sin(second / 3600))
+        appended = time.perf_counter() - started
+        print(f"{SAMPLES} samples in {len(series.segments)} segments, {series.size / 1e6:.1f} MB")
+        print(f"append: {appended / SAMPLES * 1e6:.2f} µs/sample")
+
+        end = START + SAMPLES
+        for buckets in (500, 10000):
+            step = SAMPLES / buckets
+            started = time.perf_counter()
+            count = per_sample(series, START, end, step)
+            slow = time.perf_counter() - started
+            started = time.perf_counter()
+            result = await series.query(START, end, step)
+            fast = time.perf_counter() - started
+            assert len(result["t"]) == count == buckets
+            print(f"{buckets:>6} buckets: per sample {slow * 1e3:7.1f} ms, bucketed {fast * 1e3:6.1f} ms")
+        series.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
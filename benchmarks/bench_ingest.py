@@ -0,0 +1,123 @@
+"""
+Benchmark MQTT ingest into things at 20k messages per second.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ingest
+
+A broker stand-in delivers zigbee2mqtt style messages to Mqtt.on_message
+at a fixed rate, the way gmqtt does. It compares the usual hand written
+glue, which parses each message and calls bulk_sync_property for it, with
+the Ingest pipeline, which merges the messages of a thing per window.
+Reported are the rate actually sustained, the loop's busy share and how
+many propertyStatus messages subscribers received.
+"""
+
+import asyncio
+import json
+import random
+import time
+
+from loguru import logger
+
+from thingtalk.models.containers import MultipleThings
+from thingtalk.models.property import Property
+from thingtalk.models.thing import Thing
+from thingtalk.models.value import Value
+from thingtalk.toolkits.event_bus import ee
+from thingtalk.toolkits.ingest import Ingest
+from thingtalk.toolkits.mqtt import Mqtt
+
+DEVICES = 500
+RATE = 20000
+SECONDS = 2.0
+TICK = 0.005
+
+
+class Glue(Mqtt):
+    """The per message glue every deployment used to write."""
+
+    async def on_message(self, client, topic, payload, qos, properties):
+        name = topic.split("/")[1]
+        thing = self.things.get_thing(f"urn:z2m:{name}")
+        if thing is not None:
+            await thing.bulk_sync_property(json.loads(payload))
+
+
+def make_things() -> MultipleThings:
+    things = {}
+    for i in range(DEVICES):
+        thing = Thing(f"urn:z2m:sensor-{i}", f"sensor {i}")
+        for name in ("temperature", "humidity", "battery"):
+            thing.add_property(Property(name, Value(0.0), metadata={"type": "number"}))
+        things[thing.id] = thing
+    return MultipleThings(things, "bench")
+
+
+def make_messages(count: int):
+    rng = random.Random(1)
+    return [
+        (
+            f"zigbee2mqtt/sensor-{rng.randrange(DEVICES)}",
+            json.dumps({
+                "temperature": round(rng.uniform(18, 25), 1),
+                "humidity": round(rng.uniform(30, 60), 1),
+                "battery": rng.randrange(100),
+                "linkquality": rng.randrange(255),
+            }).encode(),
+        )
+        for _ in range(count)
+    ]
+
+
+async def broker(mqtt: Mqtt, messages) -> float:
+    """Deliver the messages at RATE, returns the seconds it took."""
+    per_tick = int(RATE * TICK)
+    started = time.perf_counter()
+    for offset in range(0, len(messages), per_tick):
+        for topic, payload in messages[offset:offset + per_tick]:
+            await mqtt.on_message(mqtt.sub_client, topic, payload, 0, {})
+        due = started + (offset + per_tick) / RATE
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+    return time.perf_counter() - started
+
+
+async def run(kind: str, messages) -> dict:
+    things = make_things()
+    ingest = Ingest(things, {"zigbee2mqtt/{name}": "urn:z2m:{name}"}) if kind == "ingest" else None
+    mqtt = (Mqtt if ingest else Glue)("localhost", 1883, ingest=ingest)
+    mqtt.things = things
+
+    published = [0]
+
+    def count(message):
+        published[0] += 1
+
+    subscription = ee.subscribe("things/+/samples", count)
+    cpu = time.process_time()
+    elapsed = await broker(mqtt, messages)
+    if ingest is not None:
+        await ingest.flush()
+    cpu = time.process_time() - cpu
+    ee.unsubscribe(subscription)
+    # the clients never connected, stop their retry tasks
+    mqtt.sub_client._resend_task.cancel()
+    mqtt.pub_client._resend_task.cancel()
+    things.close()
+    for thing in things.things.values():
+        await thing.remove_listener()
+    return {"rate": len(messages) / elapsed, "busy": cpu / elapsed, "published": published[0]}
+
+
+async def main():
+    logger.remove()
+    messages = make_messages(int(RATE * SECONDS))
+    print(f"{len(messages)} messages for {DEVICES} devices offered at {RATE}/s")
+    print(f"{'':>8} {'msgs/s':>8} {'loop busy':>10} {'propertyStatus':>15}")
+    for kind in ("glue", "ingest"):
+        result = await run(kind, messages)
+        print(f"{kind:>8} {result['rate']:>8.0f} {result['busy']:>9.0%} {result['published']:>15}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
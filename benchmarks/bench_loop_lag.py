@@ -0,0 +1,90 @@
+"""
+Benchmark event loop lag with blocking drivers.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_loop_lag
+
+Things write to a driver that blocks for a few milliseconds per value. When
+the forwarder runs on the loop (what Value.set used to do), every other
+coroutine waits for it; on the driver thread pool the loop keeps ticking and
+writes to different things overlap.
+"""
+
+import asyncio
+import time
+
+from loguru import logger
+
+from thingtalk.models.property import Property
+from thingtalk.models.thing import Thing
+from thingtalk.models.value import Value
+from thingtalk.toolkits import executor
+
+THINGS = 16
+WRITES = 10
+BLOCK = 0.005
+TICK = 0.002
+
+
+def driver_write(value):
+    time.sleep(BLOCK)
+
+
+async def driver_write_on_loop(value):
+    # a plain forwarder called on the loop, as before
+    driver_write(value)
+
+
+async def sample_lag(lags: list, done: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        expected = loop.time() + TICK
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - expected)
+
+
+async def run(forwarder) -> dict:
+    things = []
+    for i in range(THINGS):
+        thing = Thing(f"urn:bench:driver-{i}", f"driver {i}")
+        thing.add_property(Property("level", Value(0, forwarder), metadata={"type": "integer"}))
+        things.append(thing)
+
+    async def writes(thing):
+        for level in range(WRITES):
+            await thing.set_property("level", level)
+
+    lags, done = [], asyncio.Event()
+    sampler = asyncio.create_task(sample_lag(lags, done))
+    started = time.perf_counter()
+    await asyncio.gather(*(writes(thing) for thing in things))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await sampler
+    for thing in things:
+        await thing.remove_listener()
+
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "p50": lags[len(lags) // 2],
+        "p99": lags[int(len(lags) * 0.99)],
+        "max": lags[-1],
+    }
+
+
+async def main():
+    logger.remove()
+    print(f"{THINGS} things x {WRITES} writes, driver blocks {BLOCK * 1000:.0f} ms, "
+          f"{executor.max_workers} driver threads")
+    print(f"{'forwarder':>10} {'total s':>8} {'lag p50 ms':>11} {'p99 ms':>8} {'max ms':>8}")
+    for label, forwarder in (("on loop", driver_write_on_loop), ("offloaded", driver_write)):
+        result = await run(forwarder)
+        print(f"{label:>10} {result['elapsed']:>8.2f} {result['p50'] * 1000:>11.2f} "
+              f"{result['p99'] * 1000:>8.2f} {result['max'] * 1000:>8.2f}")
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
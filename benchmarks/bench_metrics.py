@@ -0,0 +1,105 @@
+"""
+Benchmark the cost of the metrics instrumentation.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_metrics
+
+Measures the metric primitives on their own, then an event bus emit with
+its topic count against the same emit without it. A property update
+that reaches a socket pays for one emit count, the dispatch and delivery
+histograms and their perf_counter() calls.
+"""
+
+import random
+import time
+
+from thingtalk.toolkits.event_bus import EventBus
+from thingtalk.toolkits.metrics import Counter, Histogram, Registry
+
+N = 200_000
+REPEAT = 7
+TOPICS = [f"things/urn:thing:{i}/state" for i in range(100)]
+LATENCIES = [random.lognormvariate(-8, 1.5) for _ in range(1000)]
+
+
+def per_op(fn, n=N):
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(n)
+        best = min(best, time.perf_counter() - start)
+    return best / n * 1e9
+
+
+def baseline(n):
+    for i in range(n):
+        TOPICS[i % 100]
+
+
+def topic_count(n):
+    emitted = {}
+    for i in range(n):
+        topic = TOPICS[i % 100]
+        emitted[topic] = emitted.get(topic, 0) + 1
+
+
+def counter_labels(n):
+    counter = Counter("c", "", ("topic",), registry=Registry())
+    for i in range(n):
+        counter.labels(TOPICS[i % 100]).inc()
+
+
+def histogram_observe(n):
+    histogram = Histogram("h", "", registry=Registry())
+    for i in range(n):
+        histogram.observe(LATENCIES[i % 1000])
+
+
+def histogram_timed(n):
+    histogram = Histogram("h", "", registry=Registry())
+    perf_counter = time.perf_counter
+    for i in range(n):
+        started = perf_counter()
+        TOPICS[i % 100]
+        histogram.observe(perf_counter() - started)
+
+
+def emitter(count_emits):
+    bus = EventBus()
+    bus.count_emits = count_emits
+    for topic in TOPICS:
+        bus.on(topic, lambda data: None)
+
+    def emit(n):
+        for i in range(n):
+            bus.emit(TOPICS[i % 100], None)
+
+    return emit
+
+
+def main():
+    loop = per_op(baseline)
+    results = {
+        "emit count (dict)": per_op(topic_count) - loop,
+        "counter.labels(topic).inc()": per_op(counter_labels) - loop,
+        "histogram.observe()": per_op(histogram_observe) - loop,
+        "perf_counter() x2 + observe()": per_op(histogram_timed) - loop,
+    }
+    for name, ns in results.items():
+        print(f"{name:<32} {ns:8.0f} ns")
+
+    bare = instrumented = float("inf")
+    for _ in range(3):
+        bare = min(bare, per_op(emitter(False)))
+        instrumented = min(instrumented, per_op(emitter(True)))
+    print(f"{'emit without count':<32} {bare:8.0f} ns")
+    print(f"{'emit with count':<32} {instrumented:8.0f} ns  ({instrumented - bare:+.0f} ns)")
+
+    # bus emit + Thing.dispatch + channel delivery
+    per_update = results["emit count (dict)"] + 2 * results["perf_counter() x2 + observe()"]
+    print(f"{'instrumentation per update':<32} {per_update:8.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
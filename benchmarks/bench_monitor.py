@@ -0,0 +1,51 @@
+"""
+Benchmark the cost of the loop monitor per callback.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_monitor
+
+Without a started LoopMonitor asyncio runs unchanged, so "off" is the
+baseline; "on" adds the timing of every callback and coroutine step.
+"""
+
+import asyncio
+import time
+
+from loguru import logger
+
+from thingtalk.toolkits.monitor import LoopMonitor
+
+TASKS = 100
+STEPS = 200
+ROUNDS = 5
+
+
+async def steps():
+    for _ in range(STEPS):
+        await asyncio.sleep(0)
+
+
+async def run() -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        await asyncio.gather(*(steps() for _ in range(TASKS)))
+        best = min(best, time.perf_counter() - started)
+    return best / (TASKS * STEPS)
+
+
+async def main():
+    logger.remove()
+    off = await run()
+    monitor = LoopMonitor(threshold=0.05, interval=0.1)
+    await monitor.start()
+    on = await run()
+    await monitor.stop()
+    print(f"{TASKS * STEPS} coroutine steps, best of {ROUNDS}, µs per step")
+    print(f"monitor off {off * 1e6:6.2f}")
+    print(f"monitor on  {on * 1e6:6.2f}  (+{(on - off) * 1e6:.2f})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Benchmark property updates through the rule network.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_rule_engine
+
+Every thing carries ten rules (gt/lt thresholds and eq premises) and the
+number of things grows with the total rule count, so the per update cost
+should stay flat from 100 to 10k rules.
+"""
+
+import asyncio
+import random
+import time
+
+from loguru import logger
+
+from thingtalk.rule_engine import RuleEngine, Rule
+from thingtalk.schema import OutMsg
+
+RULES = (100, 1_000, 10_000)
+RULES_PER_THING = 10
+UPDATES = 1_000
+
+
+def make_rule(rng, index, thing_id):
+    op = rng.choice(["gt", "lt", "eq"])
+    value = rng.randrange(0, 100)
+    premise = [{"topic": f"things/{thing_id}", "messageType": "propertyStatus",
+                "name": "level", "op": op, "value": value}]
+    if index % 3 == 0:
+        premise.append({"topic": f"things/{thing_id}", "messageType": "propertyStatus",
+                        "name": "on", "op": "eq", "value": True})
+    return Rule(
+        id=f"rule-{index}",
+        enabled=True,
+        name=f"rule {index}",
+        premise_type="And",
+        premise=premise,
+        conclusion=[{"topic": "things/bench:sink", "messageType": "setProperty",
+                     "data": {"on": False}}],
+    )
+
+
+async def measure(rules: int) -> float:
+    rng = random.Random(rules)
+    engine = RuleEngine()
+    things = [f"urn:bench:{i}" for i in range(rules // RULES_PER_THING)]
+    for index in range(rules):
+        await engine.load_rule(make_rule(rng, index, things[index // RULES_PER_THING]))
+
+    updates = []
+    for _ in range(UPDATES):
+        thing_id = rng.choice(things)
+        data = {"level": rng.randrange(0, 100)}
+        if rng.random() < 0.3:
+            data["on"] = True
+        updates.append(OutMsg(topic=f"things/{thing_id}", messageType="propertyStatus", data=data))
+
+    start = time.perf_counter()
+    for message in updates:
+        await engine.handle_status(message)
+    elapsed = time.perf_counter() - start
+
+    for index in range(rules):
+        await engine.disable_rule(f"rule-{index}")
+    return elapsed / UPDATES
+
+
+async def main():
+    # keep the terminal output out of the measurement
+    logger.remove()
+    print(f"{'rules':>8} {'µs/update':>10}")
+    for rules in RULES:
+        print(f"{rules:>8} {await measure(rules) * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
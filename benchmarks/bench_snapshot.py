@@ -0,0 +1,87 @@
+"""
+Benchmark restoring the property state of a 10,000 device gateway.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_snapshot
+
+Each device has 10 properties, 100,000 in total. The state file holds a
+full compacted state followed by an interval of appended changes, and is
+read back into fresh things the way StateSnapshot.start does.
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from loguru import logger
+
+from thingtalk.models.containers import MultipleThings
+from thingtalk.models.property import Property
+from thingtalk.models.thing import Thing
+from thingtalk.models.value import Value
+from thingtalk.toolkits.snapshot import StateSnapshot
+
+DEVICES = 10000
+PROPERTIES = 10
+CHANGES = 20000
+
+
+def make_things() -> MultipleThings:
+    things = {}
+    for index in range(DEVICES):
+        thing = Thing(f"urn:bench:{index}", "sensor")
+        for number in range(PROPERTIES):
+            thing.add_property(Property(f"p{number}", Value(0), metadata={"type": "integer", "minimum": 0}))
+        things[thing.id] = thing
+    return MultipleThings(things, "things")
+
+
+async def main():
+    logger.remove()
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.jsonl")
+
+        things = make_things()
+        snapshot = StateSnapshot(path, things, interval=3600)
+        await snapshot.start()
+        for _, thing in await things.get_things():
+            for prop in thing.properties.values():
+                prop.value.reset(rng.randrange(1000))
+        await snapshot.compact()
+        for _ in range(CHANGES):
+            thing = things.get_thing(f"urn:bench:{rng.randrange(DEVICES)}")
+            await thing.set_property(f"p{rng.randrange(PROPERTIES)}", rng.randrange(1000))
+        started = time.perf_counter()
+        await snapshot.save()
+        saved = time.perf_counter() - started
+        expected = {
+            thing.id: {name: prop.value.last_value for name, prop in thing.properties.items()}
+            for _, thing in await things.get_things()
+        }
+        await snapshot.stop()
+        # keep the appended changes in the file for the restore
+        await snapshot.save()
+
+        things = make_things()
+        snapshot = StateSnapshot(path, things, interval=3600)
+        started = time.perf_counter()
+        await snapshot.start()
+        restored = time.perf_counter() - started
+        await snapshot.stop()
+
+        actual = {
+            thing.id: {name: prop.value.last_value for name, prop in thing.properties.items()}
+            for _, thing in await things.get_things()
+        }
+        assert actual == expected
+        print(f"{DEVICES * PROPERTIES} properties, {os.path.getsize(path) / 1e6:.1f} MB state file")
+        print(f"save {CHANGES} changes: {saved * 1e3:.1f} ms")
+        print(f"restore: {restored * 1e3:.1f} ms, {snapshot.restored} values")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
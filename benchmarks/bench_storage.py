@@ -0,0 +1,109 @@
+"""
+Benchmark rule CRUD latency against the table size.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_storage
+
+Measures the time the event loop spends in get/update/insert on the
+SQLite store as the rules table grows, and on TinyDB (the former backend)
+when it is installed.
+"""
+
+import asyncio
+import tempfile
+import time
+import uuid
+
+from thingtalk.toolkits.storage import SQLiteDatabase
+
+try:
+    from tinydb import TinyDB, Query
+except ImportError:
+    TinyDB = None
+
+SIZES = (1_000, 10_000, 50_000)
+TINYDB_MAX_SIZE = 10_000
+OPS = 100
+
+
+def make_rule():
+    return {
+        "id": str(uuid.uuid4()),
+        "enabled": True,
+        "name": "rule",
+        "premise_type": "Singleton",
+        "premise": [{"topic": "things/lamp", "messageType": "propertyStatus",
+                     "name": "on", "op": "eq", "value": True}],
+        "conclusion": [{"topic": "things/fan", "messageType": "setProperty",
+                        "data": {"on": True}}],
+    }
+
+
+async def bench_sqlite(directory, size):
+    db = SQLiteDatabase(f"{directory}/sqlite-{size}.db")
+    table = db.table("rules")
+    ids = []
+    for _ in range(size):
+        rule = make_rule()
+        ids.append(rule["id"])
+        await table.insert(rule)
+    await table.flush()
+
+    results = {}
+    start = time.perf_counter()
+    for i in range(OPS):
+        await table.get(ids[i * 7 % size])
+    results["get"] = (time.perf_counter() - start) / OPS
+    start = time.perf_counter()
+    for i in range(OPS):
+        await table.update(ids[i * 11 % size], {"enabled": False})
+    results["update"] = (time.perf_counter() - start) / OPS
+    start = time.perf_counter()
+    for _ in range(OPS):
+        await table.insert(make_rule())
+    results["insert"] = (time.perf_counter() - start) / OPS
+    await db.close()
+    return results
+
+
+def bench_tinydb(directory, size):
+    table = TinyDB(f"{directory}/tinydb-{size}.json").table("rules")
+    rules = [make_rule() for _ in range(size)]
+    table.insert_multiple(rules)
+    ids = [rule["id"] for rule in rules]
+
+    results = {}
+    start = time.perf_counter()
+    for i in range(OPS):
+        table.get(Query().id == ids[i * 7 % size])
+    results["get"] = (time.perf_counter() - start) / OPS
+    start = time.perf_counter()
+    for i in range(OPS):
+        table.update({"enabled": False}, Query().id == ids[i * 11 % size])
+    results["update"] = (time.perf_counter() - start) / OPS
+    start = time.perf_counter()
+    for _ in range(OPS):
+        table.insert(make_rule())
+    results["insert"] = (time.perf_counter() - start) / OPS
+    return results
+
+
+def show(name, size, results):
+    print(f"{name:>8} {size:>7} " + " ".join(
+        f"{results[op] * 1e6:>10.1f}" for op in ("get", "update", "insert")))
+
+
+async def main():
+    print(f"{'store':>8} {'rows':>7} {'get µs':>10} {'update µs':>10} {'insert µs':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in SIZES:
+            show("sqlite", size, await bench_sqlite(directory, size))
+        if TinyDB is not None:
+            for size in SIZES:
+                if size <= TINYDB_MAX_SIZE:
+                    show("tinydb", size, bench_tinydb(directory, size))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
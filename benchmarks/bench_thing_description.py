@@ -0,0 +1,93 @@
+"""
+Benchmark GET /things with 2,000 lamps.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_thing_description
+
+Compares a full 200 response, which layers the host fields onto every
+cached description and serializes them, with a 304 for a client that
+sends the last ETag back. The first request builds the caches.
+"""
+
+import time
+
+from fastapi.testclient import TestClient
+from loguru import logger
+
+from thingtalk import Action, Event, Property, Thing, Value
+from thingtalk.app import ThingTalk
+
+THINGS = 2_000
+ROUNDS = 20
+
+
+class Fade(Action):
+    title = "fade"
+    schema = {
+        "title": "Fade",
+        "input": {
+            "type": "object",
+            "properties": {
+                "brightness": {"type": "integer", "minimum": 0, "maximum": 100},
+                "duration": {"type": "integer", "minimum": 1},
+            },
+        },
+    }
+
+
+class Overheated(Event):
+    title = "overheated"
+    schema = {"type": "number", "unit": "degree celsius"}
+
+
+class Lamp(Thing):
+    type_alias = ["OnOffSwitch", "Light"]
+
+    def __init__(self, index):
+        super().__init__(f"urn:dev:ops:lamp-{index}", f"Lamp {index}")
+        self.add_property(Property("on", Value(True), metadata={
+            "@type": "OnOffProperty", "title": "On/Off", "type": "boolean",
+        }))
+        self.add_property(Property("brightness", Value(50), metadata={
+            "@type": "BrightnessProperty", "title": "Brightness", "type": "integer",
+            "minimum": 0, "maximum": 100, "unit": "percent",
+        }))
+        self.add_available_action(Fade)
+        self.add_available_event(Overheated)
+        self.href_prefix = f"/things/{self.id}"
+
+
+def timed(client, headers=None):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        response = client.get("/things", headers=headers or {})
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, response
+
+
+def main():
+    logger.remove()
+    servient = ThingTalk()
+    for index in range(THINGS):
+        lamp = Lamp(index)
+        servient.app.state.things.things[lamp.id] = lamp
+    client = TestClient(servient.app)
+
+    start = time.perf_counter()
+    response = client.get("/things")
+    cold = (time.perf_counter() - start) * 1000
+    etag = response.headers["etag"]
+
+    full, response = timed(client)
+    cached, response = timed(client, {"If-None-Match": etag})
+    assert response.status_code == 304
+
+    print(f"{'first request':<20} {cold:8.1f} ms")
+    print(f"{'200 from cache':<20} {full:8.1f} ms")
+    print(f"{'304':<20} {cached:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark the memory of a fleet of identical things.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_thing_memory
+
+Creates 10,000 bulbs of the same class, the way a Zigbee gateway pairs
+hundreds of one model, then renders every property description once, as
+serving their Thing Descriptions does. Reports the growth of the resident
+set size after each step.
+"""
+
+import gc
+import os
+
+from loguru import logger
+
+from thingtalk import Action, Event, Property, Thing, Value
+
+THINGS = 10_000
+
+
+def rss() -> int:
+    """Get the resident set size in bytes."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class Fade(Action):
+    title = "fade"
+    schema = {
+        "title": "Fade",
+        "description": "Fade the lamp to a given level",
+        "input": {
+            "type": "object",
+            "required": ["brightness", "duration"],
+            "properties": {
+                "brightness": {"type": "integer", "minimum": 0, "maximum": 100, "unit": "percent"},
+                "duration": {"type": "integer", "minimum": 1, "unit": "milliseconds"},
+            },
+        },
+    }
+
+
+class Overheated(Event):
+    title = "overheated"
+    schema = {
+        "description": "The lamp has exceeded its safe operating temperature",
+        "type": "number",
+        "unit": "degree celsius",
+    }
+
+
+class Bulb(Thing):
+    type_alias = ["OnOffSwitch", "Light"]
+    description = "A Zigbee bulb"
+
+    def __init__(self, index):
+        super().__init__(f"urn:zigbee:bulb-{index:05}", f"Bulb {index}")
+        self.add_property(Property("on", Value(True), metadata={
+            "@type": "OnOffProperty",
+            "title": "On/Off",
+            "type": "boolean",
+            "description": "Whether the lamp is turned on",
+        }))
+        self.add_property(Property("brightness", Value(50), metadata={
+            "@type": "BrightnessProperty",
+            "title": "Brightness",
+            "type": "integer",
+            "description": "The level of light from 0-100",
+            "minimum": 0,
+            "maximum": 100,
+            "unit": "percent",
+        }))
+        self.add_property(Property("color_temp", Value(370), metadata={
+            "@type": "ColorTemperatureProperty",
+            "title": "Color temperature",
+            "type": "integer",
+            "description": "The color temperature in mired",
+            "minimum": 153,
+            "maximum": 500,
+            "unit": "mired",
+        }))
+        self.add_available_action(Fade)
+        self.add_available_event(Overheated)
+        self.href_prefix = f"/things/{self.id}"
+
+
+def main():
+    logger.remove()
+    gc.collect()
+    start = rss()
+    things = [Bulb(index) for index in range(THINGS)]
+    gc.collect()
+    created = rss()
+    for thing in things:
+        thing.get_property_descriptions()
+    gc.collect()
+    described = rss()
+
+    print(f"{'created':<24} {(created - start) / 2 ** 20:7.1f} MiB  "
+          f"{(created - start) / THINGS:7.0f} B per thing")
+    print(f"{'descriptions rendered':<24} {(described - start) / 2 ** 20:7.1f} MiB  "
+          f"{(described - start) / THINGS:7.0f} B per thing")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark the fan-out of a high rate property with and without a throttle.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_throttle
+
+Meters report their power 10 times per second. The rule engine stand-in
+listens on things/{id}/samples and sees every report either way, the
+websocket stand-ins listen on things/+/state and, with a 2 Hz throttle,
+only encode and send a fifth of them.
+"""
+
+import asyncio
+import time
+
+from loguru import logger
+
+from thingtalk.models.property import Property
+from thingtalk.models.thing import Thing
+from thingtalk.models.value import Value
+from thingtalk.toolkits.event_bus import ee
+
+METERS = 200
+SOCKETS = 20
+RATE = 10
+SECONDS = 2.0
+
+
+class Meter(Thing):
+    pass
+
+
+async def run(state_throttle) -> dict:
+    Meter.state_throttle = state_throttle
+    meters = [Meter(f"urn:bench:meter-{i}", f"meter {i}") for i in range(METERS)]
+    for meter in meters:
+        meter.add_property(Property("power", Value(0.0), metadata={"type": "number"}))
+
+    counts = {"samples": 0, "sent": 0}
+
+    def rules(message):
+        counts["samples"] += 1
+
+    def socket(message):
+        message.encode()
+        counts["sent"] += 1
+
+    subscriptions = [ee.subscribe("things/+/samples", rules)]
+    subscriptions += [ee.subscribe("things/+/state", lambda m, s=socket: s(m)) for _ in range(SOCKETS)]
+
+    cpu = time.process_time()
+    started = time.perf_counter()
+    tick = 0
+    while time.perf_counter() - started < SECONDS:
+        tick += 1
+        for meter in meters:
+            await meter.sync_property("power", float(tick))
+        await asyncio.sleep(1 / RATE)
+    for meter in meters:
+        meter.flush_throttles()
+    cpu = time.process_time() - cpu
+
+    for subscription in subscriptions:
+        ee.unsubscribe(subscription)
+    for meter in meters:
+        await meter.remove_listener()
+    return {"samples": counts["samples"], "sent": counts["sent"], "cpu": cpu}
+
+
+async def main():
+    logger.remove()
+    print(f"{METERS} meters at {RATE} Hz for {SECONDS:.0f} s, {SOCKETS} sockets")
+    print(f"{'state topic':>14} {'rule samples':>13} {'socket sends':>13} {'cpu s':>7}")
+    for label, spec in (("every update", None), ("throttled 2 Hz", 0.5)):
+        result = await run(spec)
+        print(f"{label:>14} {result['samples']:>13} {result['sent']:>13} {result['cpu']:>7.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
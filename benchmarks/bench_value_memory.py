@@ -0,0 +1,62 @@
+"""
+Benchmark the memory of property values.
+
+Run from the repository root (needs pyee, a dev dependency):
+
+    python -m benchmarks.bench_value_memory
+
+Allocates 50,000 values, as on a gateway with 5,000 things of 10
+properties, and reports the bytes per value for the former pyee
+AsyncIOEventEmitter based Value and the slotted Value, with and without
+an observer.
+"""
+
+import gc
+import tracemalloc
+
+from pyee.asyncio import AsyncIOEventEmitter
+
+from thingtalk.models.value import Value
+
+VALUES = 50_000
+
+
+class EmitterValue(AsyncIOEventEmitter):
+    """The former Value, an event emitter per instance."""
+
+    def __init__(self, initial_value, value_forwarder=None):
+        AsyncIOEventEmitter.__init__(self)
+        self.last_value = initial_value
+        self.value_forwarder = value_forwarder
+
+
+def observer(value):
+    pass
+
+
+def per_value(cls, observed):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    values = [cls(index) for index in range(VALUES)]
+    if observed:
+        for value in values:
+            value.on("update", observer)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del values
+    # includes the list slot and the int, the same for both
+    return used / VALUES
+
+
+def main():
+    for observed in (False, True):
+        label = "observed" if observed else "unobserved"
+        before = per_value(EmitterValue, observed)
+        after = per_value(Value, observed)
+        print(f"{label:<12} pyee {before:6.0f} B   slotted {after:6.0f} B   "
+              f"{VALUES * (before - after) / 2 ** 20:5.1f} MiB saved per {VALUES}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ from thingtalk import background_thread_loop, Value, Thing, Property, Event, Act
 from starlette.middleware.cors import CORSMiddleware
 
 # import logging
-import time
+import asyncio
 import httpx
 
 
@@ -17,7 +17,7 @@ class Request(Action):
     title = "request"
 
     async def perform_action(self):
-        time.sleep(self._input["duration"] / 1000)
+        await asyncio.sleep(self._input["duration"] / 1000)
         await self._thing.set_property("brightness", self._input["brightness"])
         await self._thing.add_event(OverheatedEvent(self._thing, 102))
 
@@ -1,7 +1,7 @@
 from ..thingtalk import Value, Thing, Property, Event, Action
 from ..thingtalk.app import ThingTalk
 
-import time
+import asyncio
 
 
 class OverheatedEvent(Event):
@@ -38,7 +38,7 @@ class Fade(Action):
     }
 
     async def perform_action(self):
-        time.sleep(self.input["duration"] / 1000)
+        await asyncio.sleep(self.input["duration"] / 1000)
         await self._thing.set_property("brightness", self.input["brightness"])
         await self._thing.add_event(OverheatedEvent(102))
 
@@ -0,0 +1,82 @@
+import pytest
+
+from ..thingtalk.models.action import Action, ActionStore
+
+
+class Fade(Action):
+    title = "fade"
+
+
+class Blink(Action):
+    title = "blink"
+
+
+class Broken(Action):
+    title = "broken"
+
+    async def perform_action(self):
+        raise IOError("device offline")
+
+
+class FakeThing:
+    id = "urn:test:fake"
+
+    def __init__(self, **kwargs):
+        self.actions = ActionStore(**kwargs)
+        self.notified = []
+
+    async def action_notify(self, action):
+        self.notified.append(action.status)
+
+
+def test_action_ids_are_unique():
+    assert Fade(None, None).id != Fade(None, None).id
+
+
+@pytest.mark.asyncio
+async def test_action_store_collects_completed():
+    thing = FakeThing(max_completed=2)
+    actions = [Fade(thing, None) for _ in range(4)]
+    for action in actions:
+        thing.actions.add(action)
+    pending = Blink(thing, None)
+    thing.actions.add(pending)
+
+    assert thing.actions.get("fade", actions[2].id) is actions[2]
+    assert thing.actions.query(limit=2, offset=3) == [actions[3], pending]
+
+    for action in actions:
+        await action.finish()
+    assert thing.actions.query() == [actions[2], actions[3], pending]
+    assert thing.actions.get("fade", actions[0].id) is None
+
+    assert thing.actions.remove("blink", pending.id) is pending
+    assert thing.actions.remove("blink", pending.id) is None
+    assert len(thing.actions) == 2
+
+
+@pytest.mark.asyncio
+async def test_action_store_max_age():
+    thing = FakeThing(max_completed=None, max_age=0)
+    action = Fade(thing, None)
+    thing.actions.add(action)
+    assert len(thing.actions) == 1
+    await action.finish()
+    assert len(thing.actions) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_action_is_finished():
+    thing = FakeThing(max_completed=1)
+    failed = Broken(thing, None)
+    thing.actions.add(failed)
+    await failed.start()
+    assert failed.status == "error"
+    assert failed.time_completed is not None
+    assert thing.notified == ["pending", "error"]
+
+    # collected like a completed action
+    done = Fade(thing, None)
+    thing.actions.add(done)
+    await done.start()
+    assert thing.actions.query() == [done]
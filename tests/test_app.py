@@ -0,0 +1,42 @@
+from fastapi.testclient import TestClient
+
+from ..thingtalk.app import ThingTalk
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.thing import Thing
+from ..thingtalk.models.value import Value
+from ..thingtalk.toolkits import executor
+from ..thingtalk.toolkits.event_bus import ee
+from ..thingtalk.toolkits.history import History
+from ..thingtalk.toolkits.snapshot import read_state
+
+
+def test_server_thing_goes_through_the_add_hooks(tmp_path, monkeypatch):
+    monkeypatch.setattr(ThingTalk, "register_mdns", lambda self: None)
+    watched = []
+    monkeypatch.setattr(History, "watch", lambda self, thing: watched.append(thing.id))
+    path = tmp_path / "state.jsonl"
+    path.write_text('{"urn:thingtalk:server": {"state": "OFF"}}\n')
+    servient = ThingTalk(state_path=str(path), history_path=str(tmp_path / "history"))
+    server = servient.app.state.things.server
+    assert watched == [server.id]
+
+    with TestClient(servient.app) as client:
+        assert client.portal.call(server.get_property, "state") == "OFF"
+        assert client.get("/things/urn:thingtalk:server").json()["id"] == "urn:thingtalk:server"
+
+
+def test_shutdown_stops_the_pool_last(tmp_path, monkeypatch):
+    monkeypatch.setattr(ThingTalk, "register_mdns", lambda self: None)
+    path = str(tmp_path / "state.jsonl")
+    servient = ThingTalk(state_path=path)
+    thing = Thing("urn:test:lamp", "lamp")
+    thing.add_property(Property("on", Value(False), metadata={"type": "boolean"}))
+
+    with TestClient(servient.app) as client:
+        client.portal.call(servient.app.state.things.add_thing, thing)
+        client.portal.call(thing.set_property, "on", True)
+
+    # the snapshot wrote its final state through the pool, then it stopped
+    assert read_state(path)["urn:test:lamp"] == {"on": True}
+    assert executor._executor is None
+    assert servient.app.state.things.handle_broadcast not in ee.listeners("broadcast/#")
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from ..thingtalk.domains.iot import Device
+from ..thingtalk.models.containers import MultipleThings
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.value import Value
+from ..thingtalk.schema import IntermediateMsg
+from ..thingtalk.toolkits.event_bus import ee
+
+
+class Bulb(Device):
+    type_alias = ["OnOffSwitch", "Light"]
+
+    def __init__(self, id_):
+        super().__init__(id_, id_)
+        self.add_property(Property("on", Value(True), metadata={"type": "boolean"}))
+
+
+class Plug(Device):
+    type_alias = ["OnOffSwitch"]
+
+    def __init__(self, id_):
+        super().__init__(id_, id_)
+        self.add_property(Property("on", Value(True), metadata={"type": "boolean"}))
+
+
+@pytest.mark.asyncio
+async def test_indexes_and_broadcast():
+    container = MultipleThings({}, "test", broadcast_concurrency=2)
+    bulbs = [Bulb(f"urn:test:bulb-{i}") for i in range(5)]
+    plug = Plug("urn:test:plug")
+    for thing in [*bulbs, plug]:
+        await container.add_thing(thing)
+
+    assert set(container.select(type_="OnOffSwitch")) == {*bulbs, plug}
+    assert set(container.select(group="light")) == set(bulbs)
+    assert container.select(group="switch") == [plug]
+    assert set(container.select(capability="on", type_="Light")) == set(bulbs)
+
+    container.add_group(plug.id, "kitchen")
+    container.add_group(bulbs[0].id, "kitchen")
+    assert set(container.select(group="kitchen")) == {plug, bulbs[0]}
+    container.remove_group(plug.id, "kitchen")
+    assert container.select(group="kitchen") == [bulbs[0]]
+
+    message = IntermediateMsg(topic="broadcast/light", messageType="setProperty", data={"on": False})
+    await container.handle_broadcast(message)
+    assert [await bulb.get_property("on") for bulb in bulbs] == [False] * 5
+    assert await plug.get_property("on") is True
+
+    message = IntermediateMsg(topic="broadcast/type/OnOffSwitch", messageType="setProperty", data={"on": False})
+    ee.emit(message.topic, message)
+    await asyncio.sleep(0.01)
+    assert await plug.get_property("on") is False
+
+    container.close()
+
+
+@pytest.mark.asyncio
+async def test_get_things_sorted():
+    container = MultipleThings({}, "test")
+    for thing_id in ("urn:test:c", "urn:test:a"):
+        await container.add_thing(Plug(thing_id))
+    assert [thing_id for thing_id, _ in await container.get_things()] == ["urn:test:a", "urn:test:c"]
+    # the sorted ids are kept until the next change
+    await container.add_thing(Plug("urn:test:b"))
+    assert [thing_id for thing_id, _ in await container.get_things(cursor="urn:test:a")] == ["urn:test:b", "urn:test:c"]
+    container.close()
+
+
+@pytest.mark.asyncio
+async def test_sorted_ids_follow_direct_changes():
+    container = MultipleThings({}, "test")
+    for thing_id in ("urn:test:a", "urn:test:b"):
+        await container.add_thing(Plug(thing_id))
+    assert [thing_id for thing_id, _ in await container.get_things()] == ["urn:test:a", "urn:test:b"]
+    # same length, different ids
+    del container.things["urn:test:b"]
+    container.things["urn:test:c"] = Plug("urn:test:c")
+    assert [thing_id for thing_id, _ in await container.get_things()] == ["urn:test:a", "urn:test:c"]
+    container.close()
+
+
+def test_close_unsubscribes_the_broadcast_listener():
+    before = len(ee.listeners("broadcast/#"))
+    containers = [MultipleThings({}, "test") for _ in range(5)]
+    assert len(ee.listeners("broadcast/#")) == before + 5
+    for container in containers:
+        container.close()
+    container.close()
+    assert len(ee.listeners("broadcast/#")) == before
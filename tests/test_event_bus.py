@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from ..thingtalk.toolkits.event_bus import EventBus
+
+
+def test_wildcard_match():
+    bus = EventBus()
+    received = []
+
+    def listener(name):
+        return lambda msg: received.append((name, msg))
+
+    exact = bus.on("things/lamp/state", listener("exact"))
+    bus.on("things/+/state", listener("single"))
+    bus.on("things/#", listener("multi"))
+    bus.on("things/lamp/+", listener("any"))
+
+    assert bus.emit("things/lamp/state", 1)
+    assert sorted(name for name, _ in received) == ["any", "exact", "multi", "single"]
+
+    received.clear()
+    assert bus.emit("things/sensor/event", 2)
+    assert [name for name, _ in received] == ["multi"]
+
+    received.clear()
+    assert bus.emit("things", 3)
+    assert [name for name, _ in received] == ["multi"]
+
+    received.clear()
+    assert not bus.emit("scenes/1/state", 4)
+    assert bus.listeners("things/lamp/state") == [exact]
+
+
+def test_subscribe_is_idempotent_and_unsubscribe_prunes():
+    bus = EventBus()
+    calls = []
+    listener = calls.append
+
+    first = bus.subscribe("things/lamp/+", listener)
+    assert bus.subscribe("things/lamp/+", listener) is first
+    bus.emit("things/lamp/state", 1)
+    assert calls == [1]
+
+    assert bus.unsubscribe(first)
+    assert not bus.unsubscribe(first)
+    assert not bus.emit("things/lamp/state", 2)
+    assert bus._root.children == {}
+
+    bus.on("things/lamp/state", listener)
+    bus.remove_listener("things/lamp/state", listener)
+    bus.remove_listener("things/lamp/state", listener)
+    assert bus.listeners("things/lamp/state") == []
+
+
+@pytest.mark.asyncio
+async def test_coroutine_listener():
+    bus = EventBus()
+    received = []
+
+    @bus.on("things/+/state")
+    async def handle(msg):
+        received.append(msg)
+
+    bus.emit("things/lamp/state", "on")
+    assert received == []
+    await asyncio.sleep(0)
+    assert received == ["on"]
+
+
+def test_emit_without_topic():
+    bus = EventBus()
+    calls = []
+    bus.on("#", calls.append)
+    assert not bus.emit(None, 1)
+    assert not bus.emit("", 2)
+    assert bus.match(None) == []
+    assert calls == []
+
+
+def test_emit_count():
+    bus = EventBus()
+    bus.emit("things/lamp/state", 1)
+    assert bus.emitted == {}
+
+    bus.count_emits = True
+    bus.max_counted_topics = 2
+    for thing_id in ("lamp", "plug"):
+        bus.emit(f"things/{thing_id}/state", 1)
+    bus.emit("things/lamp/event", 1)
+    bus.emit("made/up/by/a/client", 1)
+    assert bus.emitted == {"things/+/state": 2, "things/+/event": 1, "other": 1}
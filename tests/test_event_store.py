@@ -0,0 +1,48 @@
+from ..thingtalk.models.event import Event, EventStore
+
+
+class Overheated(Event):
+    title = "overheated"
+
+
+class Opened(Event):
+    title = "opened"
+
+
+def make(cls, epoch):
+    event = cls(data=epoch)
+    event._epoch = epoch
+    return event
+
+
+def test_event_store_query():
+    store = EventStore()
+    for epoch in range(10):
+        store.append(make(Overheated if epoch % 2 else Opened, float(epoch)))
+
+    assert [e.data for e in store] == [float(i) for i in range(10)]
+    assert [e.data for e in store.query(name="overheated")] == [1.0, 3.0, 5.0, 7.0, 9.0]
+    assert [e.data for e in store.query(since=6.0)] == [6.0, 7.0, 8.0, 9.0]
+    assert [e.data for e in store.query(limit=3)] == [7.0, 8.0, 9.0]
+    assert [e.data for e in store.query(name="opened", since=3.0, limit=2)] == [6.0, 8.0]
+    assert store.query(name="missing") == []
+
+
+def test_event_store_bounds():
+    store = EventStore(max_events=5, max_events_per_name=2)
+    for epoch in range(6):
+        store.append(make(Overheated, float(epoch)))
+    store.append(make(Opened, 6.0))
+    assert [e.data for e in store] == [4.0, 5.0, 6.0]
+
+    for epoch in range(7, 10):
+        store.append(make(Opened, float(epoch)))
+    assert len(store) == 4
+    assert [e.data for e in store] == [4.0, 5.0, 8.0, 9.0]
+
+
+def test_event_store_max_age():
+    store = EventStore(max_age=60)
+    store.append(make(Overheated, 0.0))
+    store.append(Overheated())
+    assert len(store) == 1
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ..thingtalk.models.action import Action
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.thing import Thing
+from ..thingtalk.models.value import Value
+from ..thingtalk.toolkits.executor import run_blocking
+
+
+@pytest.mark.asyncio
+async def test_forwarders():
+    loop_thread = threading.get_ident()
+    awaited, written = [], []
+
+    async def forward(value):
+        awaited.append((value, threading.get_ident()))
+
+    def write(value):
+        time.sleep(0.01 * (3 - value))
+        written.append((value, threading.get_ident()))
+
+    value = Value(0, forward)
+    await value.set(1)
+    assert awaited == [(1, loop_thread)]
+
+    thing = Thing("urn:test:driver", "driver")
+    thing.add_property(Property("level", Value(0, write), metadata={"type": "integer"}))
+    prop = thing.find_property("level")
+    await asyncio.gather(*(prop.set_value(level) for level in (1, 2, 3)))
+    # the first write sleeps longest, the others still wait for it
+    assert [level for level, _ in written] == [1, 2, 3]
+    assert all(thread != loop_thread for _, thread in written)
+    assert await thing.get_property("level") == 3
+
+
+@pytest.mark.asyncio
+async def test_blocking_keeps_the_loop_running():
+    ticks = []
+
+    async def tick():
+        for _ in range(5):
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    started = time.perf_counter()
+    await asyncio.gather(tick(), run_blocking(time.sleep, 0.1))
+    assert len(ticks) == 5
+    assert ticks[-1] - started < 0.1
+
+
+class Calibrate(Action):
+    title = "calibrate"
+    blocking = True
+
+    def perform_action(self):
+        time.sleep(0.01)
+        self.meta = threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_blocking_action():
+    thing = Thing("urn:test:calibrated", "calibrated")
+    thing.add_available_action(Calibrate)
+    action = await thing.perform_action("calibrate", None)
+    await action.start()
+    assert action.status == "completed"
+    assert action.meta != threading.get_ident()
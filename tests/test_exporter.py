@@ -0,0 +1,62 @@
+import pytest
+
+from ..thingtalk.models.containers import SingleThing
+from ..thingtalk.models.event import Event
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.thing import Thing
+from ..thingtalk.models.value import Value
+from ..thingtalk.toolkits.exporter import MqttExporter
+
+
+class FakePublisher:
+    def __init__(self):
+        self.messages = []
+
+    def put(self, topic, payload, qos=0, retain=False, coalesce=False):
+        self.messages.append((topic, payload, retain))
+
+
+class FakeMqtt:
+    def __init__(self):
+        self.publisher = FakePublisher()
+
+
+class Overheated(Event):
+    title = "overheated"
+    schema = {"type": "number"}
+
+
+@pytest.mark.asyncio
+async def test_exporter_mirrors_changes():
+    thing = Thing("urn:test:exported", "exported")
+    thing.add_property(Property("on", Value(True), metadata={"type": "boolean"}))
+    thing.add_property(Property("level", Value(1), metadata={"type": "integer"}))
+    thing.add_available_event(Overheated)
+    mqtt = FakeMqtt()
+    exporter = MqttExporter(mqtt, SingleThing(thing), interval=60)
+
+    await exporter.start()
+    try:
+        exporter.flush()
+        assert mqtt.publisher.messages == [
+            ("things/urn:test:exported/properties/on", b"true", True),
+            ("things/urn:test:exported/properties/level", b"1", True),
+        ]
+        mqtt.publisher.messages.clear()
+
+        for level in (2, 3, 1):
+            await thing.set_property("level", level)
+        await thing.set_property("on", False)
+        exporter.flush()
+        # the level is back where it was, only the switch changed
+        assert mqtt.publisher.messages == [("things/urn:test:exported/properties/on", b"false", True)]
+        mqtt.publisher.messages.clear()
+
+        await thing.add_event(Overheated(102))
+        [(topic, payload, retain)] = mqtt.publisher.messages
+        assert topic == "things/urn:test:exported/events/overheated"
+        assert b'"data":102' in payload and not retain
+    finally:
+        await exporter.stop()
+        await thing.remove_listener()
+    assert exporter.unchanged == 1
@@ -0,0 +1,146 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from ..thingtalk.app import ThingTalk
+from ..thingtalk.models.containers import MultipleThings
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.thing import Server, Thing
+from ..thingtalk.models.value import Value
+from ..thingtalk.toolkits.history import History, Series, aggregate
+
+
+def test_aggregate_buckets():
+    timestamps = [float(t) for t in range(10)]
+    values = [float(t) for t in range(10)]
+    # split in two blocks, the second bucket spans both
+    blocks = [(timestamps[:5], values[:5]), (timestamps[5:], values[5:])]
+    assert aggregate(blocks, 2, 9, 3) == {
+        "t": [2, 5, 8],
+        "min": [2, 5, 8],
+        "max": [4, 7, 8],
+        "avg": [3, 6, 8],
+        "count": [3, 3, 1],
+    }
+
+
+@pytest.mark.asyncio
+async def test_series_segments_and_retention(tmp_path):
+    series = Series(str(tmp_path), capacity=4, max_bytes=3 * (16 + 16 * 4))
+    for t in range(20):
+        series.append(1000.0 + t, t)
+    # the oldest segments were dropped, the newest is still mapped
+    assert len(series.segments) == 3
+    assert len(os.listdir(tmp_path)) == 3
+    result = await series.query(1000, 1020, 10)
+    # samples 8 to 19 are left
+    assert result["t"] == [1000, 1010]
+    assert result["count"] == [2, 10]
+    assert result["min"] == [8, 10] and result["max"] == [9, 19]
+    series.close()
+
+    # reopened, appending goes on in the last segment
+    series = Series(str(tmp_path), capacity=4, max_age=5)
+    series.append(1020.0, 20)
+    series.prune(1025)
+    assert [segment.first for segment in series.segments] == [1020]
+    result = await series.query(1000, 1030, 30)
+    assert result["count"] == [1] and result["avg"] == [20]
+    series.close()
+
+
+@pytest.mark.asyncio
+async def test_history_records_properties(tmp_path):
+    thing = Thing("urn:test:meter", "meter")
+    thing.add_property(Property("power", Value(0), metadata={"type": "number", "history": True}))
+    thing.add_property(Property("on", Value(False), metadata={"type": "boolean"}))
+    things = MultipleThings({}, "things")
+    history = History(str(tmp_path), things)
+    things.add_hooks.append(history.watch)
+    await history.start()
+    try:
+        await things.add_thing(thing)
+        assert history.get_series(thing.id, "on") is None
+        for power in (10, 30, 20):
+            await thing.set_property("power", power)
+        await thing.bulk_sync_property({"power": 40})
+        result = await history.get_series(thing.id, "power").query(0, 2 ** 32, 2 ** 32)
+        assert result["min"] == [10] and result["max"] == [40] and result["avg"] == [25]
+    finally:
+        await history.stop()
+
+
+@pytest.mark.asyncio
+async def test_history_skips_non_finite_values(tmp_path):
+    series = Series(str(tmp_path))
+    for value in (1.0, float("nan"), float("inf"), float("-inf"), 3.0):
+        series.record(value)
+    result = await series.query(0, 2 ** 32, 2 ** 32)
+    assert result["count"] == [2] and result["avg"] == [2]
+    series.close()
+
+
+@pytest.mark.asyncio
+async def test_removed_things_are_no_longer_recorded(tmp_path):
+    server = Server()
+    things = MultipleThings({server.id: server}, "things")
+    history = History(str(tmp_path), things)
+    things.add_hooks.append(history.watch)
+    things.remove_hooks.append(history.unwatch)
+    thing = Thing("urn:test:meter", "meter")
+    thing.add_property(Property("power", Value(0), metadata={"type": "number", "history": True}))
+    await things.add_thing(thing)
+    await thing.set_property("power", 1)
+    series = history.get_series(thing.id, "power")
+    assert series.segments[-1].mapped
+
+    await things.remove_thing(thing.id)
+    assert history.get_series(thing.id, "power") is None
+    assert not history._mapped
+    assert not series.segments[-1].mapped
+    assert not thing.properties["power"].value.listeners("update")
+    await history.stop()
+    things.close()
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="counts descriptors in /proc")
+@pytest.mark.asyncio
+async def test_history_bounds_mapped_series(tmp_path):
+    things = MultipleThings({}, "things")
+    history = History(str(tmp_path), things, max_mapped=2)
+    meters = []
+    for index in range(4):
+        thing = Thing(f"urn:test:meter-{index}", "meter")
+        thing.add_property(Property("power", Value(0), metadata={"type": "number", "history": True}))
+        history.watch(thing)
+        meters.append(thing)
+
+    descriptors = len(os.listdir("/proc/self/fd"))
+    for power in (1, 2):
+        for thing in meters:
+            await thing.set_property("power", power)
+    mapped = [series for series in history.series.values() if series.segments[-1].mapped]
+    assert len(mapped) == 2
+    # one descriptor per mapped series, the file is closed after mapping
+    assert len(os.listdir("/proc/self/fd")) - descriptors <= 2
+
+    # unmapped series still answer queries and take samples
+    result = await history.get_series(meters[0].id, "power").query(0, 2 ** 32, 2 ** 32)
+    assert result["count"] == [2]
+    await history.stop()
+
+
+def test_history_endpoint_rejects_non_finite_bounds(tmp_path, monkeypatch):
+    monkeypatch.setattr(ThingTalk, "register_mdns", lambda self: None)
+    servient = ThingTalk(history_path=str(tmp_path))
+    thing = Thing("urn:test:meter", "meter")
+    thing.add_property(Property("power", Value(0), metadata={"type": "number", "history": True}))
+    href = f"/things/{thing.id}/properties/power/history"
+
+    with TestClient(servient.app) as client:
+        client.portal.call(servient.app.state.things.add_thing, thing)
+        client.portal.call(thing.set_property, "power", 5)
+        assert client.get(href).json()["max"] == [5]
+        for params in ({"from": "nan"}, {"to": "inf"}, {"step": "nan"}, {"from": 0, "to": 10, "step": "-inf"}):
+            assert client.get(href, params=params).status_code == 400, params
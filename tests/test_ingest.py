@@ -0,0 +1,59 @@
+import pytest
+
+from ..thingtalk.models.containers import MultipleThings
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.thing import Thing
+from ..thingtalk.models.value import Value
+from ..thingtalk.toolkits.event_bus import ee
+from ..thingtalk.toolkits.ingest import Ingest
+
+
+def sensor(thing_id):
+    thing = Thing(thing_id, thing_id)
+    thing.add_property(Property("temperature", Value(0.0), metadata={"type": "number"}))
+    thing.add_property(Property("humidity", Value(0.0), metadata={"type": "number"}))
+    return thing
+
+
+def test_routes():
+    ingest = Ingest(None, {
+        "zigbee2mqtt/{name}": "urn:z2m:{name}",
+        "homie/{id}/{property}": "urn:homie:{id}",
+        "legacy/+/dev_{n}/#": "urn:legacy:{n}",
+    })
+    assert ingest.filters == ["zigbee2mqtt/+", "homie/+/+", "legacy/+/+/#"]
+    assert ingest.resolve("zigbee2mqtt/kitchen") == ("urn:z2m:kitchen", None)
+    assert ingest.resolve("zigbee2mqtt/bridge/state") is None
+    assert ingest.resolve("homie/t1/temperature") == ("urn:homie:t1", "temperature")
+    assert ingest.resolve("legacy/x/dev_7") == ("urn:legacy:7", None)
+    assert ingest.resolve("legacy/x/dev_7/a/b") == ("urn:legacy:7", None)
+    assert ingest.resolve("legacy/x/other") is None
+
+
+@pytest.mark.asyncio
+async def test_messages_are_batched_per_thing():
+    kitchen, t1 = sensor("urn:z2m:kitchen"), sensor("urn:homie:t1")
+    things = MultipleThings({kitchen.id: kitchen, t1.id: t1}, "test")
+    ingest = Ingest(things, {
+        "zigbee2mqtt/{name}": "urn:z2m:{name}",
+        "homie/{id}/{property}": "urn:homie:{id}",
+    }, window=10)
+
+    published = []
+    ee.on("things/+/samples", published.append)
+    try:
+        assert ingest.feed("zigbee2mqtt/kitchen", b'{"temperature": 20.5, "linkquality": 90}')
+        assert ingest.feed("zigbee2mqtt/kitchen", b'{"temperature": 21.0, "humidity": 40}')
+        assert ingest.feed("homie/t1/temperature", b"18.5")
+        assert not ingest.feed("zigbee2mqtt/unknown", b"{}")
+        assert not ingest.feed("zigbee2mqtt/kitchen", b"not json")
+        await ingest.flush()
+    finally:
+        ee.remove_listener("things/+/samples", published.append)
+        things.close()
+
+    assert sorted((message.topic, message.data) for message in published) == [
+        ("things/urn:homie:t1", {"temperature": 18.5}),
+        ("things/urn:z2m:kitchen", {"temperature": 21.0, "humidity": 40}),
+    ]
+    assert ingest.stats() == {"received": 5, "dropped": 2, "batches": 1, "pending": 0}
@@ -0,0 +1,32 @@
+from ..thingtalk.toolkits.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_exposition():
+    registry = Registry()
+    emitted = Counter("emitted_total", "Emitted messages.", ("topic",), registry=registry)
+    depth = Gauge("depth", "Queue depth.", registry=registry, function=lambda: 3)
+    latency = Histogram("latency_seconds", "Latency.", registry=registry, buckets=(0.1, 1.0))
+
+    emitted.labels('things/a"b').inc()
+    emitted.labels('things/a"b').inc(2)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    assert depth.function() == 3
+    assert registry.expose() == "\n".join([
+        "# HELP emitted_total Emitted messages.",
+        "# TYPE emitted_total counter",
+        'emitted_total{topic="things/a\\"b"} 3',
+        "# HELP depth Queue depth.",
+        "# TYPE depth gauge",
+        "depth 3",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+        "",
+    ])
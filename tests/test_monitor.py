@@ -0,0 +1,74 @@
+import asyncio
+import asyncio.events
+import time
+
+import pytest
+
+from ..thingtalk.models.action import Action
+from ..thingtalk.models.thing import Thing, perform_action
+from ..thingtalk.schema import OutMsg
+from ..thingtalk.toolkits.event_bus import ee
+from ..thingtalk.toolkits.monitor import LoopMonitor
+
+
+class Stall(Action):
+    title = "stall"
+
+    async def perform_action(self):
+        await asyncio.sleep(0)
+        time.sleep(0.03)
+
+
+@pytest.mark.asyncio
+async def test_slow_callbacks_are_attributed():
+    run = asyncio.events.Handle._run
+    monitor = LoopMonitor(threshold=0.02, interval=0.01)
+    await monitor.start()
+    assert asyncio.events.Handle._run is not run
+
+    async def listener(message):
+        time.sleep(0.03)
+
+    thing = Thing("urn:test:stalling", "stalling")
+    thing.add_available_action(Stall)
+    ee.on("test/monitor", listener)
+    try:
+        ee.emit("test/monitor", OutMsg(topic="things/urn:test:stalling", messageType="event", data={}))
+        action = await thing.perform_action("stall", None)
+        await asyncio.create_task(perform_action(action))
+        await asyncio.sleep(0.05)
+    finally:
+        ee.remove_listener("test/monitor", listener)
+        await thing.remove_listener()
+        await monitor.stop()
+    assert asyncio.events.Handle._run is run
+
+    report = monitor.report()
+    assert report["lag"]["samples"] > 0
+    assert report["lag"]["max"] >= 0.02
+    slow = {record["callback"]: record for record in report["slow"]}
+    assert slow["test_slow_callbacks_are_attributed.<locals>.listener"]["topic"] == "things/urn:test:stalling"
+    assert slow["perform_action"]["action"] == "stall"
+    assert slow["perform_action"]["thing"] == "urn:test:stalling"
+    assert report["callbacks"]["test_slow_callbacks_are_attributed.<locals>.listener"]["count"] == 1
+
+
+def test_lag_only_on_uvloop():
+    uvloop = pytest.importorskip("uvloop")
+    run = asyncio.events.Handle._run
+
+    async def main():
+        monitor = LoopMonitor(threshold=0.02, interval=0.01)
+        await monitor.start()
+        assert asyncio.events.Handle._run is run
+        await asyncio.sleep(0.03)
+        await monitor.stop()
+        return monitor.report()
+
+    loop = uvloop.new_event_loop()
+    try:
+        report = loop.run_until_complete(main())
+    finally:
+        loop.close()
+    assert report["timing"] is False
+    assert report["lag"]["samples"] > 0
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from ..thingtalk.toolkits.mqtt import Publisher, Spool, OutgoingMessage
+
+
+class FakeClient:
+    """Records what would go to the broker."""
+
+    def __init__(self, topic_alias_maximum=0):
+        self.properties = {"topic_alias_maximum": [topic_alias_maximum]}
+        self.published = []
+
+    def publish(self, topic, payload, qos=0, retain=False, **properties):
+        self.published.append((topic, payload, qos, properties.get("topic_alias")))
+
+
+@pytest.mark.asyncio
+async def test_coalesce_and_aliases():
+    client = FakeClient(topic_alias_maximum=2)
+    publisher = Publisher(client)
+    for brightness in range(5):
+        publisher.put("things/lamp/brightness", brightness, coalesce=True)
+    publisher.put("things/lamp/event", {"overheated": 102})
+    publisher.put("things/lamp/event", {"overheated": 103})
+    publisher.start()
+    publisher.on_connect()
+    await asyncio.sleep(0.01)
+    assert client.published == [
+        ("things/lamp/brightness", b"4", 0, 1),
+        ("things/lamp/event", b'{"overheated":102}', 0, 2),
+        ("", b'{"overheated":103}', 0, 2),
+    ]
+    assert publisher.stats()["coalesced"] == 4
+
+    client.published.clear()
+    publisher.put("things/other", b"x")
+    publisher.put("things/lamp/brightness", b"5", qos=1)
+    await asyncio.sleep(0.01)
+    # the least recently used alias is taken over, QoS 1 keeps its topic
+    assert client.published == [
+        ("things/other", b"x", 0, 1),
+        ("things/lamp/brightness", b"5", 1, 2),
+    ]
+    await publisher.stop()
+
+
+@pytest.mark.asyncio
+async def test_spool_while_disconnected(tmp_path):
+    path = str(tmp_path / "spool")
+    client = FakeClient()
+    publisher = Publisher(client, rate=1000, max_pending=2, spool_path=path)
+    publisher.start()
+    for i in range(5):
+        publisher.put(f"things/t{i}", i, qos=1, user_property=("time", str(i)))
+    assert publisher.stats()["queued"] == 2
+    assert publisher.stats()["spooled"] > 0
+    await publisher.stop()
+
+    publisher = Publisher(client, rate=1000, max_pending=2, spool_path=path)
+    publisher.put("things/t5", 5)
+    publisher.start()
+    publisher.on_connect()
+    await asyncio.sleep(0.05)
+    assert [payload for _, payload, _, _ in client.published] == [b"0", b"1", b"2", b"3", b"4", b"5"]
+    assert publisher.stats()["spooled"] == 0
+    await publisher.stop()
+
+
+def test_spool_is_bounded(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), max_bytes=100)
+    message = OutgoingMessage("things/t", b"x" * 40, 1, False, {"user_property": ("time", "1")})
+    assert spool.append(message)
+    assert not spool.append(message)
+    assert spool.dropped == 1
+    restored = spool.pop()
+    assert (restored.topic, restored.payload, restored.qos) == ("things/t", b"x" * 40, 1)
+    assert restored.properties == {"user_property": ("time", "1")}
+    assert spool.pop() is None
+    spool.close()
+
+
+@pytest.mark.asyncio
+async def test_rate_limit():
+    client = FakeClient()
+    publisher = Publisher(client, rate=100)
+    publisher.start()
+    publisher.on_connect()
+    for i in range(30):
+        publisher.put(f"things/t{i}", i)
+    await asyncio.sleep(0.1)
+    assert 5 <= len(client.published) < 30
+    await publisher.stop()
+
+
+class FlakyClient(FakeClient):
+    """Refuses payloads it can't send, or fails like a lost connection."""
+
+    def __init__(self):
+        super().__init__()
+        self.error = None
+
+    def publish(self, topic, payload, qos=0, retain=False, **properties):
+        if payload == b"too large":
+            raise ValueError("Payload too large.")
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        super().publish(topic, payload, qos, retain, **properties)
+
+
+@pytest.mark.asyncio
+async def test_unsendable_message_is_dropped():
+    client = FlakyClient()
+    publisher = Publisher(client)
+    publisher.start()
+    publisher.on_connect()
+    for payload in ("too large", 1, 2):
+        publisher.put("things/lamp/state", payload)
+    await asyncio.sleep(0.01)
+    # the bad message doesn't hold up the ones behind it
+    assert [payload for _, payload, _, _ in client.published] == [b"1", b"2"]
+    assert publisher.stats()["failed"] == 1
+    assert publisher.connected
+
+    # a lost connection keeps the message for after the reconnect
+    client.error = ConnectionResetError("connection lost")
+    publisher.put("things/lamp/state", 3)
+    await asyncio.sleep(0.01)
+    assert not publisher.connected
+    publisher.on_connect()
+    await asyncio.sleep(0.01)
+    assert client.published[-1][1] == b"3"
+    await publisher.stop()
@@ -0,0 +1,22 @@
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.registry import intern_metadata
+from ..thingtalk.models.value import Value
+
+
+def test_metadata_is_shared():
+    first = Property("level", Value(1), metadata={"type": "integer", "minimum": 0})
+    second = Property("level", Value(2), metadata={"minimum": 0, "type": "integer"})
+    assert first.metadata is second.metadata
+    assert intern_metadata({"type": "integer", "minimum": 0}) is first.metadata
+
+    first.href_prefix = "/things/a"
+    assert first.description == {
+        "type": "integer",
+        "minimum": 0,
+        "links": [{"rel": "property", "href": "/things/a/properties/level", "mediaType": "application/json"}],
+    }
+    assert "links" not in second.metadata
+
+    second.metadata = {"type": "integer", "minimum": 1}
+    assert first.metadata == {"type": "integer", "minimum": 0}
+    assert second.description["minimum"] == 1
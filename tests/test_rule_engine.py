@@ -1,61 +1,124 @@
 import pytest
 
-from pydantic import ValidationError
-
-from ..thingtalk.rule_engine import (
-    RuleEngine, Rule, And, Conclusion, Question
-)
+from ..thingtalk.rule_engine import AlphaMemory, Condition, RuleEngine, Rule, And, Or
 from ..thingtalk.toolkits.event_bus import ee
 from ..thingtalk.schema import OutMsg
 
-re = RuleEngine()
+
+def make_rule(id_, premise, premise_type="Singleton", topic="things/urn:thingtalk:broadcast:light"):
+    return Rule(**{
+        "id": id_,
+        "enabled": True,
+        "name": f"rule {id_}",
+        "premise_type": premise_type,
+        "premise": premise,
+        "conclusion": [
+            {"topic": topic, "messageType": "requestAction",
+             "data": {"random_rgb": {"input": {}}}}],
+    })
+
+
+def premise(thing_id, name, op, value):
+    return {"topic": f"things/{thing_id}", "messageType": "propertyStatus",
+            "name": name, "op": op, "value": value}
+
+
+def status(thing_id, **data):
+    return OutMsg(topic=f"things/{thing_id}", messageType="propertyStatus", data=data)
+
+
+@pytest.fixture
+def fired():
+    conclusions = []
+    ee.on("things/test:conclusion", conclusions.append)
+    yield conclusions
+    ee.remove_listener("things/test:conclusion", conclusions.append)
 
 
 @pytest.mark.asyncio
 async def test_load_rule():
-    rule = {"enabled": True,
-            "name": "规则 2020/11/13 11:33",
-            "premise_type": "Singleton",
-            "premise": [
-                {"topic": "things/0x00158d0005483fc1", "messageType": "propertyStatus", "name": "action", "op": "eq",
-                 "value": "shake"}],
-            "conclusion": [
-                {"topic": "things/urn:thingtalk:broadcast:light", "messageType": "requestAction",
-                 "data": {"random_rgb": {"input": {}}}}],
-            "id": "0687b69d-ea9d-403d-87d7-7fe213ad8640"}
-
-    try:
-        rule = Rule(**rule)
-        await re.load_rule(rule)
-        assert re.question_env == {"things_0x00158d0005483fc1_action": None}
-        assert re.rule_env == {
-            "things_0x00158d0005483fc1_action_shake": {
-                "0687b69d-ea9d-403d-87d7-7fe213ad8640": And(
-                    Question(**{"things_0x00158d0005483fc1_action": {"op": "eq", "value": "shake"}}),
-                    enabled=True,
-                    conclusion=[
-                        Conclusion(**{"topic": "things/urn:thingtalk:broadcast:light", "messageType": "requestAction",
-                                      "data": {"random_rgb": {"input": {}}}})]),
-            }
-        }
-    except ValidationError as e:
-        pass
+    re = RuleEngine()
+    rule = make_rule("0687b69d", [premise("0x00158d0005483fc1", "action", "eq", "shake")])
+    await re.load_rule(rule)
+    assert re.question_env == {"things_0x00158d0005483fc1_action": None}
+    assert isinstance(re.rules["0687b69d"], And)
+    assert re.handle_status in ee.listeners("things/0x00158d0005483fc1/samples")
+
+    await re.disable_rule("0687b69d")
+    assert re.rules == {}
+    assert re.facts == {}
+    assert re.handle_status not in ee.listeners("things/0x00158d0005483fc1/samples")
+
+
+@pytest.mark.asyncio
+async def test_eq_rule_fires_once_per_report(fired):
+    re = RuleEngine()
+    await re.load_rule(make_rule("shake", [premise("button", "action", "eq", "shake")],
+                                 topic="things/test:conclusion"))
+
+    await re.handle_status(status("button", action="single"))
+    assert fired == []
+    await re.handle_status(status("button", action="shake"))
+    assert len(fired) == 1
+    # firing consumes the fact, the next report fires again
+    assert re.question_env == {"things_button_action": None}
+    await re.handle_status(status("button", action="shake"))
+    assert len(fired) == 2
+
+
+@pytest.mark.asyncio
+async def test_threshold_rules(fired):
+    re = RuleEngine()
+    await re.load_rule(make_rule("hot", [premise("sensor", "temperature", "gt", 30)],
+                                 topic="things/test:conclusion"))
+    await re.load_rule(make_rule("cold", [premise("sensor", "temperature", "lt", 10)],
+                                 topic="things/test:conclusion"))
+
+    for value, expected in [(20, 0), (30, 0), (31.5, 1), (9, 2), (10, 2), (35, 3), (35, 4)]:
+        await re.handle_status(status("sensor", temperature=value))
+        assert len(fired) == expected, value
+
+
+@pytest.mark.asyncio
+async def test_and_or_rules(fired):
+    re = RuleEngine()
+    await re.load_rule(make_rule("and", [premise("lamp", "on", "eq", True),
+                                         premise("sensor", "lux", "lt", 100)],
+                                 premise_type="And", topic="things/test:conclusion"))
+    await re.load_rule(make_rule("or", [premise("door", "contact", "eq", False),
+                                        premise("window", "contact", "eq", False)],
+                                 premise_type="Or", topic="things/test:conclusion"))
+    assert isinstance(re.rules["or"], Or)
+
+    await re.handle_status(status("sensor", lux=50))
+    assert fired == []
+    await re.handle_status(status("lamp", on=True))
+    assert len(fired) == 1
+
+    await re.handle_status(status("window", contact=False))
+    assert len(fired) == 2
+
+    re.rules["or"].enabled = False
+    await re.handle_status(status("door", contact=False))
+    assert len(fired) == 2
 
 
 @pytest.mark.asyncio
-async def test_compute_rule():
-    msg = {
-        "topic": "things/0x00158d0005483fc1",
-        "messageType": "propertyStatus",
-        "data": {
-            "action": "shake"
-        }
-    }
-    assert ee.listeners("things/0x00158d0005483fc1/state") == [re.compute_rule]
-    try:
-        msg = OutMsg(**msg)
-        ee.emit("things/0x00158d0005483fc1/state", msg)
-    except ValidationError as e:
-        pass
-    await re.compute_rule(msg)
-    assert re.question_env == {"things_0x00158d0005483fc1_action": "shake"}
+async def test_bool_facts_against_thresholds(fired):
+    memory = AlphaMemory()
+    gt = Condition("fact", "gt", 0)
+    lt = Condition("fact", "lt", 2)
+    memory.add(gt)
+    memory.add(lt)
+    # the thresholds and Condition.test agree, bools aren't numbers
+    for fact in (True, False):
+        assert memory.assign(fact) == []
+        assert not gt.test(fact) and not lt.test(fact)
+
+    re = RuleEngine()
+    await re.load_rule(make_rule("on", [premise("switch", "state", "gt", 0)],
+                                 topic="things/test:conclusion"))
+    await re.handle_status(status("switch", state=True))
+    assert fired == []
+    await re.handle_status(status("switch", state=1))
+    assert len(fired) == 1
@@ -0,0 +1,57 @@
+import pytest
+
+from ..thingtalk.models.containers import MultipleThings
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.thing import Thing
+from ..thingtalk.models.value import Value
+from ..thingtalk.toolkits.snapshot import StateSnapshot, read_state
+
+
+def make_lamp(thing_id):
+    thing = Thing(thing_id, "lamp")
+    thing.add_property(Property("on", Value(False), metadata={"type": "boolean"}))
+    thing.add_property(Property("level", Value(0), metadata={"type": "integer", "maximum": 100}))
+    return thing
+
+
+@pytest.mark.asyncio
+async def test_snapshot_restores_last_values(tmp_path):
+    path = str(tmp_path / "state.jsonl")
+    things = MultipleThings({}, "things")
+    lamp = make_lamp("urn:test:lamp")
+    await things.add_thing(lamp)
+    snapshot = StateSnapshot(path, things, interval=60)
+    await snapshot.start()
+    try:
+        await lamp.set_property("on", True)
+        await lamp.set_property("level", 30)
+        await snapshot.save()
+        await lamp.set_property("level", 40)
+        await snapshot.save()
+        # appended, later lines win
+        assert read_state(path) == {"urn:test:lamp": {"on": True, "level": 40}}
+    finally:
+        await snapshot.stop()
+    with open(path, "rb") as f:
+        assert f.read().count(b"\n") == 1
+
+    # a restart, the saved level is out of range by now
+    with open(path, "ab") as f:
+        f.write(b'{"urn:test:lamp": {"level": 400}}\n{"urn:test:la')
+    things = MultipleThings({}, "things")
+    restarted = make_lamp("urn:test:lamp")
+    await things.add_thing(restarted)
+    snapshot = StateSnapshot(path, things, interval=60)
+    things.add_hooks.append(snapshot.restore)
+    await snapshot.start()
+    try:
+        assert await restarted.get_property("on") is True
+        # the latest saved level isn't accepted, it keeps its default
+        assert await restarted.get_property("level") == 0
+        # things added later are restored too
+        await snapshot.compact()
+        other = make_lamp("urn:test:lamp")
+        await things.add_thing(other)
+        assert await other.get_property("on") is True
+    finally:
+        await snapshot.stop()
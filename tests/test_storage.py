@@ -0,0 +1,114 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+from ..thingtalk.toolkits.storage import SQLiteDatabase
+
+
+@pytest.mark.asyncio
+async def test_sqlite_table(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    db = SQLiteDatabase(path)
+    rules = db.table("rules")
+
+    assert await rules.all() == []
+    await rules.insert({"id": "a", "name": "first"})
+    await rules.insert({"id": "b", "name": "second"})
+    assert await rules.get("a") == {"id": "a", "name": "first"}
+    assert await rules.update("a", {"name": "renamed"}) == {"id": "a", "name": "renamed"}
+    assert await rules.update("missing", {"name": "x"}) is None
+    assert await rules.remove("b")
+    assert not await rules.remove("b")
+
+    # reads are copies, mutating them doesn't touch the store
+    (await rules.get("a"))["name"] = "mutated"
+    assert (await rules.get("a"))["name"] == "renamed"
+    await db.close()
+
+    reopened = SQLiteDatabase(path).table("rules")
+    assert await reopened.all() == [{"id": "a", "name": "renamed"}]
+    await reopened.db.close()
+
+
+@pytest.mark.asyncio
+async def test_close_flushes_held_back_writes(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    db = SQLiteDatabase(path, flush_interval=3600)
+    await db.table("scenes").insert({"id": "a", "name": "evening"})
+    await db.close()
+
+    reopened = SQLiteDatabase(path)
+    assert await reopened.table("scenes").all() == [{"id": "a", "name": "evening"}]
+    await reopened.close()
+
+
+def test_routers_close_the_database():
+    from ..thingtalk.routers import rules, scenes
+
+    assert rules.db.close in rules.router.on_shutdown
+    assert scenes.db.close in scenes.router.on_shutdown
+
+
+@pytest.mark.asyncio
+async def test_new_tables_import_the_tinydb_file(tmp_path):
+    legacy = tmp_path / "db.json"
+    legacy.write_text(json.dumps({
+        "_default": {},
+        "rules": {"1": {"id": "a", "name": "first"}, "2": {"name": "no id"}},
+    }))
+    path = str(tmp_path / "db.sqlite3")
+    db = SQLiteDatabase(path, legacy_path=str(legacy))
+    rules = db.table("rules")
+    assert await rules.all() == [{"id": "a", "name": "first"}, {"id": "2", "name": "no id"}]
+    assert await db.table("scenes").all() == []
+
+    # only once, removed documents stay removed
+    await rules.remove("a")
+    await db.close()
+    reopened = SQLiteDatabase(path, legacy_path=str(legacy))
+    assert await reopened.table("rules").all() == [{"id": "2", "name": "no id"}]
+    await reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_writes_are_retried(tmp_path):
+    path = str(tmp_path / "db.sqlite3")
+    db = SQLiteDatabase(path, flush_interval=0, retry_interval=0.01)
+    rules = db.table("rules")
+    commit = rules._commit
+    failures = []
+
+    def fail_once(batch):
+        if not failures:
+            failures.append(batch)
+            raise sqlite3.OperationalError("database is locked")
+        commit(batch)
+
+    rules._commit = fail_once
+    await rules.insert({"id": "a", "name": "first"})
+    for _ in range(50):
+        await asyncio.sleep(0.01)
+        if not rules._pending and rules._flushing is None:
+            break
+    assert failures
+    assert await db.run(lambda: db.connection().execute('SELECT id FROM "rules"').fetchall()) == [("a",)]
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_reads_are_retried(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "db.sqlite3"))
+    rules = db.table("rules")
+    read_all = rules._read_all
+
+    def fail(*args):
+        raise sqlite3.OperationalError("unable to open database file")
+
+    rules._read_all = fail
+    with pytest.raises(sqlite3.OperationalError):
+        await rules.all()
+    rules._read_all = read_all
+    assert await rules.all() == []
+    await db.close()
@@ -2,6 +2,9 @@ import orjson as json
 import re
 import socket
 import time
+
+import anyio
+import pytest
 from fastapi.testclient import TestClient
 from ..example.test_light import servient
 
@@ -37,6 +40,18 @@ def get_ip():
 client = TestClient(servient.app)
 
 
+@pytest.fixture(scope="module", autouse=True)
+def event_loop_thread():
+    """
+    Keep one event loop running between requests, like a real server, so
+    actions started by a request go on in the background.
+    """
+    with anyio.start_blocking_portal() as portal:
+        client.portal = portal
+        yield portal
+        client.portal = None
+
+
 def http_request(method, path, data=None):
     """
     Send an HTTP request to the server.
@@ -366,6 +381,35 @@ def test_actions():
     assert body is None
 
 
+def test_websocket_without_topic():
+    ws_href = "ws://localhost:8000/channel"
+    if _AUTHORIZATION_HEADER is not None:
+        ws_href += "?jwt=" + _AUTHORIZATION_HEADER.split(" ")[1]
+    with client.websocket_connect(ws_href) as websocket:
+        websocket.send_json({"messageType": "setProperty", "data": {"brightness": 20}})
+        message = websocket.receive_json(mode="binary")
+        assert message["messageType"] == "error"
+        assert message["data"]["message"] == "topic is required"
+
+        # the socket is still open
+        websocket.send_json(
+            {
+                "messageType": "subscribe",
+                "data": {"thing_ids": ["urn:dev:ops:my-lamp-1234"]},
+            }
+        )
+        websocket.send_json(
+            {
+                "topic": "things/urn:dev:ops:my-lamp-1234",
+                "messageType": "setProperty",
+                "data": {"brightness": 20},
+            }
+        )
+        message = websocket.receive_json(mode="binary")
+        assert message["messageType"] == "propertyStatus"
+        assert message["data"]["brightness"] == 20
+
+
 def test_websocket():
     # Test setting property through websocket
     ws_href = "ws://localhost:8000/channel"
@@ -572,3 +616,117 @@ def test_websocket():
 
         for r in received:
             assert r
+
+
+def test_bulk_properties():
+    code, body = http_request("PUT", "/properties", {"on": False, "brightness": 30})
+    assert code == 200
+    assert body == {"on": False, "brightness": 30}
+
+    # one invalid value fails the whole batch
+    code, body = http_request("PUT", "/properties", {"on": True, "brightness": 300})
+    assert code == 400
+    code, body = http_request("PUT", "/properties", {"on": True, "unknown": 1})
+    assert code == 400
+
+    code, body = http_request("GET", "/properties")
+    assert code == 200
+    assert body["on"] is False
+    assert body["brightness"] == 30
+
+    code, body = http_request("PUT", "/properties", {"on": True})
+    assert code == 200
+
+
+def test_event_history():
+    code, body = http_request("GET", "/events")
+    assert code == 200
+    assert len(body) > 0
+
+    code, limited = http_request("GET", "/events?limit=1")
+    assert code == 200
+    assert limited == body[-1:]
+
+    code, body = http_request("GET", "/events/overheated?since=2100-01-01T00:00:00Z")
+    assert code == 200
+    assert body == []
+
+    code, body = http_request("GET", "/events?limit=0")
+    assert code == 422
+
+
+def test_thing_description_etag():
+    response = client.get(_PATH_PREFIX)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert response.json()["actions"]["fade"]["links"][0]["href"] == _PATH_PREFIX + "/actions/fade"
+
+    response = client.get(_PATH_PREFIX, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+    listing = client.get("/things")
+    assert listing.status_code == 200
+    assert client.get("/things", headers={"If-None-Match": listing.headers["etag"]}).status_code == 304
+
+    thing = servient.app.state.things.get_thing("urn:dev:ops:my-lamp-1234")
+    title = thing.title
+    thing.title = "Renamed Lamp"
+    try:
+        response = client.get(_PATH_PREFIX, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json()["title"] == "Renamed Lamp"
+        assert response.headers["etag"] != etag
+    finally:
+        thing.title = title
+
+
+def test_things_pages():
+    listing = client.get("/things").json()
+    ids = [description["id"] for description in listing]
+    assert ids == sorted(ids)
+
+    page = client.get("/things", params={"limit": 1})
+    assert [d["id"] for d in page.json()] == ids[:1]
+    next_url = page.headers["link"].split(">")[0].lstrip("<")
+    page = client.get(next_url)
+    assert [d["id"] for d in page.json()] == ids[1:2]
+
+    lights = client.get("/things", params={"@type": "Light"}).json()
+    assert [d["id"] for d in lights] == ["urn:dev:ops:my-lamp-1234"]
+
+    streamed = client.get("/things", headers={"Accept": "application/x-ndjson"})
+    assert streamed.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in streamed.text.splitlines()] == listing
+    # streamed without building every description for an ETag first
+    assert "etag" not in streamed.headers
+
+
+def test_batch_properties():
+    lamp = "urn:dev:ops:my-lamp-1234"
+    response = client.post("/things:batchWrite", json={
+        lamp: {"on": True, "brightness": 40},
+        "urn:missing": {"on": True},
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert body[lamp] == {"properties": {"on": True, "brightness": 40}}
+    assert body["urn:missing"] == {"error": "Thing not found"}
+
+    response = client.post("/things:batchWrite", json={lamp: {"brightness": 400}})
+    assert "error" in response.json()[lamp]
+
+    response = client.post("/things:batchRead", json={
+        lamp: ["brightness", "color"],
+        "urn:missing": [],
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert body[lamp] == {
+        "properties": {"brightness": 40},
+        "errors": {"color": "Property not found"},
+    }
+    assert body["urn:missing"] == {"error": "Thing not found"}
+
+    response = client.post("/things:batchRead", json={lamp: []})
+    assert response.json()[lamp]["properties"] == {"on": True, "brightness": 40}
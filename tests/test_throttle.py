@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.thing import Thing
+from ..thingtalk.models.value import Value
+from ..thingtalk.toolkits.event_bus import ee
+from ..thingtalk.toolkits.throttle import Throttle
+
+
+@pytest.mark.asyncio
+async def test_throttle_leading_and_trailing():
+    emitted = []
+    throttle = Throttle(emitted.append, 0.05)
+    throttle.push({"power": 1})
+    throttle.push({"power": 2})
+    throttle.push({"power": 3, "energy": 10})
+    assert emitted == [{"power": 1}]
+    assert throttle.pending == {"power": 3, "energy": 10}
+
+    await asyncio.sleep(0.08)
+    assert emitted == [{"power": 1}, {"power": 3, "energy": 10}]
+    await asyncio.sleep(0.1)
+    throttle.push({"power": 4})
+    assert emitted[-1] == {"power": 4}
+
+    emitted.clear()
+    throttle = Throttle.from_spec(emitted.append, {"interval": 0.05, "leading": False})
+    throttle.push({"power": 5})
+    assert emitted == []
+    throttle.flush()
+    assert emitted == [{"power": 5}]
+
+    with pytest.raises(ValueError):
+        Throttle.from_spec(emitted.append, {"interval": 1, "rate": 2})
+    with pytest.raises(ValueError):
+        Throttle.from_spec(emitted.append, {"interval": 1, "leading": False, "trailing": False})
+
+
+@pytest.mark.asyncio
+async def test_debounce():
+    emitted = []
+    throttle = Throttle.from_spec(emitted.append, {"interval": 0.2, "leading": False, "debounce": True})
+    for brightness in range(5):
+        throttle.push({"brightness": brightness})
+        await asyncio.sleep(0.02)
+    assert emitted == []
+    await asyncio.sleep(0.3)
+    assert emitted == [{"brightness": 4}]
+
+
+@pytest.mark.asyncio
+async def test_thing_state_is_throttled():
+    thing = Thing("urn:test:meter", "meter")
+    thing.add_property(Property("power", Value(0), metadata={"type": "number", "throttle": 0.05}))
+    thing.add_property(Property("on", Value(True), metadata={"type": "boolean"}))
+
+    samples, states = [], []
+    ee.on(f"things/{thing.id}/samples", samples.append)
+    ee.on(f"things/{thing.id}/state", states.append)
+    try:
+        for power in range(1, 11):
+            await thing.sync_property("power", power)
+        await thing.sync_property("on", False)
+        await asyncio.sleep(0.08)
+    finally:
+        ee.remove_listener(f"things/{thing.id}/samples", samples.append)
+        ee.remove_listener(f"things/{thing.id}/state", states.append)
+        await thing.remove_listener()
+
+    assert len(samples) == 11
+    assert [message.data for message in states] == [{"power": 1}, {"on": False}, {"power": 10}]
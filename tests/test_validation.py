@@ -0,0 +1,47 @@
+import pytest
+
+from jsonschema.exceptions import ValidationError
+
+from ..thingtalk.models.errors import PropertyError
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.validation import compile_validator
+from ..thingtalk.models.value import Value
+
+BRIGHTNESS = {
+    "@type": "BrightnessProperty",
+    "title": "Brightness",
+    "type": "integer",
+    "minimum": 0,
+    "maximum": 100,
+    "unit": "percent",
+}
+
+
+def test_equal_schemas_share_a_validator():
+    assert compile_validator(dict(BRIGHTNESS)) is compile_validator(dict(BRIGHTNESS))
+    assert compile_validator(BRIGHTNESS) is not compile_validator(BRIGHTNESS, fast_path=False)
+
+
+@pytest.mark.parametrize("schema, valid, invalid", [
+    (BRIGHTNESS, [0, 50, 100, 2.0], [-1, 101, 2.5, True, "50", None]),
+    ({"type": "number", "exclusiveMinimum": 0}, [0.1, 3], [0, -1, False]),
+    ({"type": "boolean"}, [True, False], [0, 1, "true"]),
+    ({"type": "string", "enum": ["ON", "OFF"]}, ["ON", "OFF"], ["on", 1, None]),
+    ({"type": "object", "required": ["x"]}, [{"x": 1}], [{}, 1]),
+])
+def test_fast_path_matches_jsonschema(schema, valid, invalid):
+    for fast_path in (True, False):
+        validate = compile_validator(schema, fast_path)
+        for value in valid:
+            validate(value)
+        for value in invalid:
+            with pytest.raises(ValidationError):
+                validate(value)
+
+
+def test_property_metadata_change_invalidates_validator():
+    prop = Property("brightness", Value(50), metadata=dict(BRIGHTNESS))
+    prop.validate_value(100)
+    prop.metadata = {**BRIGHTNESS, "maximum": 80}
+    with pytest.raises(PropertyError):
+        prop.validate_value(100)
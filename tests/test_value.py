@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from ..thingtalk.models.errors import PropertyError
+from ..thingtalk.models.property import Property
+from ..thingtalk.models.thing import Thing
+from ..thingtalk.models.value import NotifyPolicy, Value
+from ..thingtalk.toolkits.event_bus import ee
+
+
+@pytest.mark.asyncio
+async def test_value_observers():
+    value = Value(1)
+    assert value.listeners("update") == []
+
+    updates, syncs, scheduled = [], [], []
+
+    async def observe(v):
+        scheduled.append(v)
+
+    value.on("update", updates.append)
+    value.once("sync", syncs.append)
+    value.on("update", observe)
+
+    await value.set(2)
+    await value.notify_of_external_update(3, with_action=False)
+    await value.notify_of_external_update(4, with_action=False)
+    assert updates == [2]
+    assert syncs == [3]
+    assert value.last_value == 4
+    await asyncio.sleep(0)
+    assert scheduled == [2]
+
+    value.remove_listener("update", updates.append)
+    value.remove_listener("update", observe)
+    assert value.event_names() == set()
+    await value.set(5)
+    assert updates == [2]
+
+
+@pytest.mark.asyncio
+async def test_value_listener_errors():
+    value = Value(0)
+
+    def fail(v):
+        raise ValueError(v)
+
+    value.on("update", fail)
+    with pytest.raises(ValueError):
+        await value.set(1)
+
+    errors = []
+    value.on("error", errors.append)
+    await value.set(2)
+    assert [str(e) for e in errors] == ["2"]
+
+
+@pytest.mark.asyncio
+async def test_notify_policy():
+    assert NotifyPolicy.from_metadata({"type": "number"}) is None
+    assert NotifyPolicy.from_metadata({"notify": "always"}) is None
+    assert NotifyPolicy.from_metadata({"notify": {"deadband": 1}}) is \
+        NotifyPolicy.from_metadata({"notify": {"deadband": 1}})
+    with pytest.raises(ValueError):
+        NotifyPolicy.from_metadata({"notify": "sometimes"})
+
+    value = Value(20.0)
+    value.policy = NotifyPolicy.from_metadata({"notify": {"deadband": 0.5, "deadbandPercent": 1}})
+    syncs = []
+    value.on("sync", syncs.append)
+    for v in (20.1, 20.4, 20.6, 20.6, 21.0, 100.0, 100.9, 101.1):
+        await value.notify_of_external_update(v, with_action=False)
+    assert syncs == [20.6, 100.0, 101.1]
+    assert value.last_value == 101.1
+
+    value = Value("idle")
+    value.policy = NotifyPolicy.from_metadata({"notify": "onChange"})
+    value.on("update", syncs.append)
+    assert not await value.set("idle")
+    assert await value.set("busy")
+    assert not await value.set("busy")
+
+    value.policy = NotifyPolicy.from_metadata({"notify": {"maxSilence": 0}})
+    assert await value.set("busy")
+
+
+@pytest.mark.asyncio
+async def test_suppressed_updates_are_not_published():
+    thing = Thing("urn:test:thermometer", "thermometer")
+    thing.add_property(Property(
+        "temperature",
+        Value(20.0),
+        metadata={"type": "number", "notify": {"deadband": 0.5}},
+    ))
+    thing.add_property(Property("on", Value(True), metadata={"type": "boolean"}))
+
+    published = []
+    ee.on(f"things/{thing.id}/state", published.append)
+    try:
+        await thing.sync_property("temperature", 20.2)
+        await thing.bulk_sync_property({"temperature": 20.3, "on": True})
+        await thing.set_properties({"temperature": 21.0, "on": True})
+        await asyncio.sleep(0)
+    finally:
+        ee.remove_listener(f"things/{thing.id}/state", published.append)
+
+    assert [message.data for message in published] == [{"on": True}, {"temperature": 21.0, "on": True}]
+    assert await thing.get_property("temperature") == 21.0
+
+
+@pytest.mark.asyncio
+async def test_set_properties_notifies_after_every_forwarder():
+    written = []
+
+    async def write_level(value):
+        written.append(value)
+
+    async def write_on(value):
+        raise IOError("device offline")
+
+    thing = Thing("urn:test:dimmer", "dimmer")
+    thing.add_property(Property("level", Value(0, write_level), metadata={"type": "integer"}))
+    thing.add_property(Property("on", Value(False, write_on), metadata={"type": "boolean"}))
+    updates = []
+    thing.properties["level"].value.on("update", updates.append)
+
+    with pytest.raises(PropertyError):
+        await thing.set_properties({"level": 50, "on": True})
+    # the first forwarder ran, but nobody heard of a value that wasn't set
+    assert written == [50]
+    assert updates == []
+    assert await thing.get_property("level") == 0
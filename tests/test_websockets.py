@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from starlette.websockets import WebSocketState
+
+from ..thingtalk.routers.websockets import Channel
+from ..thingtalk.schema import InputMsg, OutMsg
+
+
+class FakeWebSocket:
+    application_state = WebSocketState.CONNECTED
+
+    def __init__(self):
+        self.closed_with = None
+        self.sent = []
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+def status(thing_id, **data):
+    return OutMsg(topic=f"things/{thing_id}", messageType="propertyStatus", data=data)
+
+
+@pytest.mark.asyncio
+async def test_channel_drop_oldest():
+    channel = Channel(FakeWebSocket(), maxsize=2, policy="drop-oldest")
+    for i in range(5):
+        channel.put(status("lamp", brightness=i))
+    assert channel.depth == 2
+    assert channel.dropped == 3
+    assert [slot[0].data["brightness"] for slot in channel._queue] == [3, 4]
+
+
+@pytest.mark.asyncio
+async def test_channel_conflate():
+    channel = Channel(FakeWebSocket(), maxsize=2, policy="conflate")
+    for i in range(5):
+        channel.put(status("lamp", brightness=i))
+    channel.put(status("lamp", on=False))
+    channel.put(status("sensor", level=1))
+    assert channel.depth == 2
+    assert channel.dropped == 0
+    assert channel.conflated == 5
+    assert channel._queue[0][0].data == {"brightness": 4, "on": False}
+
+
+@pytest.mark.asyncio
+async def test_channel_disconnect():
+    websocket = FakeWebSocket()
+    channel = Channel(websocket, maxsize=1, policy="disconnect")
+    channel.put(status("lamp", brightness=1))
+    channel.put(status("lamp", brightness=2))
+    assert channel.dropped == 1
+    assert channel.depth == 0
+    channel.put(status("lamp", brightness=3))
+    assert channel.depth == 0
+    await asyncio.sleep(0)
+    assert websocket.closed_with == 1013
+
+
+@pytest.mark.asyncio
+async def test_channel_survives_unsendable_messages():
+    websocket = FakeWebSocket()
+    channel = Channel(websocket)
+    channel.start()
+    channel.put(InputMsg(topic="things/lamp/state", messageType="setProperty", data={"on": True}))
+    channel.put(OutMsg(topic="things/lamp", messageType="event", data={"at": object()}))
+    channel.put(status("lamp", on=False))
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert channel.sent == 2
+    assert channel.failed == 1
+    assert websocket.sent[-1] == b'{"topic":"things/lamp","messageType":"propertyStatus","data":{"on":false}}'
+    await channel.close()
@@ -9,7 +9,13 @@ from zeroconf.asyncio import AsyncZeroconf, AsyncServiceInfo
 
 from .models.thing import Server
 from .models.containers import MultipleThings
-from .routers import things, properties, actions, events, websockets
+from .routers import things, properties, actions, events, websockets, metrics, debug
+from .toolkits import executor
+from .toolkits.event_bus import ee
+from .toolkits.exporter import MqttExporter
+from .toolkits.history import History
+from .toolkits.monitor import LoopMonitor
+from .toolkits.snapshot import StateSnapshot
 from .utils import get_ip
 
 
@@ -19,7 +25,20 @@ class ThingTalk:
             title: str = "ThingTalk",
             description: str = "",
             version: str = "0.1.0",
-            dependencies: Optional[Sequence[Depends]] = None
+            dependencies: Optional[Sequence[Depends]] = None,
+            channel_queue_size: int = 256,
+            channel_overflow: str = "drop-oldest",
+            metrics: bool = False,
+            driver_threads: int = 8,
+            monitor: bool = False,
+            slow_callback_threshold: float = 0.05,
+            mqtt_export=None,
+            mqtt_export_interval: float = 0.1,
+            state_path: Optional[str] = None,
+            state_interval: float = 5.0,
+            history_path: Optional[str] = None,
+            history_max_age: Optional[float] = 7 * 86400,
+            history_max_bytes: Optional[int] = 64 * 1024 * 1024,
     ) -> None:
         self.app = FastAPI(
             title=title,
@@ -28,12 +47,70 @@ class ThingTalk:
             dependencies=dependencies
         )
 
-        server = Server()
-        server.href_prefix = f"/things/{server._id}"
-        self.app.state.things = MultipleThings({server._id: server}, "things")
+        self.app.state.things = MultipleThings({}, "things")
+        # outbound queue of every /channel websocket, the overflow policy is
+        # one of "drop-oldest", "disconnect" or "conflate"
+        self.app.state.channel_queue_size = channel_queue_size
+        self.app.state.channel_overflow = channel_overflow
+        # expose the Prometheus style /metrics endpoint
+        self.metrics = metrics
+        ee.count_emits = metrics
+        # threads running blocking value forwarders and actions
+        executor.max_workers = driver_threads
+        # stopped in this order by one shutdown handler, then the pool
+        self._stops = []
+        # sample the loop lag and serve slow callbacks on /debug/slow
+        self.monitor = LoopMonitor(threshold=slow_callback_threshold) if monitor else None
+        if self.monitor is not None:
+            self.app.state.monitor = self.monitor
+            self.app.add_event_handler("startup", self.monitor.start)
+            self._stops.append(self.monitor.stop)
+        # restore the last property values before serving and save changes
+        self.snapshot = None
+        if state_path is not None:
+            self.snapshot = StateSnapshot(state_path, self.app.state.things, interval=state_interval)
+            self.app.state.things.add_hooks.append(self.snapshot.restore)
+            self.app.add_event_handler("startup", self.snapshot.start)
+            self._stops.append(self.snapshot.stop)
+        # record the properties with "history" in their metadata, served on
+        # /things/{id}/properties/{name}/history
+        self.history = None
+        if history_path is not None:
+            self.history = History(
+                history_path, self.app.state.things, max_age=history_max_age, max_bytes=history_max_bytes
+            )
+            self.app.state.things.add_hooks.append(self.history.watch)
+            self.app.state.things.remove_hooks.append(self.history.unwatch)
+            self.app.add_event_handler("startup", self.history.start)
+            self._stops.append(self.history.stop)
+        self.app.state.history = self.history
+        # mirror property states and events to the broker of an Mqtt client
+        self.exporter = None
+        if mqtt_export is not None:
+            self.exporter = MqttExporter(mqtt_export, self.app.state.things, interval=mqtt_export_interval)
+            self.app.add_event_handler("startup", self.exporter.start)
+            self._stops.append(self.exporter.stop)
+        # through the add hooks like every other thing, now they are registered
+        self.app.state.things.insert_thing(Server())
+        self.app.add_event_handler("shutdown", self.stop)
         self.include_routers()
         self.register_mdns()
 
+    async def stop(self):
+        """
+        Stop the monitor, snapshot, history and exporter and close the
+        container, a shutdown handler.
+        The driver pool is shut down last, the snapshot and the history
+        still write through it while they stop.
+        """
+        for stop in self._stops:
+            try:
+                await stop()
+            except Exception:
+                logger.exception(f"failed to stop {stop.__self__}")
+        self.app.state.things.close()
+        executor.shutdown()
+
     def register_mdns(self):
         zeroconf = AsyncZeroconf()
 
@@ -87,3 +164,7 @@ class ThingTalk:
 
         self.app.include_router(restapi)
         self.app.include_router(websockets.router)
+        if self.metrics:
+            self.app.include_router(metrics.router, tags=["metrics"])
+        if self.monitor is not None:
+            self.app.include_router(debug.router, tags=["debug"])
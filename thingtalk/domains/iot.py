@@ -1,7 +1,6 @@
 from loguru import logger
 
 from ..models.thing import Thing
-from ..toolkits.event_bus import ee
 
 
 class Device(Thing):
@@ -11,17 +10,11 @@ class Device(Thing):
 
     async def subscribe_broadcast(self):
         if "Light" in self._type:
-            topic = "broadcast/light"
-            ee.on(topic, self.dispatch)
-            self.subscribe_topics.append(topic)
+            self.groups.add("light")
             logger.info("subscribe light broadcast")
         elif "OnOffSwitch" in self._type:
-            topic = "broadcast/switch"
-            ee.on(topic, self.dispatch)
-            self.subscribe_topics.append(topic)
+            self.groups.add("switch")
             logger.info("subscribe switch broadcast")
         elif "Cover" in self._type:
-            topic = "broadcast/cover"
-            ee.on(topic, self.dispatch)
-            self.subscribe_topics.append(topic)
+            self.groups.add("cover")
             logger.info("subscribe cover broadcast")
@@ -1,27 +1,46 @@
 """High-level Action base class implementation."""
 
+from collections import OrderedDict
 from functools import cached_property
+from itertools import chain, islice
+import time
 import typing
 import uuid
 
+from loguru import logger
+
+from ..toolkits.executor import run_blocking
+from ..toolkits.metrics import Histogram
 from ..utils import timestamp
 
+_action_seconds = Histogram(
+    "thingtalk_action_duration_seconds",
+    "Time actions take from start to finish.",
+    ("action",),
+)
+
 
 class Action:
-    """An Action represents an individual action on a thing."""
+    """
+    An Action represents an individual action on a thing.
+    Set blocking to make perform_action a plain method, it then runs on the
+    driver thread pool, one at a time with the blocking value forwarders of
+    the same thing.
+    """
 
     title: str = ""
     schema: dict = {}
+    blocking: bool = False
 
-    def __init__(self, thing, input_, id_=uuid.uuid4().hex):
+    def __init__(self, thing, input_, id_=None):
         """
         Initialize the object.
-        id_ ID of this action, default uuid
+        id_ ID of this action, default a new uuid
         thing -- the Thing this action belongs to
         name -- name of the action
         input_ -- any action inputs
         """
-        self._id = id_
+        self._id = id_ if id_ is not None else uuid.uuid4().hex
         self._thing = thing
         self._input = input_
         self._href_prefix: str = ""
@@ -127,22 +146,154 @@ class Action:
         return self._input
 
     async def start(self):
-        """Start performing the action."""
+        """
+        Start performing the action.
+        It's finished however perform_action ends, with the status "error"
+        if it raised, so failed actions are collected like completed ones.
+        """
+        started = time.perf_counter()
         self.status = "pending"
         await self.thing.action_notify(self)
-        await self.perform_action()
-        await self.finish()
+        status = "error"
+        try:
+            if self.blocking:
+                await run_blocking(self.perform_action, serial=self.thing)
+            else:
+                await self.perform_action()
+            status = "completed"
+        except Exception:
+            logger.exception(f"action {self.title} {self.id} of {self.thing.id} failed")
+        finally:
+            await self.finish(status)
+            _action_seconds.labels(self.title).observe(time.perf_counter() - started)
 
     async def perform_action(self):
-        """Override this with the code necessary to perform the action."""
+        """
+        Override this with the code necessary to perform the action.
+        With blocking set, override it with a plain method instead.
+        """
         pass
 
     async def cancel(self):
         """Override this with the code necessary to cancel the action."""
         pass
 
-    async def finish(self):
-        """Finish performing the action."""
-        self.status = "completed"
+    async def finish(self, status: str = "completed"):
+        """
+        Finish performing the action.
+        status -- the final status, "completed" or "error"
+        """
+        self.status = status
         self.time_completed = timestamp()
+        self.thing.actions.complete(self)
         await self.thing.action_notify(self)
+
+
+class ActionStore:
+    """
+    The actions of a thing, keyed by name and id.
+    Actions are kept until they complete, then only the most recent
+    completed ones are retained, limited by count and age.
+    """
+
+    def __init__(self, max_completed: typing.Optional[int] = 100,
+                 max_age: typing.Optional[float] = None):
+        """
+        Initialize the store.
+        max_completed -- maximum number of completed actions kept, None for no limit
+        max_age -- seconds a completed action is kept, None to keep it until evicted
+        """
+        self.max_completed = max_completed
+        self.max_age = max_age
+        # action name -> action id -> action, in request order
+        self._actions: typing.Dict[str, typing.Dict[str, Action]] = {}
+        # (action name, action id) -> monotonic completion time, oldest first
+        self._completed: typing.OrderedDict[typing.Tuple[str, str], float] = OrderedDict()
+
+    def __len__(self):
+        self._collect()
+        return sum(len(actions) for actions in self._actions.values())
+
+    def __iter__(self) -> typing.Iterator[Action]:
+        return iter(self.query())
+
+    def add(self, action: Action):
+        """
+        Store a new action.
+        action -- the action
+        """
+        self._collect()
+        self._actions.setdefault(action.name, {})[action.id] = action
+
+    def get(self, action_name: str, action_id: str) -> typing.Optional[Action]:
+        """
+        Get an action.
+        action_name -- name of the action
+        action_id -- ID of the action
+        Returns the action if found, else None.
+        """
+        actions = self._actions.get(action_name)
+        if actions is None:
+            return None
+        return actions.get(action_id)
+
+    def remove(self, action_name: str, action_id: str) -> typing.Optional[Action]:
+        """
+        Remove an action.
+        action_name -- name of the action
+        action_id -- ID of the action
+        Returns the removed action if found, else None.
+        """
+        actions = self._actions.get(action_name)
+        if actions is None:
+            return None
+        self._completed.pop((action_name, action_id), None)
+        return actions.pop(action_id, None)
+
+    def complete(self, action: Action):
+        """
+        Mark an action as completed, making it eligible for collection.
+        action -- the action
+        """
+        if self.get(action.name, action.id) is not action:
+            return
+        key = (action.name, action.id)
+        self._completed.pop(key, None)
+        self._completed[key] = time.monotonic()
+        self._collect()
+
+    def query(self, action_name: typing.Optional[str] = None,
+              limit: typing.Optional[int] = None, offset: int = 0) -> typing.List[Action]:
+        """
+        Get actions, grouped by name in request order.
+        action_name -- only actions with this name
+        limit -- at most this many actions
+        offset -- skip this many actions first
+        """
+        self._collect()
+        if action_name is not None:
+            actions = self._actions.get(action_name, {}).values()
+        else:
+            actions = chain.from_iterable(a.values() for a in self._actions.values())
+        stop = offset + limit if limit is not None else None
+        return list(islice(actions, offset, stop))
+
+    def _collect(self):
+        completed = self._completed
+        if self.max_completed is not None:
+            while len(completed) > self.max_completed:
+                self._evict(completed.popitem(last=False)[0])
+        if self.max_age is not None and completed:
+            deadline = time.monotonic() - self.max_age
+            while completed:
+                key, completed_at = next(iter(completed.items()))
+                if completed_at > deadline:
+                    break
+                del completed[key]
+                self._evict(key)
+
+    def _evict(self, key: typing.Tuple[str, str]):
+        action_name, action_id = key
+        actions = self._actions.get(action_name)
+        if actions is not None:
+            actions.pop(action_id, None)
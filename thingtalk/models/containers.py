@@ -1,5 +1,87 @@
+import asyncio
+import typing
+
+from bisect import bisect_right
+from itertools import islice
+
+from loguru import logger
+
 from .event import ThingPairedEvent, ThingRemovedEvent
 from .thing import Thing
+from ..toolkits.event_bus import ee, Subscription
+
+
+def select_things(things: typing.Dict[str, Thing],
+                  type_: typing.Optional[str] = None,
+                  cursor: typing.Optional[str] = None,
+                  limit: typing.Optional[int] = None,
+                  ids: typing.Optional[typing.List[str]] = None) -> typing.List[typing.Tuple[str, Thing]]:
+    """
+    Get a page of things, ordered by id.
+    things -- the things by id
+    type_ -- only things with this @type
+    cursor -- only things whose id sorts after this one
+    limit -- at most this many things
+    ids -- the ids of the things, already sorted
+    """
+    if ids is None:
+        ids = sorted(things)
+    if cursor is not None:
+        ids = ids[bisect_right(ids, cursor):]
+    pairs = ((thing_id, things[thing_id]) for thing_id in ids)
+    if type_ is not None:
+        pairs = ((thing_id, thing) for thing_id, thing in pairs if type_ in thing._type)
+    return list(islice(pairs, limit))
+
+
+class ThingDict(dict):
+    """
+    The things of a container by id, with their ids sorted once.
+    Every change drops the sorted ids, also when the dict is changed
+    directly instead of through add_thing and remove_thing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._ids: typing.Optional[typing.List[str]] = None
+
+    def sorted_ids(self) -> typing.List[str]:
+        """Get the ids in order."""
+        if self._ids is None:
+            self._ids = sorted(self)
+        return self._ids
+
+    def __setitem__(self, key, value):
+        self._ids = None
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._ids = None
+        super().__delitem__(key)
+
+    def __ior__(self, other):
+        self._ids = None
+        return super().__ior__(other)
+
+    def update(self, *args, **kwargs):
+        self._ids = None
+        super().update(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self._ids = None
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self._ids = None
+        return super().pop(*args)
+
+    def popitem(self):
+        self._ids = None
+        return super().popitem()
+
+    def clear(self):
+        self._ids = None
+        super().clear()
 
 
 class SingleThing:
@@ -16,27 +98,66 @@ class SingleThing:
         """Get the thing at the given index."""
         return self.thing
 
-    def get_things(self):
-        """Get the list of things."""
-        return [self.thing]
+    async def get_things(self, type_=None, cursor=None, limit=None):
+        """Get the (id, thing) pairs of the things, see select_things."""
+        return select_things({self.thing.id: self.thing}, type_, cursor, limit)
 
-    def get_name(self):
+    async def get_name(self):
         """Get the mDNS server name."""
         return self.thing.title
 
 
 class MultipleThings:
-    """A container for multiple things."""
+    """
+    A container for multiple things.
+    The things added through add_thing are indexed by @type, capability
+    (property name) and group tag, so commands for a set of things resolve
+    without scanning the rest. Messages emitted on
+        broadcast/{group}
+        broadcast/type/{@type}
+        broadcast/capability/{property name}
+    are dispatched to every matching thing concurrently.
+    """
 
-    def __init__(self, things: dict, name: str):
+    def __init__(self, things: dict, name: str, broadcast_concurrency: typing.Optional[int] = 64):
         """
         Initialize the container.
-        things -- the things to store
+        things -- the things to store, copied into a ThingDict
         name -- the mDNS server name
+        broadcast_concurrency -- maximum number of things dispatching one
+                                 broadcast at a time, None for no limit
         """
-        self.things = things
+        self.things = ThingDict(things)
         self.name = name
-        self.server = self.things.get('urn:thingtalk:server')
+        self.broadcast_concurrency = broadcast_concurrency
+        # index -> key -> ids of the things
+        self._indexes: typing.Dict[str, typing.Dict[str, typing.Set[str]]] = {
+            "type": {},
+            "capability": {},
+            "group": {},
+        }
+        # thing id -> (index, key) pairs it was indexed under
+        self._indexed: typing.Dict[str, typing.List[typing.Tuple[str, str]]] = {}
+        # called with every thing add_thing adds, before it's served, e.g.
+        # to restore its state
+        self.add_hooks: typing.List[typing.Callable[[Thing], None]] = []
+        # called with every thing remove_thing removes, e.g. to stop
+        # recording it
+        self.remove_hooks: typing.List[typing.Callable[[Thing], None]] = []
+        for thing in self.things.values():
+            self.reindex(thing)
+        self._broadcast: typing.Optional[Subscription] = ee.subscribe("broadcast/#", self.handle_broadcast)
+
+    @property
+    def server(self) -> typing.Optional[Thing]:
+        """Get the server thing, None if it wasn't added."""
+        return self.things.get('urn:thingtalk:server')
+
+    def close(self):
+        """Stop handling the messages emitted on broadcast topics."""
+        if self._broadcast is not None:
+            ee.unsubscribe(self._broadcast)
+            self._broadcast = None
 
     def get_thing(self, idx):
         """
@@ -45,18 +166,130 @@ class MultipleThings:
         """
         return self.things.get(idx, None)
 
-    def get_things(self):
-        """Get the list of things."""
-        return self.things.items()
+    async def get_things(self, type_=None, cursor=None, limit=None):
+        """Get the (id, thing) pairs of the things, see select_things."""
+        return select_things(self.things, type_, cursor, limit, self.things.sorted_ids())
 
-    def get_name(self):
+    async def get_name(self):
         """Get the mDNS server name."""
         return self.name
 
-    async def add_thing(self, thing: Thing):
+    def reindex(self, thing: Thing):
+        """
+        Update the indexes of a thing, call after changing its types,
+        properties or groups.
+        thing -- the thing
+        """
+        self._unindex(thing.id)
+        keys = [("type", type_) for type_ in thing._type]
+        keys += [("capability", name) for name in thing.properties]
+        keys += [("group", group) for group in thing.groups]
+        for index, key in keys:
+            self._indexes[index].setdefault(key, set()).add(thing.id)
+        self._indexed[thing.id] = keys
+
+    def _unindex(self, thing_id: str):
+        for index, key in self._indexed.pop(thing_id, ()):
+            ids = self._indexes[index].get(key)
+            if ids is not None:
+                ids.discard(thing_id)
+                if not ids:
+                    del self._indexes[index][key]
+
+    def add_group(self, thing_id: str, group: str):
+        """
+        Add a thing to a group.
+        thing_id -- the id of the thing
+        group -- the group tag
+        """
+        thing = self.things[thing_id]
+        thing.groups.add(group)
+        self.reindex(thing)
+
+    def remove_group(self, thing_id: str, group: str):
+        """
+        Remove a thing from a group.
+        thing_id -- the id of the thing
+        group -- the group tag
+        """
+        thing = self.things[thing_id]
+        thing.groups.discard(group)
+        self.reindex(thing)
+
+    def select(self,
+               type_: typing.Optional[str] = None,
+               capability: typing.Optional[str] = None,
+               group: typing.Optional[str] = None) -> typing.List[Thing]:
+        """
+        Get the things matching every given criterion.
+        type_ -- only things with this @type
+        capability -- only things with this property
+        group -- only things with this group tag
+        """
+        criteria = [("type", type_), ("capability", capability), ("group", group)]
+        sets = [self._indexes[index].get(key, set()) for index, key in criteria if key is not None]
+        if not sets:
+            return list(self.things.values())
+        sets.sort(key=len)
+        ids = sets[0].intersection(*sets[1:])
+        return [self.things[thing_id] for thing_id in ids if thing_id in self.things]
+
+    async def dispatch_all(self, things: typing.List[Thing], message):
+        """
+        Dispatch a message to several things concurrently.
+        things -- the things
+        message -- the message for Thing.dispatch
+        """
+        limit = self.broadcast_concurrency
+        if limit is None or len(things) <= limit:
+            coros = [thing.dispatch(message) for thing in things]
+        else:
+            semaphore = asyncio.Semaphore(limit)
+
+            async def dispatch(thing):
+                async with semaphore:
+                    await thing.dispatch(message)
+
+            coros = [dispatch(thing) for thing in things]
+
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for thing, result in zip(things, results):
+            if isinstance(result, Exception):
+                logger.opt(exception=result).error(f"{thing.id} failed to handle {message}")
+
+    async def handle_broadcast(self, message):
+        """
+        Handle a message emitted on a broadcast topic.
+        message -- the message, its topic selects the things
+        """
+        words = (message.topic or "").split("/")
+        if len(words) == 2:
+            things = self.select(group=words[1])
+        elif len(words) == 3 and words[1] in ("type", "capability"):
+            things = self.select(**{"type_" if words[1] == "type" else "capability": words[2]})
+        else:
+            logger.warning(f"unknown broadcast topic {message.topic}")
+            return
+        logger.info(f"broadcast {message.messageType} to {len(things)} things")
+        await self.dispatch_all(things, message)
+
+    def insert_thing(self, thing: Thing):
+        """
+        Add a thing through the add hooks, without subscribing it to its
+        broadcast topics, so it can be called before the loop runs.
+        thing -- the thing
+        """
         thing.href_prefix = f"/things/{thing.id}"
-        self.things.update({thing.id: thing})
+        for hook in self.add_hooks:
+            hook(thing)
+        self.things[thing.id] = thing
+        self.reindex(thing)
+
+    async def add_thing(self, thing: Thing):
+        self.insert_thing(thing)
         await thing.subscribe_broadcast()
+        # subscribing may have joined groups
+        self.reindex(thing)
 
         # await self.server.add_event(ThingPairedEvent({
         #     '@type': list(thing._type),
@@ -70,7 +303,10 @@ class MultipleThings:
         if self.things.get(thing_id):
             thing = self.things[thing_id]
             await thing.remove_listener()
+            for hook in self.remove_hooks:
+                hook(thing)
             del self.things[thing_id]
+            self._unindex(thing_id)
 
             await self.server.add_event(ThingRemovedEvent({
                 '@type': list(thing._type),
@@ -1,6 +1,12 @@
 """High-level Event base class implementation."""
 
+import heapq
+import time
+import typing
+
+from collections import deque
 from functools import cached_property
+from itertools import count, islice
 
 from ..utils import timestamp
 
@@ -21,6 +27,7 @@ class Event:
         self._thing = None
         self._data = data
         self._time = timestamp()
+        self._epoch = time.time()
 
     @cached_property
     def description(self):
@@ -62,6 +69,125 @@ class Event:
         """Get the event's timestamp."""
         return self._time
 
+    @property
+    def epoch(self) -> float:
+        """Get the event's time in seconds since the epoch."""
+        return self._epoch
+
+
+class EventStore:
+    """
+    The bounded event history of a thing.
+    Events are kept in one ring buffer per event name, ordered by time, so
+    queries by name, time and count never scan other events.
+    """
+
+    def __init__(self,
+                 max_events: int = 1000,
+                 max_events_per_name: typing.Optional[int] = None,
+                 max_age: typing.Optional[float] = None):
+        """
+        Initialize the store.
+        max_events -- maximum number of events kept in total
+        max_events_per_name -- maximum number of events kept per event name
+        max_age -- seconds an event is kept, None to keep it until evicted
+        """
+        self.max_events = max_events
+        self.max_events_per_name = max_events_per_name
+        self.max_age = max_age
+        # event name -> deque of (sequence, event), oldest first
+        self._buffers: typing.Dict[str, typing.Deque[typing.Tuple[int, Event]]] = {}
+        self._sequence = count()
+        self._size = 0
+
+    def __len__(self):
+        self._expire()
+        return self._size
+
+    def __iter__(self) -> typing.Iterator[Event]:
+        return iter(self.query())
+
+    def append(self, event: Event):
+        """
+        Store an event, evicting the oldest ones over the limits.
+        event -- the event to store
+        """
+        self._expire()
+        buffer = self._buffers.get(event.name)
+        if buffer is None:
+            buffer = self._buffers[event.name] = deque()
+        if self.max_events_per_name is not None and len(buffer) >= self.max_events_per_name:
+            buffer.popleft()
+            self._size -= 1
+        buffer.append((next(self._sequence), event))
+        self._size += 1
+
+        while self._size > self.max_events:
+            # the oldest event overall is the oldest of some name
+            oldest = min(self._buffers.values(), key=lambda b: b[0][0] if b else float("inf"))
+            oldest.popleft()
+            self._size -= 1
+
+    def query(self,
+              name: typing.Optional[str] = None,
+              since: typing.Optional[float] = None,
+              limit: typing.Optional[int] = None) -> typing.List[Event]:
+        """
+        Get events, oldest first.
+        name -- only events with this name
+        since -- only events at or after this time, in seconds since the epoch
+        limit -- at most this many of the most recent matching events
+        """
+        self._expire()
+        if name is not None:
+            buffers = [self._buffers[name]] if name in self._buffers else []
+        else:
+            buffers = list(self._buffers.values())
+
+        ranges = [
+            (buffer, _bisect_epoch(buffer, since) if since is not None else 0)
+            for buffer in buffers
+        ]
+        if limit is None:
+            return [event for _, event in heapq.merge(
+                *(islice(buffer, start, None) for buffer, start in ranges)
+            )]
+
+        # walk backwards from the newest event, so only `limit` are touched
+        newest = heapq.merge(
+            *(_reversed_from(buffer, start) for buffer, start in ranges),
+            reverse=True,
+        )
+        events = [event for _, event in islice(newest, limit)]
+        events.reverse()
+        return events
+
+    def _expire(self):
+        if self.max_age is None:
+            return
+        deadline = time.time() - self.max_age
+        for buffer in self._buffers.values():
+            while buffer and buffer[0][1].epoch < deadline:
+                buffer.popleft()
+                self._size -= 1
+
+
+def _bisect_epoch(buffer: typing.Deque[typing.Tuple[int, Event]], since: float) -> int:
+    """Find the index of the first event at or after since."""
+    low, high = 0, len(buffer)
+    while low < high:
+        middle = (low + high) // 2
+        if buffer[middle][1].epoch < since:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _reversed_from(buffer: typing.Deque[typing.Tuple[int, Event]], start: int):
+    for index in range(len(buffer) - 1, start - 1, -1):
+        yield buffer[index]
+
 
 class ThingPairingEvent(Event):
     title = "thing_pairing"
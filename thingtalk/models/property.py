@@ -1,16 +1,21 @@
 """High-level Property base class implementation."""
 
-from copy import deepcopy
-from functools import cached_property
-from jsonschema import validate
 from jsonschema.exceptions import ValidationError
 from loguru import logger
 
 from .errors import PropertyError
+from .registry import intern_metadata
+from .validation import compile_validator
+from .value import NotifyPolicy
 
 
 class Property:
-    """A Property represents an individual state value of a thing."""
+    """
+    A Property represents an individual state value of a thing.
+    Metadata is interned, properties with equal metadata share one dict,
+    so assign new metadata instead of changing it in place. Its "notify"
+    entry sets the value's NotifyPolicy.
+    """
 
     __slots__ = [
         "_thing",
@@ -20,9 +25,13 @@ class Property:
         "_href_prefix",
         "_href",
         "_media_type",
-        "__dict__",
+        "_validator",
     ]
 
+    # accept plain booleans, bounded numbers and string enums without
+    # calling into jsonschema
+    fast_validation = True
+
     def __init__(self, name, value, thing=None, metadata=None):
         """
         Initialize the object.
@@ -35,10 +44,13 @@ class Property:
         self._thing = thing
         self._name = name
         self.value = value
-        self._metadata = metadata if metadata is not None else {}
+        self._metadata = intern_metadata(metadata) if metadata is not None else {}
+        self.value.policy = NotifyPolicy.from_metadata(self._metadata)
         self._href_prefix = ""
-        self._href = f"/properties/{self._name}"
+        # None for the default /properties/{name}
+        self._href = None
         self._media_type = "application/json"
+        self._validator = None
 
     def validate_value(self, value):
         """
@@ -49,40 +61,38 @@ class Property:
             logger.error("Read-only property")
             raise PropertyError("Read-only property")
 
+        if self._validator is None:
+            self._validator = compile_validator(self.metadata, self.fast_validation)
+
         try:
-            validate(value, self.metadata)
+            self._validator(value)
         except ValidationError:
             logger.error(f"Invalid property value {value}")
             raise PropertyError(f"Invalid property value {value}")
 
-    @cached_property
+    @property
     def description(self):
         """
         Get the property description.
-        Returns a dictionary describing the property.
-        """
-        description = deepcopy(self.metadata)
-
-        if "links" not in description:
-            description["links"] = []
-
-        if description["@type"] in ["VideoProperty", "ImageProperty"]:
-            description["links"].append(
-                {"rel": "property", "href": self.href, "mediaType": self.media_type}
-            )
-        else:
-            description["links"].append(
+        Returns a dictionary describing the property, the values are shared
+        with the metadata.
+        """
+        metadata = self.metadata
+        return {
+            **metadata,
+            "links": [
+                *metadata.get("links", ()),
                 {
                     "rel": "property",
                     "href": self.href,
                     "mediaType": self.media_type,
-                }
-            )
-        return description
+                },
+            ],
+        }
 
     def clean_description_cache(self):
-        if self.__dict__.get("description"):
-            del self.__dict__["description"]
+        if self._thing is not None:
+            self._thing.invalidate_description()
 
     @property
     def href_prefix(self):
@@ -103,6 +113,8 @@ class Property:
         Get the href of this property.
         Returns the href.
         """
+        if self._href is None:
+            return f"{self._href_prefix}/properties/{self._name}"
         return self._href_prefix + self._href
 
     @href.setter
@@ -138,9 +150,10 @@ class Property:
         """
         Set the current value of the property.
         value -- the value to set
+        Returns whether the new value was notified, see NotifyPolicy.
         """
         self.validate_value(value)
-        await self.value.set(value, with_action=with_action)
+        return await self.value.set(value, with_action=with_action, serial=self._thing)
 
     @property
     def name(self):
@@ -159,11 +172,24 @@ class Property:
     def thing(self, thing):
         """Set the thing associated with this property."""
         self._thing = thing
+        if thing is not None:
+            thing.invalidate_description()
 
     @property
     def metadata(self):
         """Get the metadata associated with this property."""
         return self._metadata
 
+    @metadata.setter
+    def metadata(self, metadata):
+        """
+        Set the metadata associated with this property.
+        metadata -- the new metadata
+        """
+        self.clean_description_cache()
+        self._validator = None
+        self._metadata = intern_metadata(metadata)
+        self.value.policy = NotifyPolicy.from_metadata(self._metadata)
+
     def __repr__(self):
         return f"(Property {self._name})"
@@ -0,0 +1,69 @@
+"""
+Shared metadata for things of the same model.
+
+A fleet of identical devices describes its properties, actions and events
+with identical metadata. Everything interned here is kept once per
+distinct content and shared by every instance, so an instance only holds
+its id, its values and references. Interned objects must never be changed
+in place; assign a new dict through the owner's setter instead.
+"""
+
+import typing
+
+import orjson
+
+# beyond this many distinct entries metadata is no longer interned, so
+# per-instance content can't grow the registry without bound
+MAX_ENTRIES = 4096
+
+_metadata: typing.Dict[bytes, dict] = {}
+_interned: typing.Set[int] = set()
+_types: typing.Dict[typing.FrozenSet[str], typing.FrozenSet[str]] = {}
+_entries: typing.Dict[typing.Tuple[str, type, int], dict] = {}
+
+
+def intern_metadata(metadata: dict) -> dict:
+    """
+    Get the shared dict with the same content as some metadata.
+    metadata -- a JSON serializable dict
+    Returns the shared dict, or metadata itself if it can't be interned.
+    """
+    if id(metadata) in _interned:
+        return metadata
+    try:
+        key = orjson.dumps(metadata, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        return metadata
+
+    shared = _metadata.get(key)
+    if shared is None:
+        if len(_metadata) >= MAX_ENTRIES:
+            return metadata
+        shared = _metadata[key] = metadata
+        _interned.add(id(shared))
+    return shared
+
+
+def intern_types(types: typing.Iterable[str]) -> typing.FrozenSet[str]:
+    """Get the shared frozenset of some @type names."""
+    types = frozenset(types)
+    return _types.setdefault(types, types)
+
+
+def intern_entry(kind: str, cls: type, metadata: dict, **fields) -> dict:
+    """
+    Get the shared available_actions/available_events entry of a class.
+    kind -- "action" or "event"
+    cls -- the Action or Event class
+    metadata -- the metadata, shared only once interned
+    fields -- the other fields of a new entry
+    """
+    metadata = intern_metadata(metadata)
+    if id(metadata) not in _interned:
+        return {"metadata": metadata, **fields}
+
+    key = (kind, cls, id(metadata))
+    entry = _entries.get(key)
+    if entry is None:
+        entry = _entries[key] = {"metadata": metadata, **fields}
+    return entry
@@ -1,15 +1,18 @@
 """High-level Thing base class implementation."""
 
 import asyncio
+import time
+from hashlib import blake2b
 from typing import Dict, List, Optional
 
-from jsonschema import validate
+import orjson
 from jsonschema.exceptions import ValidationError
 
 from loguru import logger
 
 from .event import (
     Event,
+    EventStore,
     ThingPairingEvent,
     ThingPairedEvent,
     ThingRemovedEvent,
@@ -17,13 +20,25 @@ from .event import (
 )
 from .value import Value
 from .property import Property
-from .action import Action
+from .action import Action, ActionStore
 from .errors import PropertyError
+from .registry import intern_entry, intern_types
+from .validation import compile_validator
 
 from ..toolkits.event_bus import ee
+from ..toolkits.executor import call_forwarder
+from ..toolkits.metrics import Histogram
+from ..toolkits.throttle import Throttle
 from ..schema import InputMsg, OutMsg
 
 
+_dispatch_seconds = Histogram(
+    "thingtalk_dispatch_seconds",
+    "Time Thing.dispatch takes to handle a message.",
+    ("message_type",),
+)
+
+
 async def perform_action(action):
     """Perform an Action in a coroutine."""
     await action.start()
@@ -34,6 +49,16 @@ class Thing:
 
     type_alias = []
     description = ""
+    # bounds of the event history, see EventStore
+    max_events = 1000
+    max_events_per_name = None
+    max_event_age = None
+    # retention of completed actions, see ActionStore
+    max_completed_actions = 100
+    max_completed_action_age = None
+    # throttle of the propertyStatus messages on things/{id}/state for the
+    # properties without their own "throttle" metadata, see Throttle
+    state_throttle = None
 
     def __init__(self, id_: str, title: str, type_: Optional[List[str]]=None, description_: str=""):
         """
@@ -44,33 +69,42 @@ class Thing:
         owners_ -- the thing's owner(s)
         description -- description of the thing
         """
-        self._type: set[str] = set()
-
         if type_ is None:
             if self.type_alias is []:
-                self._type = self._type.union(set([self.__class__.__name__]))
+                types = [self.__class__.__name__]
             else:
-                self._type = self._type.union(set(self.type_alias))
+                types = self.type_alias
 
         elif not isinstance(type_, list):
-            self._type.add(type_)
+            types = [type_]
         else:
-            self._type = self._type.union(set(type_))
+            types = type_
+        # shared between things of the same types
+        self._type: frozenset[str] = intern_types(types)
 
         if not self.description:
             self.description = description_
 
+        # the cached Thing Description, rebuilt after any change to it
+        self._description_version = 0
+        self._thing_description: Optional[dict] = None
+        self._description_digest = ""
+
         self._id = id_
         self._context = "https://webthings.io/schemas"
         self._title = title
         self.properties: Dict[str, Property] = {}
         self.available_actions = {}
         self.available_events = {}
-        self.actions = {}
-        self.events = []
+        self.actions = ActionStore(self.max_completed_actions, self.max_completed_action_age)
+        self.events = EventStore(self.max_events, self.max_events_per_name, self.max_event_age)
         self.owners = []
+        # group tags, broadcast/{group} commands reach every thing in a group
+        self.groups: set[str] = set()
         self._href_prefix = ""
         self._ui_href = ""
+        # property name, "" for the thing's state_throttle -> Throttle
+        self._throttles: Dict[str, Throttle] = {}
         self.subscribe_topics = [f"things/{self._id}"]
         ee.on(f"things/{self._id}", self.dispatch)
 
@@ -81,33 +115,43 @@ class Thing:
         for topic in self.subscribe_topics:
             logger.info(f"remove topic {topic}'s listener dispatch")
             ee.remove_listener(topic, self.dispatch)
+        for throttle in self._throttles.values():
+            throttle.cancel()
 
     async def dispatch(self, message: InputMsg):
         logger.debug(f"dispatch {message}")
         msg_type = message.messageType
+        started = time.perf_counter()
 
-        if msg_type == "setProperty":
-            for property_name, property_value in message.data.items():
-                await self.set_property(property_name, property_value)
-
-        elif msg_type == "syncProperty":
-            for property_name, property_value in message.data.items():
-                await self.sync_property(property_name, property_value)
-
-        elif msg_type == "requestAction":
-            for action_name, action_params in message.data.items():
-                input_ = None
-                if "input" in action_params:
-                    input_ = action_params["input"]
-
-                action = await self.perform_action(action_name, input_)
-                if action:
-                    asyncio.create_task(perform_action(action))
-                else:
-                    await self.error_notify("Invalid action request", message)
+        try:
+            if msg_type == "setProperty":
+                try:
+                    await self.set_properties(message.data)
+                except PropertyError as e:
+                    await self.error_notify(str(e), message)
+
+            elif msg_type == "syncProperty":
+                for property_name, property_value in message.data.items():
+                    await self.sync_property(property_name, property_value)
+
+            elif msg_type == "requestAction":
+                for action_name, action_params in message.data.items():
+                    input_ = None
+                    if "input" in action_params:
+                        input_ = action_params["input"]
+
+                    action = await self.perform_action(action_name, input_)
+                    if action:
+                        asyncio.create_task(perform_action(action))
+                    else:
+                        await self.error_notify("Invalid action request", message)
 
-        else:
-            await self.error_notify(f"Unknown messageType: {msg_type}", message)
+            else:
+                await self.error_notify(f"Unknown messageType: {msg_type}", message)
+        finally:
+            _dispatch_seconds.labels(getattr(msg_type, "value", msg_type)).observe(
+                time.perf_counter() - started
+            )
 
     def as_thing_description(self):
         """
@@ -139,23 +183,26 @@ class Thing:
         }
 
         for name, action in self.available_actions.items():
-            thing["actions"][name] = action["metadata"]
-            thing["actions"][name]["links"] = [
-                {
-                    "rel": "action",
-                    "href": f"{self.href_prefix}/actions/{name}",
-                },
-            ]
+            thing["actions"][name] = {
+                **action["metadata"],
+                "links": [
+                    {
+                        "rel": "action",
+                        "href": f"{self.href_prefix}/actions/{name}",
+                    },
+                ],
+            }
 
         for name, event in self.available_events.items():
-            thing["events"][name] = event["metadata"]
-
-            thing["events"][name]["links"] = [
-                {
-                    "rel": "event",
-                    "href": f"{self.href_prefix}/events/{name}",
-                },
-            ]
+            thing["events"][name] = {
+                **event["metadata"],
+                "links": [
+                    {
+                        "rel": "event",
+                        "href": f"{self.href_prefix}/events/{name}",
+                    },
+                ],
+            }
 
         if self.ui_href:
             thing["links"].append(
@@ -173,6 +220,42 @@ class Thing:
 
         return thing
 
+    def get_thing_description(self) -> dict:
+        """
+        Get the Thing Description served by the API, with the thing's href
+        and security fields but without anything that depends on the host.
+        It is built once per description_version and shared, don't modify it.
+        """
+        if self._thing_description is None:
+            description = self.as_thing_description()
+            description["href"] = self.href
+            description["securityDefinitions"] = {
+                "nosec_sc": {"scheme": "nosec", },
+            }
+            description["security"] = "nosec_sc"
+            self._description_digest = blake2b(
+                orjson.dumps(description, option=orjson.OPT_NON_STR_KEYS),
+                digest_size=16,
+            ).hexdigest()
+            self._thing_description = description
+        return self._thing_description
+
+    @property
+    def description_version(self) -> int:
+        """Get a number that changes whenever the Thing Description does."""
+        return self._description_version
+
+    @property
+    def description_digest(self) -> str:
+        """Get a hash of the content of get_thing_description()."""
+        self.get_thing_description()
+        return self._description_digest
+
+    def invalidate_description(self):
+        """Drop the cached Thing Description, call after changing it."""
+        self._description_version += 1
+        self._thing_description = None
+
     @property
     def href(self) -> str:
         """Get this thing's href."""
@@ -193,13 +276,13 @@ class Thing:
         prefix -- the prefix
         """
         self._href_prefix = prefix
+        self.invalidate_description()
 
         for property_ in self.properties.values():
             property_.href_prefix = prefix
 
-        for action_name in self.actions.keys():
-            for action in self.actions[action_name]:
-                action.href_prefix = prefix
+        for action in self.actions:
+            action.href_prefix = prefix
 
     @property
     def ui_href(self) -> str:
@@ -213,6 +296,7 @@ class Thing:
         href -- the href
         """
         self._ui_href = href
+        self.invalidate_description()
 
     @property
     def id(self):
@@ -237,6 +321,7 @@ class Thing:
         title -- the new title
         """
         self._title = title
+        self.invalidate_description()
 
     @property
     def context(self):
@@ -267,34 +352,31 @@ class Thing:
         """
         return {k: v.description for k, v in self.properties.items()}
 
-    def get_action_descriptions(self, action_name=None):
+    def get_action_descriptions(self, action_name=None, limit=None, offset=0):
         """
         Get the thing's actions as an array.
         action_name -- Optional action name to get descriptions for
+        limit -- Optional maximum number of actions
+        offset -- number of actions to skip
         Returns the action descriptions.
         """
-        descriptions = []
-
-        if action_name is None:
-            for name in self.actions:
-                for action in self.actions[name]:
-                    descriptions.append(action.description)
-        elif action_name in self.actions:
-            for action in self.actions[action_name]:
-                descriptions.append(action.description)
+        return [
+            action.description
+            for action in self.actions.query(action_name, limit=limit, offset=offset)
+        ]
 
-        return descriptions
-
-    def get_event_descriptions(self, event_name=None):
+    def get_event_descriptions(self, event_name=None, since=None, limit=None):
         """
-        Get the thing's events as an array.
+        Get the thing's events as an array, oldest first.
         event_name -- Optional event name to get descriptions for
+        since -- Optional time in seconds since the epoch, skip older events
+        limit -- Optional maximum number of events, the most recent are kept
         Returns the event descriptions.
         """
-        if event_name is None:
-            return [e.description for e in self.events]
-        else:
-            return [e.description for e in self.events if e.name == event_name]
+        return [
+            e.description
+            for e in self.events.query(name=event_name, since=since, limit=limit)
+        ]
 
     def add_property(self, property_: Property):
         """
@@ -304,6 +386,7 @@ class Thing:
         property_.href_prefix = self._href_prefix
         property_.thing = self
         self.properties[property_.name] = property_
+        self.invalidate_description()
 
     def remove_property(self, property_: Property):
         """
@@ -312,6 +395,7 @@ class Thing:
         """
         if property_.name in self.properties:
             del self.properties[property_.name]
+            self.invalidate_description()
 
     def find_property(self, property_name: str):
         """
@@ -361,12 +445,56 @@ class Thing:
             return
         logger.info(f"set {self._title}'s property {property_name} to {value}")
         try:
-            await prop.set_value(value)
-            await self.property_notify({property_name: value})
+            if await prop.set_value(value):
+                await self.property_notify({property_name: value})
             await self.property_action(prop)
         except PropertyError as e:
             await self.error_notify(str(e))
 
+    async def set_properties(self, data: dict):
+        """
+        Set several property values as one batch.
+        Every value is validated before any forwarder runs, and nobody is
+        notified before every forwarder succeeded. That isn't a transaction:
+        when a forwarder fails, the forwarders before it have already written
+        their values to the device and aren't undone, the values are left
+        unchanged here and nobody is notified. Subscribers get one
+        propertyStatus and the device one properties_action call for the
+        whole batch, the propertyStatus only has the values their
+        NotifyPolicy lets through.
+        data -- dict of property_name -> value
+        Raises PropertyError if a property is unknown, a value invalid or a
+        forwarder failed.
+        """
+        if not data:
+            return
+
+        properties = []
+        for property_name, value in data.items():
+            prop = self.find_property(property_name)
+            if not prop:
+                raise PropertyError(f"{self._title} doesn't support {property_name}")
+            prop.validate_value(value)
+            properties.append(prop)
+
+        logger.info(f"set {self._title}'s properties {data}")
+        try:
+            for prop, value in zip(properties, data.values()):
+                forwarder = prop.value.value_forwarder
+                if forwarder is not None:
+                    await call_forwarder(forwarder, value, self)
+        except Exception as e:
+            raise PropertyError(f"Failed to set properties {data}: {e}") from e
+
+        notified = {}
+        for prop, value in zip(properties, data.values()):
+            if await prop.value.notify_of_external_update(value):
+                notified[prop.name] = value
+
+        if notified:
+            await self.property_notify(notified)
+        await self.properties_action(properties)
+
     async def sync_property(self, property_name: str, value):
         """
         Sync a property value from cloud or mqtt etc.
@@ -379,16 +507,16 @@ class Thing:
             return
         logger.info(f"sync {self._title}'s property {property_name} to {value}")
         try:
-            await prop.set_value(value, with_action=False)
-            await self.property_notify({property_name: value})
+            if await prop.set_value(value, with_action=False):
+                await self.property_notify({property_name: value})
         except PropertyError as e:
             await self.error_notify(str(e))
 
     async def bulk_sync_property(self, data: dict):
         """
         Bulk yync property value from cloud or mqtt etc.
-        property_name -- name of the property to set
-        value -- value to set
+        data -- dict of property_name -> value, left with the values that
+                were notified
         """
         for property_name, value in tuple(data.items()):
             prop = self.find_property(property_name)
@@ -398,11 +526,13 @@ class Thing:
                 continue
             logger.info(f"sync {self._title}'s property {property_name} to {value}")
             try:
-                await prop.set_value(value, with_action=False)
+                if not await prop.set_value(value, with_action=False):
+                    del data[property_name]
             except PropertyError as e:
                 del data[property_name]
                 await self.error_notify(str(e))
-        await self.property_notify(data)
+        if data:
+            await self.property_notify(data)
 
     def get_action(self, action_name, action_id):
         """
@@ -411,14 +541,7 @@ class Thing:
         action_id -- ID of the action
         Returns the requested action if found, else None.
         """
-        if action_name not in self.actions:
-            return None
-
-        for action in self.actions[action_name]:
-            if action.id == action_id:
-                return action
-
-        return None
+        return self.actions.get(action_name, action_id)
 
     async def add_event(self, event: Event):
         """
@@ -438,10 +561,8 @@ class Thing:
         if metadata is None:
             metadata = cls.schema
 
-        self.available_events[cls.title] = {
-            "metadata": metadata,
-            "subscribers": {},
-        }
+        self.available_events[cls.title] = intern_entry("event", cls, metadata, subscribers={})
+        self.invalidate_description()
 
     def add_available_events(self, evts):
         """
@@ -464,8 +585,12 @@ class Thing:
         action_type = self.available_actions[action_name]
 
         if "input" in action_type["metadata"]:
+            validator = action_type.get("validator")
+            if validator is None:
+                validator = compile_validator(action_type["metadata"]["input"])
+                action_type["validator"] = validator
             try:
-                validate(input_, action_type["metadata"]["input"])
+                validator(input_)
             except ValidationError as e:
                 logger.error(str(e))
                 return None
@@ -473,7 +598,7 @@ class Thing:
         action = action_type["class"](self, input_=input_)
         action.href_prefix = self.href_prefix
         await self.action_notify(action)
-        self.actions[action_name].append(action)
+        self.actions.add(action)
         return action
 
     async def remove_action(self, action_name, action_id):
@@ -488,7 +613,7 @@ class Thing:
             return False
 
         await action.cancel()
-        self.actions[action_name].remove(action)
+        self.actions.remove(action_name, action_id)
         return True
 
     def add_available_action(self, cls, metadata=None):
@@ -502,16 +627,17 @@ class Thing:
             metadata = cls.schema
 
         name = cls.title
-        self.available_actions[name] = {
-            "metadata": metadata,
-            "class": cls,
-        }
-        self.actions[name] = []
+        self.available_actions[name] = intern_entry("action", cls, metadata, **{"class": cls})
+        self.invalidate_description()
 
     async def property_notify(self, data: dict):
         """
         Notify all subscribers of a property change.
-        property_ -- the property that changed
+        Every change goes out on things/{id}/samples, for the rule engine.
+        On things/{id}/state, for websockets and the like, properties with a
+        "throttle" in their metadata, or all of them with a state_throttle,
+        are rate limited.
+        data -- property name -> new value
         """
         message = {
             "topic": f"things/{self.id}",
@@ -520,9 +646,54 @@ class Thing:
         }
         try:
             message = OutMsg(**message)
-            ee.emit(f"things/{self.id}/state", message)
         except ValidationError as e:
             logger.error(str(e))
+            return
+
+        ee.emit(f"things/{self.id}/samples", message)
+
+        immediate = None
+        for property_name, value in data.items():
+            throttle = self._throttle(property_name)
+            if throttle is not None:
+                throttle.push({property_name: value})
+            elif immediate is not None:
+                immediate[property_name] = value
+            else:
+                immediate = {property_name: value}
+
+        if immediate is None:
+            return
+        if len(immediate) < len(data):
+            message = OutMsg.construct(topic=message.topic, messageType=message.messageType, data=immediate)
+        ee.emit(f"things/{self.id}/state", message)
+
+    def _throttle(self, property_name: str) -> Optional[Throttle]:
+        """Get the throttle of a property's state updates, None for none."""
+        prop = self.properties.get(property_name)
+        spec = prop.metadata.get("throttle") if prop is not None else None
+        key = property_name
+        if spec is None:
+            spec, key = self.state_throttle, ""
+            if spec is None:
+                return None
+
+        throttle = self._throttles.get(key)
+        if throttle is None or throttle.spec is not spec:
+            if throttle is not None:
+                throttle.flush()
+            throttle = self._throttles[key] = Throttle.from_spec(self._emit_state, spec)
+        return throttle
+
+    def _emit_state(self, data: dict):
+        """Send throttled property updates on things/{id}/state."""
+        message = OutMsg.construct(topic=f"things/{self.id}", messageType="propertyStatus", data=data)
+        ee.emit(f"things/{self.id}/state", message)
+
+    def flush_throttles(self):
+        """Send every throttled property update now."""
+        for throttle in tuple(self._throttles.values()):
+            throttle.flush()
 
     async def error_notify(self, error_, request=None):
         """
@@ -553,6 +724,16 @@ class Thing:
         """
         pass
 
+    async def properties_action(self, properties: List[Property]):
+        """
+        Addional action when several properties change in one batch.
+        Calls property_action for each property by default, override it to
+        send the whole batch to the device at once.
+        properties -- the properties that changed
+        """
+        for property_ in properties:
+            await self.property_action(property_)
+
     async def action_notify(self, action: Action):
         """
         Notify all subscribers of an action status change.
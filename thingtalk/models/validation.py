@@ -0,0 +1,113 @@
+"""Compiled JSON schema validators, shared between equal schemas."""
+
+import typing
+
+from functools import lru_cache
+
+import orjson
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+Validator = typing.Callable[[typing.Any], None]
+
+_NUMERIC_KEYWORDS = {"type", "minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum"}
+_ENUM_KEYWORDS = {"type", "enum"}
+
+
+def compile_validator(schema: dict, fast_path: bool = True) -> Validator:
+    """
+    Get a validate function for a schema.
+    The schema is checked and compiled once, every equal schema shares the
+    same validator afterwards.
+    schema -- the JSON schema, e.g. a property's metadata
+    fast_path -- accept common primitive values without calling jsonschema
+    Returns a function raising jsonschema's ValidationError for bad values.
+    """
+    try:
+        key = orjson.dumps(schema, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        # not JSON serializable, so it can't be shared either
+        return _compile(schema, fast_path)
+
+    return _compile_cached(key, fast_path)
+
+
+@lru_cache(maxsize=1024)
+def _compile_cached(key: bytes, fast_path: bool) -> Validator:
+    return _compile(orjson.loads(key), fast_path)
+
+
+def _compile(schema: dict, fast_path: bool) -> Validator:
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    validator = cls(schema)
+
+    def validate(value):
+        error = best_match(validator.iter_errors(value))
+        if error is not None:
+            raise error
+
+    if fast_path:
+        accepts = _primitive_predicate(schema, set(cls.VALIDATORS) & set(schema))
+        if accepts is not None:
+            def validate_fast(value):
+                # anything the fast path doesn't accept is left to jsonschema,
+                # so the outcome and error messages stay exactly the same
+                if not accepts(value):
+                    validate(value)
+
+            return validate_fast
+
+    return validate
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _primitive_predicate(schema: dict, keywords: set) -> typing.Optional[typing.Callable[[typing.Any], bool]]:
+    """
+    Build a predicate accepting values that are certainly valid for simple
+    boolean, numeric and string enum schemas, None for everything else.
+    """
+    type_ = schema.get("type")
+
+    if type_ == "boolean" and keywords == {"type"}:
+        return lambda value: value is True or value is False
+
+    if type_ == "string" and keywords <= _ENUM_KEYWORDS:
+        enum = schema.get("enum")
+        if enum is None:
+            return lambda value: isinstance(value, str)
+        if not all(isinstance(member, str) for member in enum):
+            return None
+        members = frozenset(enum)
+        return lambda value: isinstance(value, str) and value in members
+
+    if type_ in ("integer", "number") and keywords <= _NUMERIC_KEYWORDS:
+        bounds = [schema.get(keyword) for keyword in
+                  ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum")]
+        # draft 4 style boolean exclusive bounds are left to jsonschema
+        if not all(bound is None or _is_number(bound) for bound in bounds):
+            return None
+        minimum, maximum, exclusive_minimum, exclusive_maximum = bounds
+        integer = type_ == "integer"
+
+        def accepts(value) -> bool:
+            if not _is_number(value):
+                return False
+            if integer and not isinstance(value, int):
+                return False
+            if minimum is not None and not value >= minimum:
+                return False
+            if maximum is not None and not value <= maximum:
+                return False
+            if exclusive_minimum is not None and not value > exclusive_minimum:
+                return False
+            if exclusive_maximum is not None and not value < exclusive_maximum:
+                return False
+            return True
+
+        return accepts
+
+    return None
@@ -1,9 +1,106 @@
 """An observable, settable value interface."""
 
-from pyee.asyncio import AsyncIOEventEmitter as EventEmitter
+import asyncio
+import time
+import typing
 
+from functools import lru_cache
 
-class Value(EventEmitter):
+import orjson
+from loguru import logger
+
+from ..toolkits.executor import call_forwarder
+
+Listener = typing.Callable[..., typing.Any]
+
+# tasks of coroutine listeners, referenced until they finish
+_pending: typing.Set[asyncio.Future] = set()
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class NotifyPolicy:
+    """
+    When a new value is worth notifying, declared in a property's metadata
+    under "notify":
+        "always" -- every update, the default
+        "onChange" -- only values different from the last notified one
+        {"deadband": 0.5} -- numbers moving more than 0.5 from the last
+                             notified value
+        {"deadbandPercent": 2} -- numbers moving more than 2% of the last
+                                  notified value
+        {"maxSilence": 300} -- added to any of the above, an update is
+                               notified anyway if nothing was for 300 seconds
+    With both deadbands the larger one applies. Non numeric values fall
+    back to onChange.
+    """
+
+    __slots__ = ("deadband", "deadband_percent", "max_silence")
+
+    def __init__(self, deadband: float = 0, deadband_percent: float = 0,
+                 max_silence: typing.Optional[float] = None):
+        """
+        Initialize the object.
+        deadband -- absolute change a number must exceed, 0 for any change
+        deadband_percent -- change relative to the last notified number
+        max_silence -- seconds after which an update is notified regardless
+        """
+        if deadband < 0 or deadband_percent < 0 or (max_silence is not None and max_silence < 0):
+            raise ValueError("notify deadbands and maxSilence can't be negative")
+        self.deadband = deadband
+        self.deadband_percent = deadband_percent
+        self.max_silence = max_silence
+
+    @classmethod
+    def from_metadata(cls, metadata: dict) -> typing.Optional["NotifyPolicy"]:
+        """
+        Get the policy declared in property metadata.
+        Returns None for "always", policies are shared between equal specs.
+        """
+        spec = metadata.get("notify")
+        if spec is None or spec == "always":
+            return None
+        return _policy(orjson.dumps(spec, option=orjson.OPT_SORT_KEYS))
+
+    def significant(self, previous, value, elapsed: float) -> bool:
+        """
+        Check whether a value is worth notifying.
+        previous -- the last notified value
+        value -- the new value
+        elapsed -- seconds since previous was notified
+        """
+        if self.max_silence is not None and elapsed >= self.max_silence:
+            return True
+        if (self.deadband or self.deadband_percent) and _is_number(value) and _is_number(previous):
+            band = max(self.deadband, abs(previous) * self.deadband_percent / 100)
+            return abs(value - previous) > band
+        return value != previous
+
+    def __repr__(self):
+        return (f"NotifyPolicy(deadband={self.deadband}, deadband_percent={self.deadband_percent}, "
+                f"max_silence={self.max_silence})")
+
+
+@lru_cache(maxsize=256)
+def _policy(key: bytes) -> NotifyPolicy:
+    spec = orjson.loads(key)
+    if spec == "onChange":
+        return NotifyPolicy()
+    if not isinstance(spec, dict):
+        raise ValueError(f"unknown notify policy {spec!r}")
+    unknown = set(spec) - {"mode", "deadband", "deadbandPercent", "maxSilence"}
+    if unknown or spec.get("mode", "onChange") != "onChange":
+        raise ValueError(f"unknown notify policy {spec!r}")
+    return NotifyPolicy(
+        deadband=spec.get("deadband", 0),
+        deadband_percent=spec.get("deadbandPercent", 0),
+        max_silence=spec.get("maxSilence"),
+    )
+
+
+class Value:
     """
     A property value.
     This is used for communicating between the Thing representation and the
@@ -11,42 +108,194 @@ class Value(EventEmitter):
     Notifies all observers when the underlying value changes through an
     external update (command to turn the light off) or if the underlying sensor
     reports a new value.
+
+    Observers are registered with the pyee style on/once/remove_listener
+    methods, 'update' and 'sync' are the events emitted. Listeners are
+    called synchronously, a coroutine listener is scheduled on the running
+    loop. A value without observers carries no listener storage at all.
+    Exceptions go to the 'error' listeners, or are raised if there are none.
+
+    With a NotifyPolicy, updates that aren't significant only change
+    last_value, nobody is notified.
     """
 
+    __slots__ = ("last_value", "value_forwarder", "policy", "_observers", "_notified", "_notified_at")
+
     def __init__(self, initial_value, value_forwarder=None):
         """
         Initialize the object.
         initial_value -- the initial value
         value_forwarder -- the method that updates the actual value on the
-                           thing
+                           thing, a coroutine function is awaited, a plain
+                           callable runs on the driver thread pool
         """
-        EventEmitter.__init__(self)
         self.last_value = initial_value
         self.value_forwarder = value_forwarder
+        self.policy: typing.Optional[NotifyPolicy] = None
+        # the last value observers know of, for the policy
+        self._notified = initial_value
+        self._notified_at = time.monotonic()
+        # event -> listener -> whether it only runs once, None until used
+        self._observers: typing.Optional[typing.Dict[str, typing.Dict[Listener, bool]]] = None
 
-    async def set(self, value, with_action=True):
+    async def set(self, value, with_action=True, serial=None) -> bool:
         """
         Set a new value for this thing.
         value -- value to set
         with_action -- do property action
+        serial -- blocking forwarders with the same key, usually the thing,
+                  run one at a time and in order
+        Returns whether observers were notified.
         """
         if self.value_forwarder is not None:
-            self.value_forwarder(value)
+            await call_forwarder(self.value_forwarder, value, serial)
 
-        await self.notify_of_external_update(value, with_action=with_action)
+        return await self.notify_of_external_update(value, with_action=with_action)
 
     async def get(self):
         """Return the last known value from the underlying thing."""
         return self.last_value
 
-    async def notify_of_external_update(self, value, with_action=True):
+    async def notify_of_external_update(self, value, with_action=True) -> bool:
         """
         Notify observers of a new value.
         value -- new value
+        Returns whether the value was notified, False if the policy
+        suppressed it.
         """
-        if value is not None:
-            self.last_value = value
+        if value is None:
+            return False
+
+        self.last_value = value
+        policy = self.policy
+        if policy is not None:
+            now = time.monotonic()
+            if not policy.significant(self._notified, value, now - self._notified_at):
+                return False
+            self._notified = value
+            self._notified_at = now
+
+        if self._observers is not None:
             if with_action:
                 self.emit('update', value)
             else:
                 self.emit('sync', value)
+        return True
+
+    def reset(self, value):
+        """
+        Set the last value without notifying anyone, e.g. to roll back.
+        The policy compares the next update against this value.
+        value -- the value
+        """
+        self.last_value = value
+        self._notified = value
+
+    def on(self, event: str, f: typing.Optional[Listener] = None):
+        """
+        Register the function f to the event.
+        Like pyee, this can be used as a decorator when f is omitted.
+        """
+        if f is None:
+            def decorator(f: Listener) -> Listener:
+                self._add(event, f, False)
+                return f
+
+            return decorator
+
+        self._add(event, f, False)
+        return f
+
+    add_listener = on
+
+    def once(self, event: str, f: typing.Optional[Listener] = None):
+        """Register the function f to the event, for its next emit only."""
+        if f is None:
+            def decorator(f: Listener) -> Listener:
+                self._add(event, f, True)
+                return f
+
+            return decorator
+
+        self._add(event, f, True)
+        return f
+
+    def remove_listener(self, event: str, f: Listener) -> None:
+        """Remove the function f from the event."""
+        if self._observers is None:
+            return
+        listeners = self._observers.get(event)
+        if listeners is not None:
+            listeners.pop(f, None)
+            if not listeners:
+                del self._observers[event]
+                if not self._observers:
+                    self._observers = None
+
+    def remove_all_listeners(self, event: typing.Optional[str] = None) -> None:
+        """Remove all listeners of an event, or of every event."""
+        if event is None:
+            self._observers = None
+        elif self._observers is not None:
+            self._observers.pop(event, None)
+            if not self._observers:
+                self._observers = None
+
+    def listeners(self, event: str) -> typing.List[Listener]:
+        """Get the listeners of an event."""
+        if self._observers is None:
+            return []
+        return list(self._observers.get(event, ()))
+
+    def event_names(self) -> typing.Set[str]:
+        """Get the events that have listeners."""
+        if self._observers is None:
+            return set()
+        return set(self._observers)
+
+    def emit(self, event: str, *args, **kwargs) -> bool:
+        """
+        Call every listener of the event.
+        Returns whether any listener was called.
+        """
+        listeners = self._observers.get(event) if self._observers is not None else None
+        if not listeners:
+            if event == 'error':
+                error = args[0] if args else None
+                if isinstance(error, Exception):
+                    raise error
+                raise RuntimeError(f"Uncaught, unspecified 'error' event: {error}")
+            return False
+
+        for f, once in tuple(listeners.items()):
+            if once:
+                self.remove_listener(event, f)
+            self._emit_run(f, args, kwargs)
+        return True
+
+    def _add(self, event: str, f: Listener, once: bool):
+        if self._observers is None:
+            self._observers = {}
+        self._observers.setdefault(event, {})[f] = once
+
+    def _emit_run(self, f: Listener, args, kwargs):
+        try:
+            result = f(*args, **kwargs)
+        except Exception as e:
+            # like pyee, this raises unless someone listens on 'error'
+            self.emit('error', e)
+            return
+
+        if asyncio.iscoroutine(result):
+            future = asyncio.ensure_future(result)
+            _pending.add(future)
+            future.add_done_callback(self._done)
+
+    def _done(self, future: asyncio.Future):
+        _pending.discard(future)
+        if future.cancelled() or future.exception() is None:
+            return
+        if self.listeners('error'):
+            self.emit('error', future.exception())
+        else:
+            logger.opt(exception=future.exception()).error(f"listener of {self!r} failed")
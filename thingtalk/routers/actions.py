@@ -1,7 +1,7 @@
 import typing
 import asyncio
 
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Query
 from fastapi.exceptions import HTTPException
 from fastapi.responses import ORJSONResponse, Response
 
@@ -17,13 +17,18 @@ async def perform_action(action):
 
 
 @router.get("/actions")
-async def get_actions(thing: Thing = Depends(get_thing)) -> ORJSONResponse:
+async def get_actions(
+        limit: typing.Optional[int] = Query(None, ge=1),
+        offset: int = Query(0, ge=0),
+        thing: Thing = Depends(get_thing)) -> ORJSONResponse:
     """
     Handle a request to /actions.
+    :param limit -- the maximum number of actions returned
+    :param offset -- the number of actions skipped
     :param thing-- the thing this request is for
     :return ORJSONResponse
     """
-    return ORJSONResponse(thing.get_action_descriptions())
+    return ORJSONResponse(thing.get_action_descriptions(limit=limit, offset=offset))
 
 
 @router.post("/actions")
@@ -54,15 +59,19 @@ async def revoke_actions(
 @router.get("/actions/{action_name}")
 async def get_action(
         action_name: str,
+        limit: typing.Optional[int] = Query(None, ge=1),
+        offset: int = Query(0, ge=0),
         thing: Thing = Depends(get_thing)) -> ORJSONResponse:
     """
     Handle a request to /actions/<action_name>.
     :param thing -- the thing this request is for
     :param action_name -- name of the action from the URL path
+    :param limit -- the maximum number of actions returned
+    :param offset -- the number of actions skipped
     :return ORJSONResponse
     """
     return ORJSONResponse(
-        thing.get_action_descriptions(action_name=action_name)
+        thing.get_action_descriptions(action_name=action_name, limit=limit, offset=offset)
     )
 
 
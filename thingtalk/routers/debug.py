@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from fastapi.requests import Request
+from fastapi.responses import ORJSONResponse
+
+router = APIRouter()
+
+
+@router.get("/debug/slow")
+async def get_slow(request: Request) -> ORJSONResponse:
+    """
+    Handle a request to /debug/slow.
+    :param request -- the request
+    :return ORJSONResponse with the loop lag and the slow callbacks
+    """
+    return ORJSONResponse(request.app.state.monitor.report())
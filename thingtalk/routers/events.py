@@ -1,4 +1,7 @@
-from fastapi import Depends, APIRouter
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import Depends, APIRouter, Query
 from fastapi.responses import ORJSONResponse
 
 from ..dependencies import get_thing
@@ -7,22 +10,46 @@ from ..models.thing import Thing
 router = APIRouter()
 
 
+def _epoch(since: Optional[datetime]) -> Optional[float]:
+    if since is None:
+        return None
+    if since.tzinfo is None:
+        # event timestamps are UTC
+        since = since.replace(tzinfo=timezone.utc)
+    return since.timestamp()
+
+
 @router.get("/events")
-async def get_events(thing: Thing = Depends(get_thing)) -> ORJSONResponse:
+async def get_events(
+    since: Optional[datetime] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    thing: Thing = Depends(get_thing),
+) -> ORJSONResponse:
     """
     Handle a request to /events.
+    :param since -- only events at or after this time
+    :param limit -- only the most recent events, at most this many
     :param thing -- the thing this request is for
     :return ORJSONResponse
     """
-    return ORJSONResponse(thing.get_event_descriptions())
+    return ORJSONResponse(thing.get_event_descriptions(since=_epoch(since), limit=limit))
 
 
 @router.get("/events/{event_name}")
-async def get_event(event_name: str, thing: Thing = Depends(get_thing)) -> ORJSONResponse:
+async def get_event(
+    event_name: str,
+    since: Optional[datetime] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    thing: Thing = Depends(get_thing),
+) -> ORJSONResponse:
     """
     Handle a request to /events/<event_name>.
     :param thing -- the thing this request is for
     :param event_name -- name of the event from the URL path
+    :param since -- only events at or after this time
+    :param limit -- only the most recent events, at most this many
     :return ORJSONResponse
     """
-    return ORJSONResponse(thing.get_event_descriptions(event_name=event_name))
+    return ORJSONResponse(thing.get_event_descriptions(
+        event_name=event_name, since=_epoch(since), limit=limit
+    ))
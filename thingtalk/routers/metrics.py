@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..toolkits.metrics import CONTENT_TYPE, REGISTRY
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """
+    Handle a request to /metrics.
+    :return PlainTextResponse in the Prometheus text exposition format
+    """
+    return PlainTextResponse(REGISTRY.expose(), media_type=CONTENT_TYPE)
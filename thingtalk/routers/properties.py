@@ -1,6 +1,8 @@
+import math
+import time
 import typing
 
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Query, Request
 from fastapi.exceptions import HTTPException
 from fastapi.responses import ORJSONResponse
 
@@ -10,6 +12,10 @@ from ..models.errors import PropertyError
 
 router = APIRouter()
 
+# buckets of a history query without a step, and at most with one
+HISTORY_BUCKETS = 500
+MAX_HISTORY_BUCKETS = 10000
+
 
 @router.get("/properties")
 async def get_properties(thing: Thing = Depends(get_thing)) -> ORJSONResponse:
@@ -21,6 +27,26 @@ async def get_properties(thing: Thing = Depends(get_thing)) -> ORJSONResponse:
     return ORJSONResponse(await thing.get_properties())
 
 
+@router.put("/properties")
+async def put_properties(
+        data: typing.Dict[str, typing.Any],
+        thing: Thing = Depends(get_thing)) -> ORJSONResponse:
+    """
+    Handle a PUT request to /properties, setting several properties at once.
+    :param data -- property name -> value, validated all before any is set
+    :param thing -- the thing this request is for
+    :return: ORJSONResponse
+    """
+    try:
+        await thing.set_properties(data)
+    except PropertyError:
+        raise HTTPException(status_code=400)
+
+    return ORJSONResponse(
+        {property_name: await thing.get_property(property_name) for property_name in data}
+    )
+
+
 @router.get("/properties/{property_name}")
 async def get_property(
         property_name: str,
@@ -36,6 +62,45 @@ async def get_property(
     )
 
 
+@router.get("/properties/{property_name}/history")
+async def get_property_history(
+        request: Request,
+        property_name: str,
+        from_: typing.Optional[float] = Query(None, alias="from"),
+        to: typing.Optional[float] = None,
+        step: typing.Optional[float] = None,
+        thing: Thing = Depends(check_property_and_get_thing)) -> ORJSONResponse:
+    """
+    Handle a request to /properties/<property>/history.
+    :param request -- the request
+    :param property_name -- name of the thing property this request is for
+    :param from_ -- start of the range in seconds since the epoch, an hour
+                    before the end by default
+    :param to -- end of the range in seconds since the epoch, now by default
+    :param step -- seconds per bucket, the range split in 500 by default
+    :param thing -- the thing this request is for
+    :return: ORJSONResponse with the columns of the min/max/avg buckets
+    """
+    history = request.app.state.history
+    series = history.get_series(thing.id, property_name) if history is not None else None
+    if series is None:
+        raise HTTPException(status_code=404)
+
+    end = time.time() if to is None else to
+    start = end - 3600 if from_ is None else from_
+    if step is None:
+        step = (end - start) / HISTORY_BUCKETS
+    # nan passes every comparison below, inf would make a bucket index
+    if not all(math.isfinite(bound) for bound in (start, end, step)):
+        raise HTTPException(status_code=400)
+    if start >= end or step <= 0 or (end - start) / step > MAX_HISTORY_BUCKETS:
+        raise HTTPException(status_code=400)
+
+    return ORJSONResponse(
+        {"from": start, "to": end, "step": step, **await series.query(start, end, step)}
+    )
+
+
 @router.put("/properties/{property_name}")
 async def put_property(
         property_name: str,
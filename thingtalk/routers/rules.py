@@ -9,18 +9,21 @@ from fastapi import Depends, APIRouter
 from fastapi.exceptions import HTTPException
 from fastapi.responses import ORJSONResponse
 
-from tinydb import TinyDB, Query
-
 from ..rule_engine import RuleEngine, RuleInput, Rule
+from ..toolkits.storage import open_database
 
 router = APIRouter()
 
 
-data_ref = os.environ.get("TINY_DB", '/data/db.json')
-# data_ref = os.environ.get("TINY_DB", '/tmp/db.json')
-db = TinyDB(data_ref)
+data_ref = os.environ.get("SQLITE_DB", '/data/db.sqlite3')
+# data_ref = os.environ.get("SQLITE_DB", '/tmp/db.sqlite3')
+# the TinyDB file of earlier versions, imported on first use
+legacy_ref = os.environ.get("TINY_DB", '/data/db.json')
+db = open_database(data_ref, legacy_path=legacy_ref)
 
 table = db.table("rules")
+# writes are held back for a moment, flush them when the app stops
+router.add_event_handler("shutdown", db.close)
 re = RuleEngine()
 
 
@@ -29,17 +32,17 @@ async def create_rules(rules: typing.List[typing.Optional[RuleInput]]):
     for rule in rules:
         rule_data = rule.dict()
         rule_data.update({"id": str(uuid.uuid4())})
-        table.insert(rule_data)
-        await re.load_rule(rule_data)
+        await table.insert(rule_data)
+        await re.load_rule(Rule(**rule_data))
 
-    data = table.all()
+    data = await table.all()
 
     return ORJSONResponse({"rules": data})
 
 
 @router.get("/rules")
 async def get_rules():
-    data = table.all()
+    data = await table.all()
     return ORJSONResponse({"rules": data})
 
 
@@ -50,7 +53,7 @@ async def create_rule(rule: RuleInput):
     try:
         logger.debug(rule_data)
         rule = Rule(**rule_data)
-        table.insert(rule_data)
+        await table.insert(rule_data)
         await re.load_rule(rule)
     except ValidationError as e:
         logger.error(str(e))
@@ -61,32 +64,22 @@ async def create_rule(rule: RuleInput):
 
 @router.put("/rules/{rule_id}")
 async def update_rule(rule_id: str, rule_data: dict):
-    RuleModel = Query()
-    rule = table.get(RuleModel.id == rule_id)
-
-    if rule:
-        for pre in rule.get("premise"):
-            await re.disable_rule(f"things_{pre.get('topic').split('/')[1]}_{pre.get('name')}_{pre.get('value')}", rule_id)
+    rule = await table.update(rule_id, rule_data)
+    if rule is None:
+        raise HTTPException(status_code=404)
 
-    doc_ids = table.update(rule_data, RuleModel.id == rule_id)
-    if doc_ids:
-        rule = table.get(RuleModel.id == rule_id)
-        try:
-            rule = Rule(**rule)
-            await re.load_rule(rule)
-        except ValidationError as e:
-            logger.error(str(e))
+    await re.disable_rule(rule_id)
+    try:
+        await re.load_rule(Rule(**rule))
+    except ValidationError as e:
+        logger.error(str(e))
 
-    return ORJSONResponse(rule.dict())
+    return ORJSONResponse(rule)
 
 
 @router.delete("/rules/{rule_id}")
 async def delete_rule(rule_id: str):
-    RuleModel = Query()
-    rule = table.get(RuleModel.id == rule_id)
-    if rule:
-        for pre in rule.get("premise"):
-            await re.disable_rule(f"things_{pre.get('topic').split('/')[1]}_{pre.get('name')}_{pre.get('value')}", rule_id)
-        table.remove(RuleModel.id == rule_id)
+    if await table.remove(rule_id):
+        await re.disable_rule(rule_id)
 
     return ORJSONResponse({"msg": "success"})
@@ -8,20 +8,24 @@ from loguru import logger
 from pydantic import ValidationError, BaseModel, constr
 
 from fastapi import Depends, APIRouter
+from fastapi.exceptions import HTTPException
 from fastapi.responses import ORJSONResponse
 
-from tinydb import TinyDB, Query
-
 from ..toolkits.event_bus import ee
+from ..toolkits.storage import open_database
 
 
 router = APIRouter()
 
-data_ref = os.environ.get("TINY_DB", '/data/db.json')
-# data_ref = os.environ.get("TINY_DB", '/tmp/db.json')
-db = TinyDB(data_ref)
+data_ref = os.environ.get("SQLITE_DB", '/data/db.sqlite3')
+# data_ref = os.environ.get("SQLITE_DB", '/tmp/db.sqlite3')
+# the TinyDB file of earlier versions, imported on first use
+legacy_ref = os.environ.get("TINY_DB", '/data/db.json')
+db = open_database(data_ref, legacy_path=legacy_ref)
 
 table = db.table("scenes")
+# writes are held back for a moment, flush them when the app stops
+router.add_event_handler("shutdown", db.close)
 
 
 {
@@ -78,9 +82,8 @@ class SceneMsg(BaseModel):
 
 async def run_scene_by_id(scene_data: SceneMsg):
     scene_id = scene_data.topic.split("/")[1]
-    SceneModel = Query()
     logger.debug(scene_id)
-    scene = table.get(SceneModel.id == scene_id)
+    scene = await table.get(scene_id)
     logger.debug(scene)
     if scene:
         try:
@@ -94,7 +97,7 @@ async def run_scene_by_id(scene_data: SceneMsg):
 
 @router.get("/scenes")
 async def get_scenes():
-    data = table.all()
+    data = await table.all()
     return ORJSONResponse({"scenes": data})
 
 
@@ -103,25 +106,23 @@ async def create_scene(scene: SceneInput):
     scene_data = scene.dict()
     scene_data.update({"id": str(uuid.uuid4())})
     logger.debug(scene_data)
-    table.insert(scene_data)
+    await table.insert(scene_data)
 
     return ORJSONResponse(scene_data)
 
 
 @router.put("/scenes/{scene_id}")
 async def update_scene(scene_id: str, scene_data: dict):
-    SceneModel = Query()
-    doc_ids = table.update(scene_data, SceneModel.id == scene_id)
-    if doc_ids:
-        rule = table.get(SceneModel.id == scene_id)
+    scene = await table.update(scene_id, scene_data)
+    if scene is None:
+        raise HTTPException(status_code=404)
 
-    return ORJSONResponse(rule)
+    return ORJSONResponse(scene)
 
 
 @router.post("/scenes/{scene_id}")
 async def run_scene(scene_id: str):
-    SceneModel = Query()
-    scene = table.get(SceneModel.id == scene_id)
+    scene = await table.get(scene_id)
     logger.debug(scene)
     if scene:
         try:
@@ -144,9 +145,6 @@ async def run_scene(scene_id: str):
 
 @router.delete("/scenes/{scene_id}")
 async def delete_scene(scene_id: str):
-    SceneModel = Query()
-    rule = table.get(SceneModel.id == scene_id)
-    if rule:
-        table.remove(SceneModel.id == scene_id)
+    await table.remove(scene_id)
 
     return ORJSONResponse({"msg": "success"})
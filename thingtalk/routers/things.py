@@ -1,70 +1,242 @@
-import copy
+import asyncio
+import typing
 
-from fastapi import APIRouter
+from hashlib import blake2b
+
+import orjson
+from fastapi import APIRouter, Query
 from fastapi import Depends
 from fastapi.requests import Request
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 
 from ..dependencies import get_thing
+from ..models.errors import PropertyError
 from ..models.thing import Thing
 from ..utils import get_http_href, get_ws_href
 
 router = APIRouter()
 
+NDJSON = "application/x-ndjson"
+
+
+def layer_description(thing: Thing, http_href: str, ws_href: str) -> dict:
+    """
+    Add the host dependent fields to a thing's cached description.
+    Only the top level and the links are copied, the rest is shared.
+    :param thing -- the thing to describe
+    :param http_href -- the http origin of the request
+    :param ws_href -- the websocket origin of the request
+    :return the Thing Description
+    """
+    description = thing.get_thing_description()
+    return {
+        **description,
+        "links": [
+            *description["links"],
+            {
+                "rel": "alternate",
+                "href": f"{ws_href}{thing.href}",
+            },
+        ],
+        "base": f"{http_href}{thing.href}",
+    }
+
+
+def make_etag(digests: typing.Iterable[str], http_href: str, ws_href: str, variant: str = "") -> str:
+    """
+    Get a strong ETag for descriptions served to one origin.
+    :param digests -- the description_digest of every thing in the response
+    :param http_href -- the http origin of the request
+    :param ws_href -- the websocket origin of the request
+    :param variant -- anything else the response bytes depend on
+    """
+    h = blake2b(f"{http_href}\n{ws_href}\n{variant}".encode(), digest_size=16)
+    for digest in digests:
+        h.update(digest.encode())
+    return f'"{h.hexdigest()}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Check whether the client's If-None-Match already has this ETag."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag:
+            return True
+    return False
+
+
+async def stream_descriptions(things: typing.List[Thing], http_href: str, ws_href: str):
+    """Serialize one Thing Description per line, as the response is sent."""
+    for thing in things:
+        yield orjson.dumps(layer_description(thing, http_href, ws_href)) + b"\n"
+
 
 @router.get("/things")
-async def get_things(request: Request) -> ORJSONResponse:
+async def get_things(
+        request: Request,
+        limit: typing.Optional[int] = Query(None, ge=1),
+        cursor: typing.Optional[str] = None,
+        type_: typing.Optional[str] = Query(None, alias="@type")) -> Response:
     """
     Handle a request to / when the server manages multiple things.
     Handle a GET request.
+    Things are ordered by id. When a limit cuts the list short, a Link
+    header with rel="next" points to the next page. Clients accepting
+    application/x-ndjson get one Thing Description per line, streamed,
+    without an ETag: it would need every description before the first
+    line is sent.
     :param request -- the request
-    :return ORJSONResponse
+    :param limit -- the maximum number of things returned
+    :param cursor -- only things after this id, from the next link
+    :param type_ -- only things with this @type
+    :return the descriptions, or an empty 304 if the client's copy is current
     """
-    things = request.app.state.things
+    pairs = await request.app.state.things.get_things(
+        type_=type_, cursor=cursor, limit=limit + 1 if limit is not None else None
+    )
+    things = [thing for _, thing in pairs]
+    http_href, ws_href = get_http_href(request), get_ws_href(request)
 
-    descriptions = []
-    for idx, thing in tuple(await things.get_things()):
-        description = thing.as_thing_description()
-        description["href"] = thing.href
-        description["links"].append({
-            "rel": "alternate",
-            "href": f"{get_ws_href(request)}{thing.href}",
-        })
-        description["base"] = f"{get_http_href(request)}{thing.href}"
+    headers = {"Vary": "Accept"}
+    if limit is not None and len(things) > limit:
+        things = things[:limit]
+        next_url = request.url.include_query_params(cursor=things[-1].id, limit=limit)
+        headers["Link"] = f'<{next_url}>; rel="next"'
 
-        description["securityDefinitions"] = {
-            "nosec_sc": {"scheme": "nosec", },
-        }
-        description["security"] = "nosec_sc"
+    if NDJSON in request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_descriptions(things, http_href, ws_href),
+            media_type=NDJSON,
+            headers=headers,
+        )
 
-        bak = copy.deepcopy(description)
-        descriptions.append(bak)
+    headers["ETag"] = make_etag(
+        (thing.description_digest for thing in things),
+        http_href,
+        ws_href,
+        variant=headers.get("Link", ""),
+    )
+    if not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
 
-    return ORJSONResponse(descriptions)
+    return ORJSONResponse(
+        [layer_description(thing, http_href, ws_href) for thing in things],
+        headers=headers,
+    )
 
 
 @router.get("/things/{thing_id}")
 async def get_thing_by_id(
         request: Request,
-        thing: Thing = Depends(get_thing)) -> ORJSONResponse:
+        thing: Thing = Depends(get_thing)) -> Response:
     """
     Handle a GET request, including websocket requests.
     :param request: the request
     :param thing -- the thing this request is for
-    :return ORJSONResponse
-    """
-    description = thing.as_thing_description()
-    description["href"] = thing.href
-    description["links"].append(
-        {
-            "rel": "alternate",
-            "href": f"{get_ws_href(request)}{thing.href}",
-        }
-    )
-    description["base"] = f"{get_http_href(request)}{thing.href}"
-    description["securityDefinitions"] = {
-        "nosec_sc": {"scheme": "nosec", },
+    :return ORJSONResponse, or an empty 304 if the client's copy is current
+    """
+    http_href, ws_href = get_http_href(request), get_ws_href(request)
+
+    etag = make_etag((thing.description_digest,), http_href, ws_href)
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return ORJSONResponse(layer_description(thing, http_href, ws_href), headers={"ETag": etag})
+
+
+async def read_properties(thing: typing.Optional[Thing], names: typing.Optional[typing.List[str]]) -> dict:
+    """
+    Read some properties of a thing for a batch.
+    :param thing -- the thing, None if it doesn't exist
+    :param names -- the properties to read, None or empty for all of them
+    :return {"properties": {...}} plus {"errors": {...}} for failed reads
+    """
+    if thing is None:
+        return {"error": "Thing not found"}
+    if not names:
+        return {"properties": await thing.get_properties()}
+
+    values, errors = {}, {}
+    for name in names:
+        prop = thing.find_property(name)
+        if prop is None:
+            errors[name] = "Property not found"
+            continue
+        try:
+            values[name] = await prop.get_value()
+        except Exception as e:
+            errors[name] = str(e)
+
+    result = {"properties": values}
+    if errors:
+        result["errors"] = errors
+    return result
+
+
+async def write_properties(thing: typing.Optional[Thing], data: typing.Dict[str, typing.Any]) -> dict:
+    """
+    Set properties of a thing for a batch, see Thing.set_properties.
+    :param thing -- the thing, None if it doesn't exist
+    :param data -- property name -> value
+    :return {"properties": {...}} with the new values, or {"error": ...}
+    """
+    if thing is None:
+        return {"error": "Thing not found"}
+    try:
+        await thing.set_properties(data)
+    except PropertyError as e:
+        return {"error": str(e)}
+    return {"properties": {name: await thing.get_property(name) for name in data}}
+
+
+def gather_results(thing_ids: typing.List[str], results: typing.List[typing.Any]) -> dict:
+    """Pair the gathered results with their thing ids, failures become errors."""
+    return {
+        thing_id: {"error": str(result)} if isinstance(result, Exception) else result
+        for thing_id, result in zip(thing_ids, results)
     }
-    description["security"] = "nosec_sc"
 
-    return ORJSONResponse(description)
+
+@router.post("/things:batchRead")
+async def batch_read(
+        request: Request,
+        message: typing.Dict[str, typing.Optional[typing.List[str]]]) -> ORJSONResponse:
+    """
+    Handle a POST request reading properties of many things at once.
+    :param request -- the request
+    :param message -- thing id -> property names, an empty list reads all
+    :return ORJSONResponse with thing id -> result, each thing succeeds or
+            fails on its own
+    """
+    things = request.app.state.things
+    thing_ids = list(message)
+    results = await asyncio.gather(
+        *(read_properties(things.get_thing(thing_id), message[thing_id]) for thing_id in thing_ids),
+        return_exceptions=True,
+    )
+    return ORJSONResponse(gather_results(thing_ids, results))
+
+
+@router.post("/things:batchWrite")
+async def batch_write(
+        request: Request,
+        message: typing.Dict[str, typing.Dict[str, typing.Any]]) -> ORJSONResponse:
+    """
+    Handle a POST request setting properties of many things at once.
+    :param request -- the request
+    :param message -- thing id -> {property name: value}
+    :return ORJSONResponse with thing id -> result, each thing succeeds or
+            fails on its own
+    """
+    things = request.app.state.things
+    thing_ids = list(message)
+    results = await asyncio.gather(
+        *(write_properties(things.get_thing(thing_id), message[thing_id]) for thing_id in thing_ids),
+        return_exceptions=True,
+    )
+    return ORJSONResponse(gather_results(thing_ids, results))
@@ -1,13 +1,21 @@
-from functools import partial
+import asyncio
+import time
+import typing
 
+from collections import deque
+from enum import Enum
+
+import orjson
 from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
 from fastapi.websockets import WebSocket, WebSocketDisconnect
 from starlette.websockets import WebSocketState
 from websockets import ConnectionClosedOK, ConnectionClosedError
 from loguru import logger
 from pydantic import ValidationError
 
-from ..toolkits.event_bus import ee
+from ..toolkits.event_bus import ee, Subscription
+from ..toolkits.metrics import Counter, Gauge, Histogram
 from ..schema import InputMsg, OutMsg
 
 
@@ -18,26 +26,238 @@ async def perform_action(action):
 
 router = APIRouter()
 
+# the topics of a thing a /channel subscription covers
+CHANNEL_TOPICS = ("state", "event", "error")
+
+_messages = Counter(
+    "thingtalk_channel_messages_total",
+    "Messages handled by /channel websockets, by outcome.",
+    ("outcome",),
+)
+_sent = _messages.labels("sent")
+_dropped = _messages.labels("dropped")
+_conflated = _messages.labels("conflated")
+_failed = _messages.labels("failed")
+_delivery_seconds = Histogram(
+    "thingtalk_channel_delivery_seconds",
+    "Time from creating a message to sending it on a websocket.",
+)
+
+
+def encode(data) -> bytes:
+    """
+    Serialize a message from the event bus.
+    data -- an OutMsg, or any other model a client emitted
+    """
+    if isinstance(data, OutMsg):
+        return data.encode()
+    return orjson.dumps(data.dict(), option=orjson.OPT_NON_STR_KEYS)
+
 
 async def send_data(websocket: WebSocket, data: OutMsg):
     if websocket.application_state == WebSocketState.CONNECTED:
         try:
-            await websocket.send_json(data.dict(), mode='binary')
+            await websocket.send_bytes(encode(data))
         except (WebSocketDisconnect, ConnectionClosedOK, ConnectionClosedError) as e:
             logger.debug(e)
     else:
         logger.info(f"can't send data {data} because websocket was closed")
 
 
-subscribe_table = {}
+class OverflowPolicy(str, Enum):
+    drop_oldest = 'drop-oldest'
+    disconnect = 'disconnect'
+    conflate = 'conflate'
+
+
+class Channel:
+    """
+    The outbound side of a /channel connection.
+    Messages from the event bus are put on a bounded queue without awaiting
+    anything, a writer task drains the queue into the websocket, so a slow
+    client only ever costs its own queue.
+    """
+
+    def __init__(self,
+                 websocket: WebSocket,
+                 maxsize: int = 256,
+                 policy: typing.Union[OverflowPolicy, str] = OverflowPolicy.drop_oldest):
+        """
+        Initialize the channel.
+        websocket -- the connection to write to
+        maxsize -- maximum number of queued messages
+        policy -- what to do when the queue is full
+        """
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = OverflowPolicy(policy)
+        self.subscriptions: typing.List[Subscription] = []
+        self.sent = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.failed = 0
+        self.max_depth = 0
+        # every queued message sits in a one item list, so conflation can
+        # swap in a merged propertyStatus without searching the queue
+        self._queue: typing.Deque[list] = deque()
+        self._pending_status: typing.Dict[str, list] = {}
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._writer: typing.Optional[asyncio.Task] = None
+        self._closing: typing.Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """Get the number of messages waiting to be sent."""
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        """Get the queue counters of this channel."""
+        return {
+            "policy": self.policy.value,
+            "maxsize": self.maxsize,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+            "failed": self.failed,
+        }
+
+    def start(self):
+        """Start the writer task."""
+        self._writer = asyncio.create_task(self._write())
+
+    async def close(self):
+        """Stop the writer task and discard anything still queued."""
+        self._closed = True
+        self._queue.clear()
+        self._pending_status.clear()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"writer of websocket {id(self.websocket)} failed: {e}")
+
+    def put(self, data: OutMsg):
+        """
+        Queue a message for sending, this is the event bus listener.
+        data -- the message to send
+        """
+        if self._closed:
+            return
+
+        conflate = (self.policy is OverflowPolicy.conflate
+                    and data.messageType == "propertyStatus")
+        if conflate:
+            slot = self._pending_status.get(data.topic)
+            if slot is not None:
+                merged = OutMsg.construct(
+                    topic=data.topic,
+                    messageType=data.messageType,
+                    data={**slot[0].data, **data.data},
+                )
+                merged._created = slot[0]._created
+                slot[0] = merged
+                self.conflated += 1
+                _conflated.inc()
+                return
+
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            _dropped.inc()
+            if self.policy is OverflowPolicy.disconnect:
+                logger.warning(f"websocket {id(self.websocket)} is too slow, disconnect it")
+                self._abort()
+                return
+            self._forget(self._queue.popleft())
+
+        slot = [data]
+        self._queue.append(slot)
+        if conflate:
+            self._pending_status[data.topic] = slot
+        if len(self._queue) > self.max_depth:
+            self.max_depth = len(self._queue)
+        self._ready.set()
+
+    def _forget(self, slot: list):
+        topic = slot[0].topic
+        if self._pending_status.get(topic) is slot:
+            del self._pending_status[topic]
+
+    def _abort(self):
+        self._closed = True
+        self._queue.clear()
+        self._pending_status.clear()
+        self._ready.set()
+        if self.websocket.application_state == WebSocketState.CONNECTED:
+            self._closing = asyncio.create_task(self.websocket.close(code=1013))
+
+    async def _write(self):
+        websocket = self.websocket
+        while not self._closed:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            slot = self._queue.popleft()
+            self._forget(slot)
+            data = slot[0]
+            try:
+                await send_data(websocket, data)
+            except Exception as e:
+                # e.g. data orjson can't serialize, skip the message only
+                logger.error(f"failed to send {data} on websocket {id(websocket)}: {e}")
+                self.failed += 1
+                _failed.inc()
+            else:
+                self.sent += 1
+                _sent.inc()
+                created = getattr(data, "_created", None)
+                if created is not None:
+                    _delivery_seconds.observe(time.perf_counter() - created)
+            if websocket.application_state != WebSocketState.CONNECTED:
+                self._closed = True
+
+
+channels: typing.Dict[int, Channel] = {}
+
+Gauge("thingtalk_channels", "Open /channel websockets.", function=lambda: len(channels))
+Gauge(
+    "thingtalk_channel_queue_depth",
+    "Messages waiting in the outbound queues of all /channel websockets.",
+    function=lambda: sum(channel.depth for channel in tuple(channels.values())),
+)
+
+
+@router.get("/channels")
+async def get_channels() -> ORJSONResponse:
+    """
+    Handle a request to /channels.
+    :return ORJSONResponse with the queue counters of every open channel
+    """
+    return ORJSONResponse(
+        {str(key): channel.stats() for key, channel in tuple(channels.items())}
+    )
 
 
 @router.websocket("/channel")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
 
-    send = partial(send_data, websocket)
-    subscribe_topics = []
+    state = websocket.app.state
+    channel = Channel(
+        websocket,
+        maxsize=getattr(state, "channel_queue_size", 256),
+        policy=getattr(state, "channel_overflow", OverflowPolicy.drop_oldest),
+    )
+    channel.start()
+    channels[id(websocket)] = channel
+    send = channel.put
 
     try:
         while True:
@@ -53,22 +273,30 @@ async def websocket_endpoint(websocket: WebSocket):
             msg_type = message.messageType
 
             if msg_type == "subscribe":
+                # the thing id "+" subscribes to all things, the samples topic
+                # is left out, state is the rate limited view of it
                 for thing_id in message.data.get("thing_ids", []):
-                    logger.info(f"subscribe topic things/{thing_id}/state things/{thing_id}/event things/{thing_id}/error")
-                    for topic_type in ["state", "event", "error"]:
-                        subscribe_topic = f"things/{thing_id}/{topic_type}"
-                        ee.on(subscribe_topic, send)
-                        subscribe_topics.append(subscribe_topic)
-                    subscribe_table.update({id(websocket): subscribe_topics})
+                    for kind in CHANNEL_TOPICS:
+                        subscribe_topic = f"things/{thing_id}/{kind}"
+                        logger.info(f"subscribe topic {subscribe_topic}")
+                        channel.subscriptions.append(ee.subscribe(subscribe_topic, send))
+            elif not message.topic:
+                logger.error(f"websocket {id(websocket)} sent {msg_type} without a topic")
+                await websocket.send_json(
+                    {
+                        "messageType": "error",
+                        "data": {"status": "400 Bad Request", "message": "topic is required"},
+                    },
+                    mode="binary",
+                )
             else:
                 ee.emit(message.topic, message)
 
     except (WebSocketDisconnect, ConnectionClosedOK) as e:
         logger.info(f"websocket {id(websocket)} was closed with code {e}")
-        topics = subscribe_table.get(id(websocket))
-        if topics:
-            for topic in topics:
-                if send in ee.listeners(topic):
-                    ee.remove_listener(topic, send)
-            del subscribe_table[id(websocket)]
-            logger.info(f"remove listener send of websocket {id(websocket)}")
+    finally:
+        for subscription in channel.subscriptions:
+            ee.unsubscribe(subscription)
+        del channels[id(websocket)]
+        await channel.close()
+        logger.info(f"remove listener send of websocket {id(websocket)}")
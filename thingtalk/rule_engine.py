@@ -1,5 +1,7 @@
+import time
 import typing
 
+from bisect import bisect_left, bisect_right
 from enum import Enum
 
 from async_cron.job import CronJob
@@ -11,8 +13,9 @@ from pydantic import (
 )
 
 from .toolkits.event_bus import ee
+from .toolkits.metrics import Counter, Histogram
 from .toolkits.scheduler import Scheduler
-from .schema import OutMsg, Question
+from .schema import OutMsg
 
 msh = Scheduler(locale="zh_CN")
 
@@ -66,126 +69,223 @@ class Rule(RuleInput):
     id: str
 
 
+class Condition:
+    """
+    A premise shared by every rule that tests the same fact the same way,
+    the alpha node of the network.
+    """
+
+    __slots__ = ("key", "op", "value", "satisfied", "rules")
+
+    def __init__(self, key: str, op: str, value: typing.Any):
+        self.key = key
+        self.op = op
+        self.value = value
+        self.satisfied = False
+        self.rules: typing.Dict[str, "Operation"] = {}
+
+    def test(self, fact: typing.Any) -> bool:
+        """
+        Evaluate the condition against a fact value.
+        Booleans are never greater or less than anything, like in the
+        thresholds of AlphaMemory.
+        """
+        if fact is None:
+            return False
+        if self.op in ("gt", "lt") and (isinstance(fact, bool) or isinstance(self.value, bool)):
+            return False
+        try:
+            if self.op == "eq":
+                return fact == self.value
+            elif self.op == "gt":
+                return fact > self.value
+            elif self.op == "lt":
+                return fact < self.value
+        except TypeError:
+            return False
+        return False
+
+    def __repr__(self):
+        return f"Condition({self.key} {self.op} {self.value!r})"
+
+
 class Operation:
+    """
+    A rule, the beta node of the network.
+    It counts its satisfied conditions, so a changed fact only touches the
+    rules that test it.
+    """
+
     def __init__(self,
-                 questions: typing.Dict[str, Question],
+                 id_: str,
+                 conditions: typing.List[Condition],
                  enabled=True,
                  conclusion=None):
-        self.questions = questions
+        self.id = id_
+        self.conditions = conditions
         self.enabled = enabled
         self.conclusion = conclusion
+        self.topics: typing.List[str] = []
+        self.satisfied = sum(condition.satisfied for condition in conditions)
+
+    def is_satisfied(self) -> bool:
+        raise NotImplementedError()
 
 
 class And(Operation):
 
+    def is_satisfied(self) -> bool:
+        return self.satisfied == len(self.conditions)
+
     def __repr__(self):
-        return f"And({self.questions}...)"
+        return f"And({self.conditions}...)"
 
 
 class Or(Operation):
 
+    def is_satisfied(self) -> bool:
+        return self.satisfied > 0
+
     def __repr__(self):
-        return f"Or({self.questions}...)"
+        return f"Or({self.conditions}...)"
 
 
-class OperationFunctor:
-    """
-    An abstract visitor defined over Logic Operation.
-    Defines the default dispatch over expressions, and
-    implements memoization.
-    """
+def _is_number(value: typing.Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Thresholds:
+    """Numeric gt or lt conditions of one fact, sorted by threshold."""
+
+    __slots__ = ("values", "conditions")
 
     def __init__(self):
-        self.memo_map = {}
-
-    # pylint: disable=no-else-return
-    async def visit(self, expr: Operation) -> bool:
-        """Apply the visitor to an expression."""
-        if expr in self.memo_map:
-            return self.memo_map[expr]
-
-        if isinstance(expr, And):
-            res = await self.visit_and(expr)
-        elif isinstance(expr, Or):
-            res = await self.visit_or(expr)
-        else:
-            raise Exception(f"warning unhandled case: {type(expr)}")
+        self.values: typing.List[float] = []
+        self.conditions: typing.List[Condition] = []
 
-        self.memo_map[expr] = res
+    def add(self, condition: Condition):
+        index = bisect_right(self.values, condition.value)
+        self.values.insert(index, condition.value)
+        self.conditions.insert(index, condition)
 
-        return res
+    def remove(self, condition: Condition):
+        index = bisect_left(self.values, condition.value)
+        while self.conditions[index] is not condition:
+            index += 1
+        del self.values[index]
+        del self.conditions[index]
 
-    async def visit_and(self, _: And) -> bool:
-        raise NotImplementedError()
+    def __len__(self):
+        return len(self.values)
 
-    async def visit_or(self, _: Or) -> bool:
-        raise NotImplementedError()
 
+class AlphaMemory:
+    """
+    The current value of one fact and the conditions testing it, indexed by
+    operator: eq conditions by value, numeric gt/lt conditions by threshold.
+    """
 
-class RuleComputeVisitor(OperationFunctor):
+    __slots__ = ("value", "eq", "gt", "lt", "other")
 
-    def compute_question(self, question_key: str, question: Question) -> bool:
-        logger.debug(f"{question_env[question_key]} {question.value}")
-        if question.op == "eq":
-            res = question_env[question_key] == question.value
-        elif question.op == "gt":
-            res = question_env[question_key] > question.value
-        elif question.op == "lt":
-            res = question_env[question_key] < question.value
-        elif question.op in ["run/scene", "run/cron"]:
-            res = question_env[question_key] is True
-            logger.debug(res)
+    def __init__(self):
+        self.value = None
+        self.eq: typing.Dict[typing.Any, Condition] = {}
+        # fact > threshold, satisfied for a prefix of the sorted thresholds
+        self.gt = Thresholds()
+        # fact < threshold, satisfied for a suffix of the sorted thresholds
+        self.lt = Thresholds()
+        # comparisons against non numeric values, tested one by one
+        self.other: typing.List[Condition] = []
+
+    def __bool__(self):
+        return bool(self.eq or self.gt or self.lt or self.other)
+
+    def add(self, condition: Condition):
+        if condition.op == "eq":
+            self.eq[condition.value] = condition
+        elif condition.op == "gt" and _is_number(condition.value):
+            self.gt.add(condition)
+        elif condition.op == "lt" and _is_number(condition.value):
+            self.lt.add(condition)
+        else:
+            self.other.append(condition)
+        condition.satisfied = condition.test(self.value)
+
+    def remove(self, condition: Condition):
+        if condition.op == "eq":
+            del self.eq[condition.value]
+        elif condition.op == "gt" and _is_number(condition.value):
+            self.gt.remove(condition)
+        elif condition.op == "lt" and _is_number(condition.value):
+            self.lt.remove(condition)
         else:
-            res = False
-        return res
-
-    async def run_conclusion(self, _operation: Operation) -> None:
-        for conclusion in _operation.conclusion:
-            logger.debug(conclusion.topic)
-            ee.emit(conclusion.topic, conclusion)
-        for question_key, should_value in tuple(_operation.questions.items()):
-            question_env[question_key] = None
-
-    async def visit_and(self, _and: And) -> bool:
-        ans = True
-        for question_key, question in tuple(_and.questions.items()):
-            logger.debug(f"Question: {question}")
-            res = self.compute_question(question_key, question)
-            ans = ans and res
-        logger.debug(ans)
-        if ans:
-            logger.debug(_and.conclusion)
-            await self.run_conclusion(_and)
-
-    async def visit_or(self, _or: Or) -> bool:
-        ans = False
-        for question_key, question in tuple(_or.questions.items()):
-            logger.debug(f"Question: {question}")
-            res = self.compute_question(question_key, question)
-            ans = ans or res
-        if ans:
-            await self.run_conclusion(_or)
-
-
-def generate_question_id(topic: str, property_name: str) -> bool:
+            self.other.remove(condition)
+
+    def find(self, op: str, value: typing.Any) -> typing.Optional[Condition]:
+        if op == "eq":
+            return self.eq.get(value)
+        if op in ("gt", "lt") and _is_number(value):
+            thresholds = self.gt if op == "gt" else self.lt
+            index = bisect_left(thresholds.values, value)
+            if index < len(thresholds) and thresholds.values[index] == value:
+                return thresholds.conditions[index]
+            return None
+        for condition in self.other:
+            if condition.op == op and condition.value == value:
+                return condition
+        return None
+
+    def assign(self, value: typing.Any) -> typing.List[Condition]:
+        """
+        Set the fact to a new value.
+        Returns the conditions whose outcome changed.
+        """
+        old, self.value = self.value, value
+        changed = []
+
+        if self.eq:
+            for fact in (old, value):
+                try:
+                    condition = self.eq.get(fact)
+                except TypeError:
+                    # unhashable facts never equal a premise value
+                    continue
+                if condition is not None and condition.test(value) != condition.satisfied:
+                    changed.append(condition)
+
+        if self.gt:
+            values = self.gt.values
+            before = bisect_left(values, old) if _is_number(old) else 0
+            after = bisect_left(values, value) if _is_number(value) else 0
+            changed.extend(self.gt.conditions[min(before, after):max(before, after)])
+
+        if self.lt:
+            values = self.lt.values
+            before = bisect_right(values, old) if _is_number(old) else len(values)
+            after = bisect_right(values, value) if _is_number(value) else len(values)
+            changed.extend(self.lt.conditions[min(before, after):max(before, after)])
+
+        for condition in self.other:
+            if condition.test(value) != condition.satisfied:
+                changed.append(condition)
+
+        return changed
+
+
+def generate_question_id(topic: str, property_name: str) -> str:
     topic_words = topic.split("/")
     return f"things_{topic_words[1]}_{property_name}"
 
 
-def generate_scenes_id(topic: str) -> bool:
+def generate_scenes_id(topic: str) -> str:
     topic_words = topic.split("/")
     return f"scenes_{topic_words[1]}"
 
 
-def generate_cron_id(rule_id, messageType, time) -> bool:
+def generate_cron_id(rule_id, messageType, time) -> str:
     return f"cron_{rule_id}_{messageType}_{time}"
 
 
-def generate_rule_id(topic: str, property_name: str, property_value: typing.Any) -> bool:
-    topic_words = topic.split("/")
-    return f"things_{topic_words[1]}_{property_name}_{property_value}"
-
-
 async def report_cron_status(question_key) -> None:
     message = {
         "topic": question_key,
@@ -197,20 +297,56 @@ async def report_cron_status(question_key) -> None:
     ee.emit(f"{question_key}/state", message)
 
 
-question_env = {}
+_evaluation_seconds = Histogram(
+    "thingtalk_rule_evaluation_seconds",
+    "Time the rule engine takes to evaluate a status message or a rule.",
+)
+_fired = Counter("thingtalk_rules_fired_total", "Rules whose conclusions were run.")
 
 
 class RuleEngine:
-    def __init__(self):
-
-        # "things_xxxx_state_on": {
-        #     "xxxx": And({"things_xxxx_state": {"op": "eq", "value": "ON"},
-        #                  "things_xxxx_brightness": {"op": "lt", "value": 100}}, enabled=True)
-        # },
-        self.rule_env = {}
+    """
+    A compiled rule network.
+    Premises are indexed by the fact they test (a thing property, a scene or
+    a cron job), so a status update only evaluates the conditions whose
+    outcome it changes and only touches the rules using them. A rule fires
+    when its last missing condition becomes true; firing consumes the facts
+    it tested, so the same report has to arrive again to fire it again.
+    """
 
-    def update_question_env(self, question_key: str, value: typing.Any):
-        question_env[question_key] = value
+    def __init__(self):
+        # question key -> AlphaMemory, e.g. "things_xxxx_brightness"
+        self.facts: typing.Dict[str, AlphaMemory] = {}
+        # rule id -> And/Or
+        self.rules: typing.Dict[str, Operation] = {}
+        # subscribed topic -> number of rules using it
+        self.topics: typing.Dict[str, int] = {}
+
+    @property
+    def question_env(self) -> typing.Dict[str, typing.Any]:
+        """Get the current value of every fact a rule tests."""
+        return {key: memory.value for key, memory in self.facts.items()}
+
+    def update_question_env(self, question_key: str, value: typing.Any) -> typing.List[Operation]:
+        """
+        Assert a new value for a fact.
+        Returns the rules this made satisfied, in load order.
+        """
+        memory = self.facts.get(question_key)
+        if memory is None:
+            return []
+
+        activated = {}
+        for condition in memory.assign(value):
+            condition.satisfied = not condition.satisfied
+            delta = 1 if condition.satisfied else -1
+            for rule_id, rule in condition.rules.items():
+                rule.satisfied += delta
+                if condition.satisfied:
+                    activated[rule_id] = rule
+
+        return [rule for rule in activated.values()
+                if rule.enabled and rule.is_satisfied()]
 
     async def add_cron_job(self, pre, question_key):
         if pre.messageType == "everyday":
@@ -249,119 +385,139 @@ class RuleEngine:
             for i in dates:
                 job = CronJob(name=question_key).weekday(i).at(time).go(report_cron_status, question_key)
                 msh.add_job(job)
-        ee.on(f"{question_key}/state", self.handle_status)
 
-    async def compute_rule(self, rule_id):
-        for rule_pk, rule in tuple(self.rule_env.get(rule_id, {}).items()):
-            logger.debug(f"compute rule: key {rule_pk} enabled {rule.enabled}")
-            if rule.enabled:
-                await RuleComputeVisitor().visit(rule)
+    def fire(self, rules: typing.List[Operation]) -> None:
+        """Run the conclusions of satisfied rules and consume their facts."""
+        consumed = {}
+        for rule in rules:
+            logger.debug(f"fire rule {rule.id}")
+            _fired.inc()
+            for conclusion in rule.conclusion:
+                logger.debug(conclusion.topic)
+                ee.emit(conclusion.topic, conclusion)
+            for condition in rule.conditions:
+                consumed[condition.key] = None
+
+        for question_key in consumed:
+            self.update_question_env(question_key, None)
+
+    async def compute_rule(self, rule_id: str):
+        """Fire a rule if it is enabled and all of its premises hold."""
+        started = time.perf_counter()
+        rule = self.rules.get(rule_id)
+        if rule is not None and rule.enabled and rule.is_satisfied():
+            self.fire([rule])
+        _evaluation_seconds.observe(time.perf_counter() - started)
 
     async def handle_status(self, msg: OutMsg):
         assert isinstance(msg, OutMsg)
+        started = time.perf_counter()
 
         if msg.messageType == "propertyStatus":
             for property_name, value in msg.data.items():
-                rule_id = generate_rule_id(msg.topic, property_name, value)
                 question_key = generate_question_id(msg.topic, property_name)
-                self.update_question_env(question_key, value)
-                # logger.debug(question_env)
-                await self.compute_rule(rule_id)
+                self.fire(self.update_question_env(question_key, value))
 
         if msg.messageType == "sceneStatus":
-            rule_id = generate_scenes_id(msg.topic)
             question_key = generate_scenes_id(msg.topic)
-            self.update_question_env(question_key, True)
-            await self.compute_rule(rule_id)
+            self.fire(self.update_question_env(question_key, True))
 
         if msg.messageType == "cronStatus":
-            rule_id = msg.topic
             question_key = msg.topic
-            self.update_question_env(question_key, True)
-            # logger.debug(question_env)
-            await self.compute_rule(rule_id)
+            self.fire(self.update_question_env(question_key, True))
+
+        _evaluation_seconds.observe(time.perf_counter() - started)
 
     async def load_rules(self, rules: typing.List[typing.Optional[Rule]]):
         for rule in rules:
             await self.load_rule(rule)
         logger.info(f"load question env: {self.question_env}")
-        logger.info(f"load rule env: {self.rule_env}")
+        logger.info(f"load rules: {list(self.rules)}")
 
     async def preload(self, pre: typing.Union[ThingPremise, ScenePremise, CronPremise], rule_id: str):
         if "things" in pre.topic:
-            topic_words = pre.topic.split("/")
-            return f"things_{topic_words[1]}_{pre.name}", {"op": pre.op, "value": pre.value}
+            return generate_question_id(pre.topic, pre.name), pre.op, pre.value
         elif "scenes" in pre.topic:
-            topic_words = pre.topic.split("/")
-            return f"scenes_{topic_words[1]}", {"op": "run/scene"}
+            return generate_scenes_id(pre.topic), "eq", True
         elif "cron" in pre.topic:
-            question_key = f"cron_{rule_id}_{pre.messageType}_{pre.data.get('time')}"
+            question_key = generate_cron_id(rule_id, pre.messageType, pre.data.get('time'))
             await self.add_cron_job(pre, question_key=question_key)
-            return question_key, {"op": "run/cron"}
+            return question_key, "eq", True
         else:
             raise Exception("不会执行这一条")
 
-    def generate_rule_id(self, pre: typing.Union[ThingPremise, ScenePremise, CronPremise], rule_id: str):
-        if "things" in pre.topic:
-            topic_words = pre.topic.split("/")
-            return f"things_{topic_words[1]}_{pre.name}_{pre.value}"
-        elif "scenes" in pre.topic:
-            topic_words = pre.topic.split("/")
-            return f"scenes_{topic_words[1]}"
-        elif "cron" in pre.topic:
-            return f"cron_{rule_id}_{pre.messageType}_{pre.data.get('time')}"
+    def subscribe(self, topic: str):
+        if topic not in self.topics:
+            ee.on(topic, self.handle_status)
+        self.topics[topic] = self.topics.get(topic, 0) + 1
+
+    def unsubscribe(self, topic: str):
+        count = self.topics.get(topic, 0) - 1
+        if count > 0:
+            self.topics[topic] = count
+        elif topic in self.topics:
+            del self.topics[topic]
+            ee.remove_listener(topic, self.handle_status)
 
     async def load_rule(self, rule: Rule):
         assert isinstance(rule, Rule)
-        questions = {}
-        # 更新 questions，以及当前 rule 需要查询的 question_keys
+        if rule.id in self.rules:
+            await self.disable_rule(rule.id)
+
+        conditions = {}
         for pre in rule.premise:
-            question_key, question_data = await self.preload(pre, rule.id)
-            question = Question(**question_data)
-            questions.update({question_key: question})
-            self.update_question_env(question_key, None)
+            question_key, op, value = await self.preload(pre, rule.id)
+            memory = self.facts.get(question_key)
+            if memory is None:
+                memory = self.facts[question_key] = AlphaMemory()
+            condition = memory.find(op, value)
+            if condition is None:
+                condition = Condition(question_key, op, value)
+                memory.add(condition)
+            conditions[id(condition)] = condition
+
+        conditions = list(conditions.values())
+        if rule.premise_type == "Or":
+            operation = Or(rule.id, conditions, enabled=rule.enabled, conclusion=rule.conclusion)
+        else:
+            operation = And(rule.id, conditions, enabled=rule.enabled, conclusion=rule.conclusion)
+
+        for condition in conditions:
+            condition.rules[rule.id] = operation
+        self.rules[rule.id] = operation
 
         for pre in rule.premise:
-            rule_pk = rule.id
-            rule_id = self.generate_rule_id(pre, rule_pk)
-            rule_map = self.rule_env.get(rule_id, {})
-            logger.debug(rule_map)
-            if rule.premise_type in ["And", "Singleton"]:
-                rule_map.update({
-                    rule_pk: And(questions, enabled=rule.enabled, conclusion=rule.conclusion)
-                })
-            elif rule.premise_type == "Or":
-                rule_map.update({
-                    rule_pk: Or(questions, enabled=rule.enabled, conclusion=rule.conclusion)
-                })
-            logger.info(f"add rule: key {rule_id}")
-            logger.debug({
-                rule_id: rule_map
-            })
-            self.rule_env.update({
-                rule_id: rule_map
-            })
-            logger.debug(self.rule_env)
-            if "things" in pre.topic or "scenes" in pre.topic:
-                ee.on(f"{pre.topic}/state", self.handle_status)
-        logger.info(f"load rule env: {self.rule_env}")
-
-    async def disable_rule(self, pre, rule):
-        # logger.info(self.rule_env)
-        rule_pk = rule.id.hex
-        rule_id = self.generate_rule_id(pre, rule_pk)
-        # if "things" in pre.topic:
-        #     rule_id = generate_rule_id(pre.topic, pre.name, pre.value)
-        # elif "scenes" in pre.topic:
-        #     rule_id = generate_scenes_id(pre.topic)
-        # elif "cron" in pre.topic:
-        #     logger.debug(f"cron keys {self.cron_keys}")
-        #     logger.debug(rule.id.hex)
-        #     rule_id = self.cron_keys.get(rule.id.hex)
+            if "things" in pre.topic:
+                # every change, not the rate limited state
+                operation.topics.append(f"{pre.topic}/samples")
+            elif "scenes" in pre.topic:
+                operation.topics.append(f"{pre.topic}/state")
+            elif "cron" in pre.topic:
+                operation.topics.append(f"{generate_cron_id(rule.id, pre.messageType, pre.data.get('time'))}/state")
+        for topic in operation.topics:
+            self.subscribe(topic)
+        logger.info(f"add rule: key {rule.id} {operation}")
+
+    async def disable_rule(self, rule_id: str):
+        """
+        Remove a rule from the network.
+        rule_id -- id of the rule
+        """
         logger.debug(f"disable rule {rule_id}")
-        rule_map = self.rule_env.get(rule_id)
-        if rule_map:
-            if rule_map.get(rule_pk):
-                del rule_map[rule_pk]
-        msh.del_job(rule_id)
-        # logger.info(self.rule_env)
+        operation = self.rules.pop(rule_id, None)
+        if operation is None:
+            return
+
+        for condition in operation.conditions:
+            del condition.rules[rule_id]
+            if condition.rules:
+                continue
+            memory = self.facts[condition.key]
+            memory.remove(condition)
+            if not memory:
+                del self.facts[condition.key]
+            if condition.key.startswith("cron_"):
+                msh.del_job(condition.key)
+
+        for topic in operation.topics:
+            self.unsubscribe(topic)
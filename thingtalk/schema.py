@@ -1,8 +1,10 @@
+import time
 import typing
 
 from enum import Enum
 
-from pydantic import BaseModel
+import orjson
+from pydantic import BaseModel, PrivateAttr
 
 
 class InputMsgType(str, Enum):
@@ -43,6 +45,27 @@ class OutMsg(BaseModel):
     messageType: OutputMsgType
     data: typing.Dict[str, typing.Any]
 
+    _encoded: typing.Optional[bytes] = PrivateAttr(default=None)
+    # perf_counter() at creation, to measure how long delivery takes
+    _created: float = PrivateAttr(default_factory=time.perf_counter)
+
+    def encode(self) -> bytes:
+        """
+        Serialize the message to JSON bytes.
+        The buffer is cached on the message, so fanning it out to many
+        subscribers only pays for serialization once.
+        """
+        if self._encoded is None:
+            self._encoded = orjson.dumps(
+                {
+                    "topic": self.topic,
+                    "messageType": self.messageType,
+                    "data": self.data,
+                },
+                option=orjson.OPT_NON_STR_KEYS,
+            )
+        return self._encoded
+
 
 class Question(BaseModel):
     op: str
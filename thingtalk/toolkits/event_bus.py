@@ -1,3 +1,279 @@
-from pyee.asyncio import AsyncIOEventEmitter as EventEmitter
+"""
+An in-process event bus with MQTT style topics.
 
-ee = EventEmitter()
+Listeners subscribe to topic filters made of `/` separated words, where `+`
+matches exactly one word and a trailing `#` matches any number of words,
+e.g. `things/+/state` or `things/#`. Filters are kept in a trie, so matching
+a topic costs O(depth) no matter how many subscriptions exist, and removing
+a subscription never scans the other listeners.
+
+The `on`/`emit`/`remove_listener`/`listeners` methods keep the pyee
+EventEmitter semantics the rest of thingtalk was written against:
+registering the same listener twice on one filter is a no-op, and
+coroutine listeners are scheduled on the running loop.
+"""
+
+import typing
+
+from asyncio import AbstractEventLoop, Future, ensure_future, iscoroutine
+
+from loguru import logger
+
+from .metrics import Counter, Gauge
+
+SINGLE_LEVEL = "+"
+MULTI_LEVEL = "#"
+# the emit count key of topics beyond EventBus.max_counted_topics
+OTHER_TOPICS = "other"
+
+Listener = typing.Callable[..., typing.Any]
+
+
+class Subscription:
+    """A handle to a listener subscribed to a topic filter."""
+
+    __slots__ = ("topic", "listener")
+
+    def __init__(self, topic: str, listener: Listener):
+        self.topic = topic
+        self.listener = listener
+
+    def __repr__(self):
+        return f"Subscription({self.topic!r}, {self.listener!r})"
+
+
+class _Node:
+    __slots__ = ("children", "listeners")
+
+    def __init__(self):
+        self.children: typing.Dict[str, "_Node"] = {}
+        # listener -> Subscription, dicts keep the registration order
+        self.listeners: typing.Dict[Listener, Subscription] = {}
+
+
+class EventBus:
+    """A topic trie event bus."""
+
+    # distinct topics counted, the emits of any more count as OTHER_TOPICS
+    max_counted_topics = 256
+
+    def __init__(self, loop: typing.Optional[AbstractEventLoop] = None):
+        """
+        Initialize the bus.
+        loop -- the loop coroutine listeners run on, default the running loop
+        """
+        self._loop = loop
+        self._root = _Node()
+        self._waiting: typing.Set[Future] = set()
+        # count emits for the metrics, set by ThingTalk(metrics=True)
+        self.count_emits = False
+        # topic, its second level replaced by +, -> number of emits
+        self.emitted: typing.Dict[str, int] = {}
+
+    def subscribe(self, topic: str, listener: Listener) -> Subscription:
+        """
+        Subscribe a listener to a topic filter.
+        topic -- the topic filter, may contain `+` and `#` wildcards
+        listener -- the callable to invoke with the emitted arguments
+        Returns the subscription handle.
+        """
+        node = self._root
+        for word in topic.split("/"):
+            child = node.children.get(word)
+            if child is None:
+                child = node.children[word] = _Node()
+            node = child
+
+        subscription = node.listeners.get(listener)
+        if subscription is None:
+            subscription = node.listeners[listener] = Subscription(topic, listener)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> bool:
+        """
+        Remove a subscription.
+        subscription -- the handle returned by subscribe
+        Returns whether the subscription was still active.
+        """
+        return self._remove(subscription.topic, subscription.listener)
+
+    def on(self, event: str, f: typing.Optional[Listener] = None):
+        """
+        Register the function f to the topic filter event.
+        Like pyee, this can be used as a decorator when f is omitted.
+        """
+        if f is None:
+            def decorator(f: Listener) -> Listener:
+                self.subscribe(event, f)
+                return f
+
+            return decorator
+
+        self.subscribe(event, f)
+        return f
+
+    add_listener = on
+
+    def remove_listener(self, event: str, f: Listener) -> None:
+        """Remove the function f from the topic filter event."""
+        self._remove(event, f)
+
+    def remove_all_listeners(self, event: typing.Optional[str] = None) -> None:
+        """Remove all listeners of a topic filter, or of every filter."""
+        if event is None:
+            self._root = _Node()
+            return
+
+        node = self._find(event)
+        if node is not None:
+            for listener in tuple(node.listeners):
+                self._remove(event, listener)
+
+    def listeners(self, event: str) -> typing.List[Listener]:
+        """Get the listeners registered on exactly this topic filter."""
+        node = self._find(event)
+        if node is None:
+            return []
+        return list(node.listeners)
+
+    def count(self) -> int:
+        """Get the number of subscriptions."""
+        total = 0
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            total += len(node.listeners)
+            stack.extend(node.children.values())
+        return total
+
+    def match(self, topic: str) -> typing.List[Listener]:
+        """
+        Get every listener whose filter matches a topic.
+        topic -- the concrete topic, without wildcards, None or an empty
+                 topic matches nothing
+        """
+        if not topic:
+            return []
+        words = topic.split("/")
+        depth = len(words)
+        matched: typing.List[Listener] = []
+        stack = [(self._root, 0)]
+        while stack:
+            node, level = stack.pop()
+            children = node.children
+            multi = children.get(MULTI_LEVEL)
+            if multi is not None:
+                # `a/#` also matches the parent level `a`
+                matched.extend(multi.listeners)
+            if level == depth:
+                matched.extend(node.listeners)
+                continue
+
+            word = words[level]
+            exact = children.get(word)
+            if exact is not None:
+                stack.append((exact, level + 1))
+            single = children.get(SINGLE_LEVEL)
+            if single is not None and word != SINGLE_LEVEL:
+                stack.append((single, level + 1))
+        return matched
+
+    def emit(self, event: str, *args, **kwargs) -> bool:
+        """
+        Call every listener matching the topic event.
+        Coroutine listeners are scheduled, not awaited.
+        Returns whether any listener matched, never for None or an empty
+        topic.
+        """
+        if not event:
+            return False
+        if self.count_emits:
+            self._count(event)
+        listeners = self.match(event)
+        for f in listeners:
+            self._emit_run(event, f, args, kwargs)
+        return bool(listeners)
+
+    def _count(self, event: str):
+        # one key per thing would grow with every thing, and with every
+        # topic a /channel client makes up, so things/{id}/state counts as
+        # things/+/state and the keys are capped
+        words = event.split("/", 2)
+        if len(words) > 1:
+            words[1] = SINGLE_LEVEL
+            event = "/".join(words)
+        emitted = self.emitted
+        if event in emitted:
+            emitted[event] += 1
+        elif len(emitted) < self.max_counted_topics:
+            emitted[event] = 1
+        else:
+            emitted[OTHER_TOPICS] = emitted.get(OTHER_TOPICS, 0) + 1
+
+    def _emit_run(self, event: str, f: Listener, args, kwargs):
+        try:
+            coro = f(*args, **kwargs)
+        except Exception:
+            logger.exception(f"listener {f} of {event} failed")
+            return
+
+        if iscoroutine(coro):
+            if self._loop:
+                fut = ensure_future(coro, loop=self._loop)
+            else:
+                fut = ensure_future(coro)
+        elif isinstance(coro, Future):
+            fut = coro
+        else:
+            return
+
+        def callback(fut):
+            self._waiting.discard(fut)
+            if fut.cancelled():
+                return
+            exc = fut.exception()
+            if exc is not None:
+                logger.opt(exception=exc).error(f"listener {f} of {event} failed")
+
+        fut.add_done_callback(callback)
+        self._waiting.add(fut)
+
+    def _find(self, topic: str) -> typing.Optional[_Node]:
+        node = self._root
+        for word in topic.split("/"):
+            node = node.children.get(word)
+            if node is None:
+                return None
+        return node
+
+    def _remove(self, topic: str, listener: Listener) -> bool:
+        path = []
+        node = self._root
+        for word in topic.split("/"):
+            child = node.children.get(word)
+            if child is None:
+                return False
+            path.append((node, word))
+            node = child
+
+        if node.listeners.pop(listener, None) is None:
+            return False
+
+        # prune the branches nobody listens on anymore
+        for parent, word in reversed(path):
+            child = parent.children[word]
+            if child.listeners or child.children:
+                break
+            del parent.children[word]
+        return True
+
+
+ee = EventBus()
+
+Counter(
+    "thingtalk_bus_emitted_total",
+    "Messages emitted on the event bus.",
+    ("topic",),
+    function=lambda: [((topic,), count) for topic, count in tuple(ee.emitted.items())],
+)
+Gauge("thingtalk_bus_subscriptions", "Listeners subscribed to the event bus.", function=ee.count)
@@ -0,0 +1,82 @@
+"""
+A bounded thread pool for blocking driver code.
+
+Value forwarders and actions that talk to hardware through blocking calls
+run here instead of on the event loop. Calls sharing a serial key, e.g.
+everything written to one thing, run one at a time in the order they were
+made, so a driver sees writes in order and never concurrently.
+"""
+
+import asyncio
+import inspect
+import typing
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# threads of the pool, set before the first call or through ThingTalk
+max_workers = 8
+
+_executor: typing.Optional[ThreadPoolExecutor] = None
+# serial key -> (loop, lock), the lock is only valid on the loop it was made on
+_locks: "weakref.WeakKeyDictionary[typing.Any, typing.Tuple[asyncio.AbstractEventLoop, asyncio.Lock]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the pool, starting it on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thingtalk-driver")
+    return _executor
+
+
+def shutdown(wait: bool = True):
+    """Stop the pool, the next call starts a new one."""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def _lock(serial) -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    entry = _locks.get(serial)
+    if entry is None or entry[0] is not loop:
+        entry = _locks[serial] = (loop, asyncio.Lock())
+    return entry[1]
+
+
+async def run_blocking(func: typing.Callable, *args, serial=None):
+    """
+    Run a blocking function on the pool.
+    func -- the function
+    args -- its arguments
+    serial -- calls with the same key run one at a time, in order; it must
+              be weak referenceable, e.g. a Thing. None runs at once.
+    Returns what func returns.
+    """
+    loop = asyncio.get_running_loop()
+    call = partial(func, *args) if args else func
+    if serial is None:
+        return await loop.run_in_executor(get_executor(), call)
+    async with _lock(serial):
+        return await loop.run_in_executor(get_executor(), call)
+
+
+async def call_forwarder(func: typing.Callable, value, serial=None):
+    """
+    Hand a value to a forwarder.
+    Coroutine functions are awaited on the loop, anything else runs on the
+    pool; an awaitable it returns is awaited too.
+    func -- the forwarder
+    value -- the new value
+    serial -- the serial key of the blocking call, see run_blocking
+    """
+    if asyncio.iscoroutinefunction(func):
+        return await func(value)
+    result = await run_blocking(func, value, serial=serial)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
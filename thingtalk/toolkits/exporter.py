@@ -0,0 +1,128 @@
+"""
+Mirror thing state to an MQTT broker.
+
+The exporter listens on things/+/state and things/+/event and publishes
+
+    things/{id}/properties/{name} -- the bare JSON value, retained
+    things/{id}/events/{name} -- the event description, not retained
+
+Property updates only replace an entry of a pending dict, the dict is
+encoded and published once per interval, and values equal to the last
+published one for their topic are skipped. Bursts for one property so
+cost one publish, and unchanged states none.
+"""
+
+import asyncio
+import typing
+
+import orjson
+from loguru import logger
+
+from .event_bus import ee, Subscription
+
+
+class MqttExporter:
+    """Publish property states and events of all things."""
+
+    def __init__(self, mqtt, things=None, interval: float = 0.1, prefix: str = "things", qos: int = 0):
+        """
+        Initialize the object.
+        mqtt -- the Mqtt client to publish with, connected by the caller
+        things -- the things container, its current states are published
+                  on start, None for none
+        interval -- seconds between two batches
+        prefix -- the first level of the published topics
+        qos -- the QoS level of the published messages
+        """
+        self.mqtt = mqtt
+        self.things = things
+        self.interval = interval
+        self.prefix = prefix
+        self.qos = qos
+        self.published = 0
+        self.unchanged = 0
+        # topic -> latest value of the current interval
+        self._pending: typing.Dict[str, typing.Any] = {}
+        # topic -> last published payload
+        self._last: typing.Dict[str, bytes] = {}
+        # (thing id, property name) -> topic
+        self._topics: typing.Dict[typing.Tuple[str, str], str] = {}
+        self._subscriptions: typing.List[Subscription] = []
+        self._task: typing.Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Subscribe to the bus and start publishing, a startup handler."""
+        if self._task is not None:
+            return
+        if self.things is not None:
+            for _, thing in await self.things.get_things():
+                for name, prop in thing.properties.items():
+                    self._pending[self._topic(thing.id, name)] = prop.value.last_value
+        self._subscriptions = [
+            ee.subscribe("things/+/state", self.on_state),
+            ee.subscribe("things/+/event", self.on_event),
+        ]
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Publish what is pending and unsubscribe, a shutdown handler."""
+        for subscription in self._subscriptions:
+            ee.unsubscribe(subscription)
+        self._subscriptions = []
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.flush()
+
+    def on_state(self, message):
+        """Take a message from things/+/state."""
+        if message.messageType != "propertyStatus":
+            return
+        thing_id = message.topic[len("things/"):]
+        pending = self._pending
+        for name, value in message.data.items():
+            topic = self._topics.get((thing_id, name))
+            if topic is None:
+                topic = self._topic(thing_id, name)
+            pending[topic] = value
+
+    def on_event(self, message):
+        """Take a message from things/+/event, events are published at once."""
+        thing_id = message.topic[len("things/"):]
+        for name, description in message.data.items():
+            self.mqtt.publisher.put(
+                f"{self.prefix}/{thing_id}/events/{name}", orjson.dumps(description), qos=self.qos
+            )
+            self.published += 1
+
+    def flush(self):
+        """Publish the pending states now."""
+        pending, self._pending = self._pending, {}
+        last = self._last
+        put = self.mqtt.publisher.put
+        for topic, value in pending.items():
+            try:
+                payload = orjson.dumps(value)
+            except TypeError as e:
+                logger.warning(f"can't export {topic}: {e}")
+                continue
+            if last.get(topic) == payload:
+                self.unchanged += 1
+                continue
+            last[topic] = payload
+            put(topic, payload, qos=self.qos, retain=True, coalesce=True)
+            self.published += 1
+
+    def _topic(self, thing_id: str, name: str) -> str:
+        topic = self._topics[(thing_id, name)] = f"{self.prefix}/{thing_id}/properties/{name}"
+        return topic
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._pending:
+                self.flush()
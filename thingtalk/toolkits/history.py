@@ -0,0 +1,456 @@
+"""
+Embedded time series history of property values.
+
+Properties opt in through their metadata:
+
+    {"type": "number", "history": true}
+    {"type": "number", "history": {"maxAge": 86400, "maxBytes": 1048576}}
+
+Every value a recorded property notifies (numbers, booleans as 0 and 1)
+is appended with its time to the series of the property, a directory of
+segment files under
+
+    {path}/{quoted thing id}/{quoted property name}/{first time in ms}.seg
+
+A segment is columnar: a header, then `capacity` timestamps, then
+`capacity` values, all native doubles. The newest segment of a series is
+memory-mapped and appended to in place; full segments are closed and only
+mapped again, read-only, while a query reads them. Retention drops whole
+segments, the oldest first, once all their samples are older than maxAge
+or the series is larger than maxBytes.
+
+Every map holds a file descriptor, so History keeps at most max_mapped
+series mapped: the series mapped longest ago is unmapped when another one
+needs its map, and mapped again on its next sample.
+
+Queries aggregate the samples into min/max/avg buckets. Bucket bounds are
+found by bisecting the timestamp column and each bucket is reduced by
+min, max and sum over a slice of the value column, so the per sample work
+runs in C, on the driver pool, off the loop.
+"""
+
+import asyncio
+import contextlib
+import math
+import mmap
+import os
+import struct
+import time
+import typing
+
+from bisect import bisect_left
+from collections import OrderedDict
+from urllib.parse import quote
+
+from loguru import logger
+
+from .executor import run_blocking
+
+# magic, capacity, count, padded to keep the columns 8 byte aligned
+_HEADER = struct.Struct("<4sII4x")
+_COUNT = struct.Struct("<I")
+_COUNT_OFFSET = 8
+_MAGIC = b"TTH1"
+_SUFFIX = ".seg"
+
+Columns = typing.Tuple[typing.Sequence[float], typing.Sequence[float]]
+
+
+class Segment:
+    """A segment file of a series."""
+
+    __slots__ = ("path", "capacity", "count", "first", "last", "size", "_map", "_views")
+
+    def __init__(self, path: str, capacity: int, count: int = 0):
+        """
+        Initialize the object.
+        path -- the segment file
+        capacity -- number of samples it holds
+        count -- number of samples written
+        """
+        self.path = path
+        self.capacity = capacity
+        self.count = count
+        self.first: typing.Optional[float] = None
+        self.last: typing.Optional[float] = None
+        self.size = _HEADER.size + 16 * capacity
+        self._map: typing.Optional[mmap.mmap] = None
+        # the whole map, timestamps and values
+        self._views: typing.Optional[typing.Tuple[memoryview, memoryview, memoryview]] = None
+
+    @classmethod
+    def create(cls, path: str, capacity: int) -> "Segment":
+        """Create an empty segment file and map it for appending."""
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, capacity, 0))
+            f.truncate(_HEADER.size + 16 * capacity)
+        segment = cls(path, capacity)
+        segment.open()
+        return segment
+
+    @classmethod
+    def load(cls, path: str) -> "Segment":
+        """Read the header and the time range of a segment file."""
+        with open(path, "rb") as f:
+            magic, capacity, count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError(f"{path} isn't a history segment")
+        segment = cls(path, capacity, count)
+        if count:
+            with segment.columns() as (timestamps, _):
+                segment.first, segment.last = timestamps[0], timestamps[-1]
+        return segment
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    @property
+    def mapped(self) -> bool:
+        """Check whether the segment is open for appending."""
+        return self._map is not None
+
+    def open(self):
+        """Map the file for appending."""
+        # the map keeps a descriptor of its own
+        with open(self.path, "r+b") as f:
+            self._map = mmap.mmap(f.fileno(), 0)
+        self._views = _cast(self._map, self.capacity)
+
+    def close(self):
+        """Unmap the file, it can still be read through columns."""
+        if self._map is None:
+            return
+        for view in self._views:
+            view.release()
+        self._map.flush()
+        self._map.close()
+        self._map = self._views = None
+
+    def append(self, timestamp: float, value: float):
+        """Append a sample, the segment must be open and not full."""
+        index = self.count
+        _, timestamps, values = self._views
+        timestamps[index] = timestamp
+        values[index] = value
+        self.count = index + 1
+        # the count last, a crash never exposes a half written sample
+        _COUNT.pack_into(self._map, _COUNT_OFFSET, self.count)
+        if self.first is None:
+            self.first = timestamp
+        self.last = timestamp
+
+    def copy(self) -> Columns:
+        """Copy the columns of an open segment, e.g. for another thread."""
+        _, timestamps, values = self._views
+        count = self.count
+        return timestamps[:count].tolist(), values[:count].tolist()
+
+    @contextlib.contextmanager
+    def columns(self) -> typing.Iterator[Columns]:
+        """Map the file read-only and get its timestamps and values."""
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                whole, timestamps, values = _cast(mapped, self.capacity)
+                views = (timestamps[:self.count], values[:self.count], timestamps, values, whole)
+                try:
+                    yield views[0], views[1]
+                finally:
+                    # the map can't be closed while a view of it is alive
+                    for view in views:
+                        view.release()
+
+
+def _cast(mapped: mmap.mmap, capacity: int) -> typing.Tuple[memoryview, memoryview, memoryview]:
+    whole = memoryview(mapped)
+    start = _HEADER.size
+    middle = start + 8 * capacity
+    return whole, whole[start:middle].cast("d"), whole[middle:middle + 8 * capacity].cast("d")
+
+
+def aggregate(blocks: typing.Iterable[Columns], start: float, end: float, step: float) -> dict:
+    """
+    Reduce samples to min/max/avg buckets.
+    blocks -- (timestamps, values) columns, in time order, timestamps sorted
+    start -- the time of the first bucket
+    end -- samples at or after this time are left out
+    step -- seconds per bucket
+    Returns the columns of the buckets with samples: their start time, the
+    min, max and average value, and the number of samples.
+    """
+    # bucket index -> [min, max, sum, count]
+    buckets: typing.Dict[int, list] = {}
+    for timestamps, values in blocks:
+        index = bisect_left(timestamps, start)
+        stop = bisect_left(timestamps, end, index)
+        while index < stop:
+            bucket = int((timestamps[index] - start) // step)
+            upper = bisect_left(timestamps, start + (bucket + 1) * step, index, stop)
+            if upper <= index:
+                # rounding, the bucket bound fell on this very sample
+                upper = index + 1
+            chunk = values[index:upper]
+            low, high, total, count = min(chunk), max(chunk), sum(chunk), upper - index
+            known = buckets.get(bucket)
+            if known is None:
+                buckets[bucket] = [low, high, total, count]
+            else:
+                known[0] = min(known[0], low)
+                known[1] = max(known[1], high)
+                known[2] += total
+                known[3] += count
+            index = upper
+
+    result = {"t": [], "min": [], "max": [], "avg": [], "count": []}
+    for bucket in sorted(buckets):
+        low, high, total, count = buckets[bucket]
+        result["t"].append(start + bucket * step)
+        result["min"].append(low)
+        result["max"].append(high)
+        result["avg"].append(total / count)
+        result["count"].append(count)
+    return result
+
+
+def _read(segments: typing.List[Segment], head: typing.Optional[Columns],
+          start: float, end: float, step: float) -> dict:
+    with contextlib.ExitStack() as stack:
+        blocks = []
+        for segment in segments:
+            try:
+                blocks.append(stack.enter_context(segment.columns()))
+            except FileNotFoundError:
+                # dropped by the retention meanwhile
+                continue
+        if head is not None:
+            blocks.append(head)
+        return aggregate(blocks, start, end, step)
+
+
+class Series:
+    """The recorded samples of one property."""
+
+    def __init__(self, directory: str, capacity: int = 4096,
+                 max_age: typing.Optional[float] = None, max_bytes: typing.Optional[int] = None):
+        """
+        Initialize the object, loading the segments already there.
+        directory -- the directory of the segment files
+        capacity -- samples per segment
+        max_age -- seconds samples are kept, None for no limit
+        max_bytes -- size the segment files are kept under, None for no limit
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.segments: typing.List[Segment] = []
+        # called after the newest segment was mapped
+        self.on_map: typing.Optional[typing.Callable[["Series"], None]] = None
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(_SUFFIX):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                self.segments.append(Segment.load(path))
+            except (ValueError, struct.error) as e:
+                logger.warning(f"skip history segment {path}: {e}")
+
+    @property
+    def size(self) -> int:
+        """Get the size of the segment files in bytes."""
+        return sum(segment.size for segment in self.segments)
+
+    def record(self, value):
+        """
+        Append a value with the current time, a Value listener.
+        Values other than finite numbers and booleans are ignored, a nan
+        or inf would turn the aggregates of its bucket into nan.
+        """
+        if isinstance(value, (int, float)) and math.isfinite(value):
+            self.append(time.time(), float(value))
+
+    def append(self, timestamp: float, value: float):
+        """
+        Append a sample.
+        timestamp -- seconds since the epoch, earlier than the last sample's
+                     is taken as the last sample's, the clock went back
+        value -- the value
+        """
+        head = self.segments[-1] if self.segments else None
+        if head is not None and head.last is not None and timestamp < head.last:
+            timestamp = head.last
+        if head is None or head.full:
+            if head is not None:
+                head.close()
+            path = os.path.join(self.directory, f"{int(timestamp * 1000):016d}{_SUFFIX}")
+            if head is not None and path == head.path:
+                path = os.path.join(self.directory, f"{int(timestamp * 1000) + 1:016d}{_SUFFIX}")
+            head = Segment.create(path, self.capacity)
+            self.segments.append(head)
+            self.prune(timestamp)
+            if self.on_map is not None:
+                self.on_map(self)
+        elif not head.mapped:
+            # loaded, unmapped for another series or closed by a stop
+            head.open()
+            if self.on_map is not None:
+                self.on_map(self)
+        head.append(timestamp, value)
+
+    def prune(self, now: typing.Optional[float] = None):
+        """
+        Drop the segments outside the retention, never the newest one.
+        now -- the current time, seconds since the epoch
+        """
+        now = time.time() if now is None else now
+        drop = 0
+        sealed = len(self.segments) - 1
+        if self.max_age is not None:
+            while drop < sealed and (self.segments[drop].last or 0) < now - self.max_age:
+                drop += 1
+        if self.max_bytes is not None:
+            size = self.size - sum(segment.size for segment in self.segments[:drop])
+            while drop < sealed and size > self.max_bytes:
+                size -= self.segments[drop].size
+                drop += 1
+        for segment in self.segments[:drop]:
+            try:
+                os.remove(segment.path)
+            except FileNotFoundError:
+                pass
+        del self.segments[:drop]
+
+    def close(self):
+        """Unmap the newest segment."""
+        if self.segments:
+            self.segments[-1].close()
+
+    async def query(self, start: float, end: float, step: float) -> dict:
+        """
+        Aggregate the samples of a time range, see aggregate.
+        start -- seconds since the epoch
+        end -- seconds since the epoch, excluded
+        step -- seconds per bucket
+        """
+        segments = [
+            segment for segment in self.segments
+            if segment.count and segment.last >= start and segment.first < end
+        ]
+        head = None
+        if segments and segments[-1].mapped:
+            # the newest segment is written on the loop, read a copy
+            head = segments.pop().copy()
+        return await run_blocking(_read, segments, head, start, end, step)
+
+
+class History:
+    """Record the properties whose metadata asks for a history."""
+
+    def __init__(self, path: str, things=None, max_age: typing.Optional[float] = 7 * 86400,
+                 max_bytes: typing.Optional[int] = 64 * 1024 * 1024,
+                 capacity: int = 4096, interval: float = 60.0, max_mapped: int = 256):
+        """
+        Initialize the object.
+        path -- the directory of the series
+        things -- the things container, its things are recorded on start,
+                  None for none
+        max_age -- default seconds samples are kept, None for no limit
+        max_bytes -- default size of a series, None for no limit
+        capacity -- samples per segment file
+        interval -- seconds between two retention runs
+        max_mapped -- series whose newest segment is kept mapped, each
+                      holds a file descriptor
+        """
+        self.path = path
+        self.things = things
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.capacity = capacity
+        self.interval = interval
+        self.max_mapped = max_mapped
+        # the mapped series, mapped longest ago first
+        self._mapped: typing.OrderedDict[Series, None] = OrderedDict()
+        # (thing id, property name) -> series
+        self.series: typing.Dict[typing.Tuple[str, str], Series] = {}
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def watch(self, thing):
+        """
+        Start recording the properties of a thing that ask for a history.
+        thing -- the thing
+        """
+        for name, prop in thing.properties.items():
+            spec = prop.metadata.get("history")
+            if not spec or (thing.id, name) in self.series:
+                continue
+            spec = spec if isinstance(spec, dict) else {}
+            series = self.series[(thing.id, name)] = Series(
+                os.path.join(self.path, quote(thing.id, safe=""), quote(name, safe="")),
+                capacity=self.capacity,
+                max_age=spec.get("maxAge", self.max_age),
+                max_bytes=spec.get("maxBytes", self.max_bytes),
+            )
+            series.on_map = self._on_map
+            prop.value.on("update", series.record)
+            prop.value.on("sync", series.record)
+
+    def unwatch(self, thing):
+        """
+        Stop recording the properties of a thing, e.g. when it's removed.
+        Its samples are kept on disk.
+        thing -- the thing
+        """
+        for key in [key for key in self.series if key[0] == thing.id]:
+            series = self.series.pop(key)
+            prop = thing.properties.get(key[1])
+            if prop is not None:
+                prop.value.remove_listener("update", series.record)
+                prop.value.remove_listener("sync", series.record)
+            series.close()
+            self._mapped.pop(series, None)
+
+    def get_series(self, thing_id: str, name: str) -> typing.Optional[Series]:
+        """Get the series of a property, None if it isn't recorded."""
+        return self.series.get((thing_id, name))
+
+    def _on_map(self, series: Series):
+        self._mapped[series] = None
+        self._mapped.move_to_end(series)
+        while len(self._mapped) > self.max_mapped:
+            evicted, _ = self._mapped.popitem(last=False)
+            evicted.close()
+
+    def prune(self):
+        """Apply the retention to every series."""
+        now = time.time()
+        for series in self.series.values():
+            series.prune(now)
+
+    async def start(self):
+        """Record the things there already and run the retention, a startup handler."""
+        if self.things is not None:
+            for _, thing in await self.things.get_things():
+                self.watch(thing)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the retention and unmap the series, a shutdown handler."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for series in self.series.values():
+            series.close()
+        self._mapped.clear()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.prune()
+            except OSError as e:
+                logger.error(f"failed to prune the history in {self.path}: {e}")
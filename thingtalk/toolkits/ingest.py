@@ -0,0 +1,227 @@
+"""
+Ingest device state from MQTT topics into things.
+
+Routes map topic patterns to thing ids, e.g.
+
+    Ingest(things, {"zigbee2mqtt/{name}": "{name}"})
+
+A `{placeholder}` matches one topic level and can be used in the thing id
+template, `+` and a trailing `#` work as in MQTT. A pattern capturing
+`{property}` receives bare values for that property, e.g.
+`{"homie/{id}/{property}": "urn:homie:{id}"}`, any other pattern receives
+JSON objects of property name -> value.
+
+All patterns are compiled into one regular expression and resolved topics
+are cached, payloads are decoded with orjson. Messages are merged per
+thing for a short window, so each thing gets one bulk_sync_property call,
+and subscribers one propertyStatus, per window however many messages
+arrived.
+"""
+
+import asyncio
+import re
+import typing
+
+import orjson
+from loguru import logger
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+Resolved = typing.Tuple[str, typing.Optional[str]]
+
+
+class Route:
+    """A topic pattern and the thing id it maps to."""
+
+    __slots__ = ("pattern", "template", "group", "names", "filter", "regex")
+
+    def __init__(self, pattern: str, template: str, group: str):
+        """
+        Initialize the object.
+        pattern -- the topic pattern, with {placeholders}, + and #
+        template -- the thing id, formatted with the placeholders
+        group -- the name of the route's group in the combined expression
+        """
+        self.pattern = pattern
+        self.template = template
+        self.group = group
+        self.names: typing.List[str] = []
+        # the filter the broker is subscribed to
+        self.filter = "/".join("+" if _PLACEHOLDER.search(word) else word for word in pattern.split("/"))
+        self.regex = self._compile()
+
+    def _compile(self) -> str:
+        """Get the regular expression of the pattern, with unique group names."""
+        words = self.pattern.split("/")
+        parts = []
+        for index, word in enumerate(words):
+            if word == "#":
+                if index != len(words) - 1:
+                    raise ValueError(f"# must be the last level of {self.pattern}")
+                # like MQTT, a/# matches a too
+                return "/".join(parts) + "(?:/.*)?" if parts else ".*"
+            if word == "+":
+                parts.append("[^/]+")
+                continue
+            regex, position = "", 0
+            for match in _PLACEHOLDER.finditer(word):
+                name = match.group(1)
+                self.names.append(name)
+                regex += re.escape(word[position:match.start()]) + f"(?P<{self.group}_{name}>[^/]+)"
+                position = match.end()
+            parts.append(regex + re.escape(word[position:]))
+        return "/".join(parts)
+
+
+class Ingest:
+    """Micro-batch MQTT messages into Thing.bulk_sync_property calls."""
+
+    # resolved topics cached, the cache is emptied when it outgrows this
+    cache_size = 65536
+
+    def __init__(self, things, routes: typing.Dict[str, str], window: float = 0.05):
+        """
+        Initialize the object.
+        things -- the things container, anything with get_thing(id)
+        routes -- topic pattern -> thing id template
+        window -- seconds messages of one thing are merged for
+        """
+        self.things = things
+        self.window = window
+        self.routes: typing.Dict[str, Route] = {}
+        for index, (pattern, template) in enumerate(routes.items()):
+            route = Route(pattern, template, f"r{index}")
+            self.routes[route.group] = route
+        self._matcher = re.compile(
+            "|".join(f"(?P<{group}>{route.regex})" for group, route in self.routes.items())
+        )
+        self._resolved: typing.Dict[str, typing.Optional[Resolved]] = {}
+        # thing -> merged property values of the current window
+        self._pending: typing.Dict[typing.Any, dict] = {}
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+        self._syncing: typing.Set[asyncio.Future] = set()
+        self.received = 0
+        self.dropped = 0
+        self.batches = 0
+
+    @property
+    def filters(self) -> typing.List[str]:
+        """Get the topic filters to subscribe to."""
+        return list(dict.fromkeys(route.filter for route in self.routes.values()))
+
+    def resolve(self, topic: str) -> typing.Optional[Resolved]:
+        """
+        Get the thing id and the property a topic maps to.
+        topic -- the topic of a message
+        Returns (thing id, property name or None), None if no route matches.
+        """
+        try:
+            return self._resolved[topic]
+        except KeyError:
+            pass
+
+        match = self._matcher.fullmatch(topic)
+        resolved = None
+        if match is not None:
+            route = self.routes[match.lastgroup]
+            captures = {name: match.group(f"{route.group}_{name}") for name in route.names}
+            resolved = route.template.format(**captures), captures.get("property")
+
+        if len(self._resolved) >= self.cache_size:
+            self._resolved.clear()
+        self._resolved[topic] = resolved
+        return resolved
+
+    def feed(self, topic: str, payload: typing.Union[bytes, str]) -> bool:
+        """
+        Take a message, must be called on the loop.
+        topic -- the topic of the message
+        payload -- the raw payload
+        Returns whether the message was queued for a thing.
+        """
+        self.received += 1
+        resolved = self.resolve(topic)
+        if resolved is None:
+            self.dropped += 1
+            return False
+
+        thing_id, property_name = resolved
+        thing = self.things.get_thing(thing_id)
+        if thing is None:
+            self.dropped += 1
+            return False
+
+        try:
+            value = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            if property_name is None:
+                logger.warning(f"can't decode the payload of {topic}")
+                self.dropped += 1
+                return False
+            # a bare string value
+            value = payload.decode() if isinstance(payload, bytes) else payload
+
+        if property_name is not None:
+            data = {property_name: value}
+        elif isinstance(value, dict):
+            data = value
+        else:
+            logger.warning(f"the payload of {topic} isn't an object")
+            self.dropped += 1
+            return False
+
+        pending = self._pending.get(thing)
+        if pending is None:
+            # decoded just now, so nobody else holds it
+            self._pending[thing] = data
+        else:
+            pending.update(data)
+
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._expired)
+        return True
+
+    async def flush(self):
+        """Sync everything waiting now, and wait for the syncs to finish."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        await self._sync(pending)
+        if self._syncing:
+            await asyncio.gather(*self._syncing, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Get the message counters."""
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "pending": len(self._pending),
+        }
+
+    def _expired(self):
+        self._timer = None
+        pending, self._pending = self._pending, {}
+        future = asyncio.ensure_future(self._sync(pending))
+        self._syncing.add(future)
+        future.add_done_callback(self._syncing.discard)
+
+    async def _sync(self, pending: dict):
+        if not pending:
+            return
+        self.batches += 1
+        things = []
+        coros = []
+        for thing, data in pending.items():
+            # drop what the thing doesn't have instead of warning per message
+            properties = thing.properties
+            data = {name: value for name, value in data.items() if name in properties}
+            if data:
+                things.append(thing)
+                coros.append(thing.bulk_sync_property(data))
+
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for thing, result in zip(things, results):
+            if isinstance(result, Exception):
+                logger.opt(exception=result).error(f"failed to sync {thing.id}")
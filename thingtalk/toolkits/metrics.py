@@ -0,0 +1,306 @@
+"""
+Low overhead metrics in the Prometheus text exposition format.
+
+Counters are plain attribute updates and histograms append to a buffer
+that is only sorted into buckets every few hundred observations or on
+scrape. The children of labelled metrics are cached by label values, so
+`metric.labels("a").inc()` costs one dict lookup and one addition. Any
+metric can instead be computed from a callback on scrape, then the
+instrumented code only keeps its own plain counts, or nothing at all.
+`REGISTRY.expose()` renders every metric.
+"""
+
+import math
+import typing
+
+from bisect import bisect_right
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+LabelValues = typing.Tuple[str, ...]
+
+
+class Registry:
+    """A collection of metrics, rendered together."""
+
+    def __init__(self):
+        self._metrics: typing.Dict[str, "Metric"] = {}
+
+    def register(self, metric: "Metric"):
+        """Add a metric, its name must be unique."""
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def unregister(self, metric: "Metric"):
+        """Remove a metric."""
+        self._metrics.pop(metric.name, None)
+
+    def get(self, name: str) -> typing.Optional["Metric"]:
+        """Get a metric by name."""
+        return self._metrics.get(name)
+
+    def expose(self) -> str:
+        """Render every metric in the text exposition format."""
+        lines: typing.List[str] = []
+        for metric in tuple(self._metrics.values()):
+            lines.extend(metric.expose())
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        """Increase the counter."""
+        self.value += amount
+
+
+class _GaugeValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float):
+        """Set the gauge."""
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        """Increase the gauge."""
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        """Decrease the gauge."""
+        self.value -= amount
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "_counts", "_sum", "_pending")
+
+    FOLD_SIZE = 256
+
+    def __init__(self, bounds: typing.Tuple[float, ...]):
+        self.bounds = bounds
+        # one count per bucket plus +Inf, cumulated when rendered
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+        self._pending: typing.List[float] = []
+
+    def observe(self, value: float):
+        """Record an observation."""
+        pending = self._pending
+        pending.append(value)
+        if len(pending) >= self.FOLD_SIZE:
+            self._fold()
+
+    @property
+    def counts(self) -> typing.List[int]:
+        """Get the count of every bucket, the last one is +Inf."""
+        self._fold()
+        return self._counts
+
+    @property
+    def sum(self) -> float:
+        """Get the sum of all observations."""
+        self._fold()
+        return self._sum
+
+    def _fold(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        # sorting once and bisecting per bucket beats bisecting per value
+        pending.sort()
+        counts = self._counts
+        below = 0
+        for index, bound in enumerate(self.bounds):
+            upto = bisect_right(pending, bound)
+            counts[index] += upto - below
+            below = upto
+        counts[-1] += len(pending) - below
+        self._sum += sum(pending)
+
+
+class Metric:
+    """A named metric, optionally split into children by label values."""
+
+    type_ = "untyped"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: typing.Sequence[str] = (),
+                 registry: typing.Optional[Registry] = REGISTRY,
+                 function: typing.Optional[typing.Callable[[], typing.Any]] = None):
+        """
+        Initialize the metric.
+        name -- the metric name
+        documentation -- the help text
+        labelnames -- names of the labels, each child has one value per label
+        registry -- the registry to add the metric to, None for none
+        function -- compute the value on scrape instead, returns a number, or
+                    (label values, number) pairs for a labelled metric
+        """
+        self.function = function
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: typing.Dict[LabelValues, typing.Any] = {}
+        if not self.labelnames:
+            self._children[()] = self._child()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values: str):
+        """Get the child of some label values."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._child()
+        return child
+
+    def clear(self):
+        """Remove every child."""
+        self._children.clear()
+        if not self.labelnames:
+            self._children[()] = self._child()
+
+    def expose(self) -> typing.List[str]:
+        """Render the metric in the text exposition format."""
+        lines = [
+            f"# HELP {self.name} {_escape_help(self.documentation)}",
+            f"# TYPE {self.name} {self.type_}",
+        ]
+        for values, sample in self.samples():
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(sample)}")
+        return lines
+
+    def samples(self) -> typing.Iterator[typing.Tuple[LabelValues, float]]:
+        """Get the value of every child."""
+        if self.function is None:
+            for values, child in tuple(self._children.items()):
+                yield values, child.value
+        elif self.labelnames:
+            for values, value in self.function():
+                yield tuple(values), value
+        else:
+            yield (), self.function()
+
+    def _child(self):
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. a number of messages."""
+
+    type_ = "counter"
+
+    def inc(self, amount: float = 1):
+        """Increase an unlabelled counter."""
+        self._children[()].value += amount
+
+    def _child(self):
+        return _CounterValue()
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. a queue depth."""
+
+    type_ = "gauge"
+
+    def set(self, value: float):
+        """Set an unlabelled gauge."""
+        self._children[()].value = value
+
+    def inc(self, amount: float = 1):
+        """Increase an unlabelled gauge."""
+        self._children[()].value += amount
+
+    def dec(self, amount: float = 1):
+        """Decrease an unlabelled gauge."""
+        self._children[()].value -= amount
+
+    def _child(self):
+        return _GaugeValue()
+
+
+class Histogram(Metric):
+    """Observations counted into buckets, e.g. latencies in seconds."""
+
+    type_ = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: typing.Sequence[str] = (),
+                 registry: typing.Optional[Registry] = REGISTRY,
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Initialize the histogram.
+        buckets -- the upper bounds of the buckets, +Inf is always added
+        """
+        self.buckets = tuple(sorted(b for b in buckets if b != math.inf))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float):
+        """Record an observation on an unlabelled histogram."""
+        self._children[()].observe(value)
+
+    def expose(self) -> typing.List[str]:
+        lines = [
+            f"# HELP {self.name} {_escape_help(self.documentation)}",
+            f"# TYPE {self.name} {self.type_}",
+        ]
+        labelnames = self.labelnames + ("le",)
+        for values, child in tuple(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                labels = _labels(labelnames, values + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_number(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def samples(self):
+        for values, child in tuple(self._children.items()):
+            yield values, sum(child.counts)
+
+    def _child(self):
+        return _HistogramValue(self.buckets)
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", r"\\").replace("\n", r"\n")
+
+
+def _escape_value(text: str) -> str:
+    return text.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _labels(names: LabelValues, values: typing.Sequence[typing.Any]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_value(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if value.is_integer():
+            return str(int(value)) if abs(value) < 1e15 else repr(value)
+        return repr(value)
+    return str(value)
@@ -0,0 +1,190 @@
+"""
+Event loop lag and slow callback monitor.
+
+While a LoopMonitor runs, a task measures how late the loop wakes it up,
+and every callback or coroutine step the loop runs is timed. Steps slower
+than the threshold are recorded with what they were working on: the bus
+topic of a message, the thing id and the action name, found in the locals
+of the coroutine or on the object of a bound method.
+
+Timing works by wrapping asyncio's Handle._run while a monitor is started,
+so nothing at all is added to the loop when no monitor runs. Loops that
+don't run their callbacks through asyncio's Handle, like uvloop, which
+uvicorn picks when it's installed, can't be timed that way: there only
+the lag is sampled, run uvicorn with `--loop asyncio` for slow callbacks.
+"""
+
+import asyncio
+import asyncio.events
+import time
+import typing
+
+from collections import deque
+from types import FrameType
+
+from loguru import logger
+
+from ..models.action import Action
+from ..models.thing import Thing
+from ..utils import timestamp
+
+_handle_run = asyncio.events.Handle._run
+_active: typing.Optional["LoopMonitor"] = None
+
+
+def _timed_run(handle: asyncio.Handle):
+    monitor = _active
+    callback = handle._callback
+    task = getattr(callback, "__self__", None)
+    # the frame of a coroutine is gone once it returns, keep it for the report
+    frame = task.get_coro().cr_frame if isinstance(task, asyncio.Task) else None
+    started = time.perf_counter()
+    _handle_run(handle)
+    duration = time.perf_counter() - started
+    if monitor is not None and duration >= monitor.threshold:
+        monitor.record(callback, task, frame, duration)
+
+
+def _name(callback, task) -> str:
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return getattr(coro, "__qualname__", repr(coro))
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+def _attribute(record: dict, callback, task, frame: typing.Optional[FrameType]):
+    objects = list(frame.f_locals.values()) if frame is not None else []
+    if task is not None and not isinstance(task, asyncio.Task):
+        # the object of a bound method
+        objects.append(task)
+    for obj in objects:
+        if isinstance(obj, Action):
+            record.setdefault("action", obj.name)
+            record.setdefault("thing", obj.thing.id)
+        elif isinstance(obj, Thing):
+            record.setdefault("thing", obj.id)
+        else:
+            topic = getattr(obj, "topic", None)
+            if isinstance(topic, str):
+                record.setdefault("topic", topic)
+
+
+class LoopMonitor:
+    """Measure the loop lag and record slow callbacks."""
+
+    def __init__(self, threshold: float = 0.05, interval: float = 0.1,
+                 max_records: int = 100, window: int = 600):
+        """
+        Initialize the monitor.
+        threshold -- seconds a callback or coroutine step may take
+        interval -- seconds between two lag samples
+        max_records -- number of slow callbacks kept, the newest ones
+        window -- number of lag samples the statistics are computed over
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.slow: typing.Deque[dict] = deque(maxlen=max_records)
+        # callback name -> [count, total seconds, max seconds]
+        self.callbacks: typing.Dict[str, typing.List[float]] = {}
+        self.lags: typing.Deque[float] = deque(maxlen=window)
+        self.max_lag = 0.0
+        # whether callbacks are timed, False on loops like uvloop
+        self.timing = False
+        self._sampler: typing.Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        """Check whether the monitor is started."""
+        return self._sampler is not None
+
+    async def start(self):
+        """Start sampling and timing the running loop, a startup handler."""
+        global _active
+        if self._sampler is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self.timing = isinstance(loop, asyncio.BaseEventLoop)
+        if self.timing:
+            if _active is not None and _active is not self:
+                raise RuntimeError("another LoopMonitor is already running")
+            _active = self
+            asyncio.events.Handle._run = _timed_run
+        else:
+            logger.warning(
+                f"{type(loop).__module__}.{type(loop).__name__} doesn't run callbacks through "
+                f"asyncio.Handle, only the loop lag is sampled, slow callbacks aren't recorded; "
+                f"run uvicorn with --loop asyncio to record them"
+            )
+        self._sampler = asyncio.create_task(self._sample())
+
+    async def stop(self):
+        """Stop sampling and timing, a shutdown handler."""
+        global _active
+        if _active is self:
+            asyncio.events.Handle._run = _handle_run
+            _active = None
+        sampler, self._sampler = self._sampler, None
+        if sampler is not None:
+            sampler.cancel()
+            try:
+                await sampler
+            except asyncio.CancelledError:
+                pass
+
+    def record(self, callback, task, frame: typing.Optional[FrameType], duration: float):
+        """
+        Record a slow callback.
+        callback -- the callback the loop ran
+        task -- the task of a coroutine step, or the object of a bound method
+        frame -- the frame of the task's coroutine
+        duration -- seconds it took
+        """
+        name = _name(callback, task)
+        record = {"at": timestamp(), "duration": duration, "callback": name}
+        try:
+            _attribute(record, callback, task, frame)
+        except Exception as e:
+            logger.debug(f"can't attribute slow callback {name}: {e}")
+        self.slow.append(record)
+
+        totals = self.callbacks.get(name)
+        if totals is None:
+            totals = self.callbacks[name] = [0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += duration
+        if duration > totals[2]:
+            totals[2] = duration
+        logger.warning(f"slow callback {record}")
+
+    def report(self) -> dict:
+        """Get the lag statistics and the slow callbacks, newest first."""
+        lags = sorted(self.lags)
+        return {
+            "running": self.running,
+            "timing": self.timing,
+            "threshold": self.threshold,
+            "lag": {
+                "samples": len(lags),
+                "last": self.lags[-1] if self.lags else None,
+                "mean": sum(lags) / len(lags) if lags else None,
+                "p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else None,
+                "max": self.max_lag,
+            },
+            "callbacks": {
+                name: {"count": count, "total": total, "max": max_}
+                for name, (count, total, max_) in sorted(
+                    self.callbacks.items(), key=lambda item: item[1][1], reverse=True
+                )
+            },
+            "slow": list(reversed(self.slow)),
+        }
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lags.append(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
@@ -1,12 +1,369 @@
-import uuid
+"""
+MQTT clients of a gateway.
+
+Publishing goes through a Publisher: messages are queued without waiting
+for the network, and sent by a task at a bounded rate. While a message
+waits, a newer one for the same topic can replace it (coalesce=True), so
+a backlog never carries stale states. Topics get MQTT 5 topic aliases as
+far as the broker allows. While disconnected the queue fills up, then
+spills to a bounded spool file that is sent, oldest first, after the
+reconnect.
+"""
+
+import asyncio
+import itertools
+import os
+import struct
 import time
+import typing
+import uuid
+
+from collections import OrderedDict
 
 import gmqtt
+import orjson
 
 from loguru import logger
 
 from .event_bus import ee
 
+# topic length, payload length, properties length, qos, retain
+_RECORD = struct.Struct("!IIIBB")
+
+
+class OutgoingMessage:
+    """A message waiting to be published."""
+
+    __slots__ = ("topic", "payload", "qos", "retain", "properties")
+
+    def __init__(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False,
+                 properties: typing.Optional[dict] = None):
+        """
+        Initialize the object.
+        topic -- the topic
+        payload -- the encoded payload
+        qos -- the QoS level
+        retain -- whether the broker retains it
+        properties -- MQTT 5 properties, e.g. content_type
+        """
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.properties = properties or {}
+
+
+def encode_payload(payload) -> bytes:
+    """Encode a payload like gmqtt does, JSON with orjson."""
+    if isinstance(payload, bytes):
+        return payload
+    if isinstance(payload, str):
+        return payload.encode()
+    if payload is None:
+        return b""
+    if isinstance(payload, (int, float)) and not isinstance(payload, bool):
+        return str(payload).encode()
+    return orjson.dumps(payload)
+
+
+class Spool:
+    """
+    A bounded append-only file of messages.
+    Read from the front while new messages are appended, it is emptied once
+    everything has been read.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 16 * 1024 * 1024):
+        """
+        Initialize the object.
+        path -- the file, messages left there by a previous run are kept
+        max_bytes -- the maximum file size, messages beyond it are dropped
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._file = open(path, "a+b")
+        self._file.seek(0, os.SEEK_END)
+        self._size = self._file.tell()
+        self._offset = 0
+
+    def __len__(self) -> int:
+        """Get the number of bytes not read yet."""
+        return self._size - self._offset
+
+    def append(self, message: OutgoingMessage) -> bool:
+        """
+        Add a message at the end.
+        Returns False if the spool is full and the message was dropped.
+        """
+        topic = message.topic.encode()
+        properties = orjson.dumps(message.properties) if message.properties else b""
+        record = _RECORD.pack(len(topic), len(message.payload), len(properties),
+                              message.qos, message.retain) + topic + message.payload + properties
+        if self._size + len(record) > self.max_bytes:
+            self.dropped += 1
+            return False
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(record)
+        self._size += len(record)
+        return True
+
+    def flush(self):
+        """Write the appended messages to disk."""
+        self._file.flush()
+
+    def pop(self) -> typing.Optional[OutgoingMessage]:
+        """Take the oldest message, None if the spool is empty."""
+        if self._offset >= self._size:
+            return None
+        self._file.flush()
+        self._file.seek(self._offset)
+        header = self._file.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            # a record cut short by a crash
+            self.clear()
+            return None
+        topic_length, payload_length, properties_length, qos, retain = _RECORD.unpack(header)
+        body = self._file.read(topic_length + payload_length + properties_length)
+        if len(body) < topic_length + payload_length + properties_length:
+            self.clear()
+            return None
+        self._offset += _RECORD.size + len(body)
+        properties = body[topic_length + payload_length:]
+        message = OutgoingMessage(
+            body[:topic_length].decode(),
+            body[topic_length:topic_length + payload_length],
+            qos,
+            bool(retain),
+            _properties(orjson.loads(properties)) if properties else None,
+        )
+        if self._offset >= self._size:
+            self.clear()
+        return message
+
+    def clear(self):
+        """Drop everything."""
+        self._file.seek(0)
+        self._file.truncate()
+        self._size = self._offset = 0
+
+    def close(self):
+        """Close the file, what wasn't read stays for the next run."""
+        if self._offset:
+            # keep only the unread tail
+            self._file.seek(self._offset)
+            rest = self._file.read()
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.write(rest)
+        self._file.close()
+
+
+def _properties(properties: dict) -> dict:
+    # JSON has no tuples, gmqtt wants (name, value) pairs for user properties
+    user_property = properties.get("user_property")
+    if user_property:
+        if isinstance(user_property[0], list):
+            properties["user_property"] = [tuple(pair) for pair in user_property]
+        else:
+            properties["user_property"] = tuple(user_property)
+    return properties
+
+
+class Publisher:
+    """
+    Queue, coalesce and rate limit the messages of a client.
+    Topic aliases only replace the topic of QoS 0 messages, messages that
+    may be resent after a reconnect, when aliases are reset, always carry
+    their topic.
+    """
+
+    def __init__(self,
+                 client,
+                 rate: float = 1000.0,
+                 max_pending: int = 10000,
+                 spool_path: typing.Optional[str] = None,
+                 spool_max_bytes: int = 16 * 1024 * 1024):
+        """
+        Initialize the object.
+        client -- the gmqtt client to publish with
+        rate -- maximum messages per second
+        max_pending -- messages queued in memory while disconnected before
+                       they spill to the spool, or are dropped without one
+        spool_path -- the spool file, None for none
+        spool_max_bytes -- the maximum size of the spool file
+        """
+        self.client = client
+        self.rate = rate
+        self.max_pending = max_pending
+        self.spool = Spool(spool_path, spool_max_bytes) if spool_path else None
+        self.connected = False
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+        # topic, or (topic, sequence number) for messages that don't
+        # coalesce -> message, oldest first
+        self._queue: typing.OrderedDict[typing.Any, OutgoingMessage] = OrderedDict()
+        self._sequence = itertools.count()
+        self._aliases: typing.OrderedDict[str, int] = OrderedDict()
+        self._alias_maximum = 0
+        # a message that failed to send, it goes first next time
+        self._retry: typing.Optional[OutgoingMessage] = None
+        self._tokens = 1.0
+        self._refilled = time.monotonic()
+        self._wake: typing.Optional[asyncio.Event] = None
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the sending task, on the loop it will run on."""
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._wake.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the sending task, spooling what is still queued."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.spool is not None:
+            self._spill()
+            self.spool.close()
+
+    def put(self, topic: str, payload, qos: int = 0, retain: bool = False,
+            coalesce: bool = False, **properties):
+        """
+        Queue a message.
+        topic -- the topic
+        payload -- bytes, str, a number or anything orjson serializes
+        qos -- the QoS level
+        retain -- whether the broker retains it
+        coalesce -- replace a message for the same topic that is still
+                    waiting, keeping its place in the queue
+        properties -- MQTT 5 properties, e.g. content_type
+        """
+        message = OutgoingMessage(topic, encode_payload(payload), qos, retain, properties)
+        if coalesce:
+            if topic in self._queue:
+                self.coalesced += 1
+            self._queue[topic] = message
+        else:
+            self._queue[(topic, next(self._sequence))] = message
+
+        if not self.connected and len(self._queue) > self.max_pending:
+            if self.spool is not None:
+                self._spill()
+            else:
+                self._queue.popitem(last=False)
+                self.dropped += 1
+        if self._wake is not None:
+            self._wake.set()
+
+    def on_connect(self):
+        """Call when the client has connected, sending resumes."""
+        self.connected = True
+        self._aliases.clear()
+        maximum = self.client.properties.get("topic_alias_maximum", 0)
+        self._alias_maximum = maximum[0] if isinstance(maximum, (list, tuple)) else maximum
+        if self._wake is not None:
+            self._wake.set()
+
+    def on_disconnect(self):
+        """Call when the client has lost its connection."""
+        self.connected = False
+        self._aliases.clear()
+
+    def stats(self) -> dict:
+        """Get the counters."""
+        return {
+            "connected": self.connected,
+            "queued": len(self._queue),
+            "spooled": len(self.spool) if self.spool is not None else 0,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "dropped": self.dropped + (self.spool.dropped if self.spool is not None else 0),
+        }
+
+    def _spill(self):
+        """Move the queue to the end of the spool."""
+        queue, self._queue = self._queue, OrderedDict()
+        if self._retry is not None:
+            self.spool.append(self._retry)
+            self._retry = None
+        for message in queue.values():
+            self.spool.append(message)
+        self.spool.flush()
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self.connected:
+                message = self._next()
+                if message is None:
+                    break
+                await self._throttle()
+                try:
+                    self._send(message)
+                except Exception as e:
+                    # the broker may not know the alias, the topic goes again
+                    self._aliases.pop(message.topic, None)
+                    if isinstance(e, OSError) or not getattr(self.client, "is_connected", True):
+                        logger.warning(f"failed to publish to {message.topic}, retrying after the reconnect: {e}")
+                        self._retry = message
+                        self.on_disconnect()
+                    else:
+                        # e.g. too large, retrying would block everything behind it
+                        logger.error(f"dropped a message to {message.topic} that can't be published: {e}")
+                        self.failed += 1
+
+    def _next(self) -> typing.Optional[OutgoingMessage]:
+        if self._retry is not None:
+            message, self._retry = self._retry, None
+            return message
+        # the spool only holds messages older than the queue
+        if self.spool is not None and len(self.spool):
+            return self.spool.pop()
+        if self._queue:
+            return self._queue.popitem(last=False)[1]
+        return None
+
+    async def _throttle(self):
+        now = time.monotonic()
+        self._tokens = min(max(1.0, self.rate / 10), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens < 1:
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._tokens = 1.0
+            self._refilled = time.monotonic()
+        self._tokens -= 1
+
+    def _send(self, message: OutgoingMessage):
+        topic = message.topic
+        properties = message.properties
+        if self._alias_maximum:
+            alias = self._aliases.get(topic)
+            if alias is not None:
+                self._aliases.move_to_end(topic)
+                if message.qos == 0:
+                    topic = ""
+            else:
+                if len(self._aliases) < self._alias_maximum:
+                    alias = len(self._aliases) + 1
+                else:
+                    # reuse the alias of the least recently published topic
+                    _, alias = self._aliases.popitem(last=False)
+                self._aliases[topic] = alias
+            properties = {**properties, "topic_alias": alias}
+        self.client.publish(topic, message.payload, qos=message.qos, retain=message.retain, **properties)
+        self.sent += 1
+
 
 class Client(gmqtt.Client):
     app = None
@@ -23,7 +380,22 @@ class Mqtt:
                  broker_port,
                  token: str = '',
                  username: str = '',
-                 password: str = ''):
+                 password: str = '',
+                 ingest=None,
+                 publish_rate: float = 1000.0,
+                 spool_path: typing.Optional[str] = None):
+        """
+        Initialize the object.
+        broker_host -- the broker's host
+        broker_port -- the broker's port
+        token -- the token to authenticate with
+        username -- the user name to authenticate with
+        password -- the password to authenticate with
+        ingest -- an Ingest syncing received messages into things, its
+                  filters are subscribed on connect
+        publish_rate -- maximum messages published per second
+        spool_path -- the file messages are spooled to while disconnected
+        """
         self.sub_client = Client(f"sub_client:{uuid.uuid4().hex}",
                                  session_expiry_interval=600)
         self.pub_client = Client(f"pub_client:{uuid.uuid4().hex}")
@@ -40,23 +412,35 @@ class Mqtt:
 
         self.broker_host = broker_host
         self.broker_port = broker_port
+        self.ingest = ingest
+        self.publisher = Publisher(self.pub_client, rate=publish_rate, spool_path=spool_path)
 
     async def connect(self):
+        self.publisher.start()
         await self.sub_client.connect(self.broker_host, self.broker_port)
         await self.pub_client.connect(self.broker_host, self.broker_port)
+        if self.ingest is not None:
+            for topic_filter in self.ingest.filters:
+                self.sub_client.subscribe(topic_filter, qos=0)
 
     async def set_app(self, app):
         await self.sub_client.set_app(app)
         await self.pub_client.set_app(app)
 
     async def publish(self, topic, payload, qos=1, content_type='json',
-                      message_expiry_interval=60, topic_alias=1, user_property=('time', str(time.time()))):
-        # just another way to publish same message
-        self.pub_client.publish(topic, payload, qos=qos, content_type=content_type,
-                                message_expiry_interval=message_expiry_interval, topic_alias=topic_alias,
-                                user_property=user_property)
+                      message_expiry_interval=60, user_property=None, retain=False, coalesce=False):
+        """
+        Queue a message for publishing, see Publisher.put.
+        user_property -- default the publishing time
+        """
+        if user_property is None:
+            user_property = ('time', str(time.time()))
+        self.publisher.put(topic, payload, qos=qos, retain=retain, coalesce=coalesce,
+                           content_type=content_type, message_expiry_interval=message_expiry_interval,
+                           user_property=user_property)
 
     async def disconnect(self):
+        await self.publisher.stop()
         await self.pub_client.disconnect()
         await self.sub_client.disconnect(session_expiry_interval=0)
 
@@ -69,13 +453,19 @@ class Mqtt:
 
     def on_connect(self, client: Client, flags, rc, properties):
         logger.info(f"[CONNECTED {client._client_id}]")
+        if client is self.pub_client:
+            self.publisher.on_connect()
 
     async def on_message(self, client: Client, topic, payload, qos, properties):
+        if self.ingest is not None and self.ingest.feed(topic, payload):
+            return
         logger.info(
             f"[RECV MSG {client._client_id}] TOPIC: {topic} PAYLOAD: {payload} QOS: {qos} PROPERTIES: {properties}")
 
     def on_disconnect(self, client: Client, packet, exc=None):
         logger.info(f"[DISCONNECTED {client._client_id}]")
+        if client is self.pub_client:
+            self.publisher.on_disconnect()
 
     def on_subscribe(self, client: Client, mid, qos, properties):
         # in order to check if all the subscriptions were successful, we should first get all subscriptions with this
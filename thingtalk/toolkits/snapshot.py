@@ -0,0 +1,194 @@
+"""
+Durable property state, restored on restart.
+
+Every change notified on things/+/samples is remembered, and the changes
+are appended to a file as one JSON line per interval:
+
+    {"urn:thing:1": {"on": true}, "urn:thing:2": {"level": 12}}
+
+Later lines win. When the file has grown to a few times the size of the
+last full state, it is compacted: the full state is written to a new file
+that replaces it. On start the lines are merged back and the last values
+are put into the things without notifying anyone, and things added later
+get theirs when they are added to the container.
+"""
+
+import asyncio
+import os
+import typing
+
+import orjson
+from jsonschema.exceptions import ValidationError
+from loguru import logger
+
+from .event_bus import ee, Subscription
+from .executor import run_blocking
+from ..models.validation import compile_validator
+
+State = typing.Dict[str, typing.Dict[str, typing.Any]]
+
+
+def read_state(path: str) -> State:
+    """
+    Merge the lines of a state file.
+    path -- the file
+    Returns thing id -> property name -> value, empty if there is no file.
+    """
+    state: State = {}
+    try:
+        with open(path, "rb") as f:
+            lines = f.read().split(b"\n")
+    except FileNotFoundError:
+        return state
+
+    for number, line in enumerate(lines):
+        if not line:
+            continue
+        try:
+            changes = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # a line cut short by a crash
+            logger.warning(f"skip broken line {number + 1} of {path}")
+            continue
+        for thing_id, values in changes.items():
+            known = state.get(thing_id)
+            if known is None:
+                state[thing_id] = values
+            else:
+                known.update(values)
+    return state
+
+
+class StateSnapshot:
+    """Persist the last value of every property of a container's things."""
+
+    def __init__(self, path: str, things, interval: float = 5.0, compact_factor: float = 4.0):
+        """
+        Initialize the object.
+        path -- the state file
+        things -- the things container
+        interval -- seconds between two appends of the changes
+        compact_factor -- compact when the file is this many times the size
+                          of the last full state
+        """
+        self.path = path
+        self.things = things
+        self.interval = interval
+        self.compact_factor = compact_factor
+        self.restored = 0
+        # everything known, also of things not added (yet)
+        self._state: State = {}
+        self._dirty: State = {}
+        self._size = 0
+        self._compacted_size = 0
+        self._subscription: typing.Optional[Subscription] = None
+        self._task: typing.Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Restore the things and start recording, a startup handler."""
+        self._state = await run_blocking(read_state, self.path)
+        for _, thing in await self.things.get_things():
+            self.restore(thing)
+        self._size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self._compacted_size = self._size
+        self._subscription = ee.subscribe("things/+/samples", self.on_samples)
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"restored {self.restored} property values from {self.path}")
+
+    async def stop(self):
+        """Stop recording and write the full state, a shutdown handler."""
+        if self._subscription is not None:
+            ee.unsubscribe(self._subscription)
+            self._subscription = None
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.compact()
+
+    def restore(self, thing):
+        """
+        Put the saved values into a thing's properties, without notifying.
+        Values its properties no longer accept are skipped.
+        thing -- the thing
+        """
+        values = self._state.get(thing.id)
+        if not values:
+            return
+        for name, value in values.items():
+            prop = thing.properties.get(name)
+            if prop is None:
+                continue
+            try:
+                compile_validator(prop.metadata, prop.fast_validation)(value)
+            except ValidationError:
+                logger.warning(f"skip saved value {value} of {thing.id} {name}")
+                continue
+            prop.value.reset(value)
+            self.restored += 1
+
+    def on_samples(self, message):
+        """Remember the changes of a propertyStatus message."""
+        if message.messageType != "propertyStatus":
+            return
+        thing_id = message.topic[len("things/"):]
+        dirty = self._dirty.get(thing_id)
+        if dirty is None:
+            self._dirty[thing_id] = dict(message.data)
+        else:
+            dirty.update(message.data)
+
+    async def save(self):
+        """Append the changes since the last save."""
+        dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        for thing_id, values in dirty.items():
+            known = self._state.get(thing_id)
+            if known is None:
+                self._state[thing_id] = dict(values)
+            else:
+                known.update(values)
+        line = orjson.dumps(dirty, default=str) + b"\n"
+        await run_blocking(self._append, line, serial=self)
+        self._size += len(line)
+
+    async def compact(self):
+        """Replace the file with the current full state."""
+        dirty, self._dirty = self._dirty, {}
+        for thing_id, values in dirty.items():
+            self._state.setdefault(thing_id, {}).update(values)
+        # the values that were never notified, e.g. held back by a deadband
+        for _, thing in await self.things.get_things():
+            if thing.properties:
+                values = self._state.setdefault(thing.id, {})
+                for name, prop in thing.properties.items():
+                    values[name] = prop.value.last_value
+        data = orjson.dumps(self._state, default=str) + b"\n"
+        await run_blocking(self._replace, data, serial=self)
+        self._size = self._compacted_size = len(data)
+
+    def _append(self, line: bytes):
+        with open(self.path, "ab") as f:
+            f.write(line)
+
+    def _replace(self, data: bytes):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save()
+                if self._size > max(self._compacted_size * self.compact_factor, 64 * 1024):
+                    await self.compact()
+            except OSError as e:
+                logger.error(f"failed to save the state to {self.path}: {e}")
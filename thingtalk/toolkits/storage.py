@@ -0,0 +1,281 @@
+"""
+Document storage for rules, scenes and other JSON documents keyed by id.
+
+`Storage` is the interface the routers program against. `SQLiteDatabase`
+keeps one table per collection with the document id as primary key, in
+WAL mode. Tables are read once into memory, reads are served from that
+cache and writes are applied to it immediately, then written behind in
+batched transactions on a dedicated thread, so the event loop never waits
+on disk I/O and CRUD latency doesn't depend on the table size.
+
+Rules and scenes used to be kept in a TinyDB JSON file. A table that
+doesn't exist yet in the SQLite file is filled from the same table of
+that file, if there is one, when it is first opened.
+"""
+
+import asyncio
+import json
+import sqlite3
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+from loguru import logger
+
+
+class Storage:
+    """A collection of JSON documents, each with a unique "id" field."""
+
+    async def all(self) -> typing.List[dict]:
+        """Get every document."""
+        raise NotImplementedError()
+
+    async def get(self, doc_id: str) -> typing.Optional[dict]:
+        """Get a document by id, None if it doesn't exist."""
+        raise NotImplementedError()
+
+    async def insert(self, doc: dict) -> dict:
+        """Insert or replace a document, returns the stored document."""
+        raise NotImplementedError()
+
+    async def update(self, doc_id: str, fields: dict) -> typing.Optional[dict]:
+        """Update fields of a document, returns it or None if it doesn't exist."""
+        raise NotImplementedError()
+
+    async def remove(self, doc_id: str) -> bool:
+        """Remove a document, returns whether it existed."""
+        raise NotImplementedError()
+
+    async def flush(self) -> None:
+        """Wait until every write so far is durable."""
+        pass
+
+
+def read_tinydb_table(path: str, name: str) -> typing.List[dict]:
+    """
+    Read a table of a TinyDB JSON file.
+    path -- the file
+    name -- the table
+    Returns the documents, empty if there is no file.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    # TinyDB leaves an empty file until the first write
+    tables = json.loads(data) if data.strip() else {}
+    docs = []
+    for doc_id, doc in tables.get(name, {}).items():
+        doc.setdefault("id", doc_id)
+        docs.append(doc)
+    return docs
+
+
+class SQLiteDatabase:
+    """A SQLite database file, accessed from a single worker thread."""
+
+    def __init__(self,
+                 path: str,
+                 flush_interval: float = 0.05,
+                 retry_interval: float = 1.0,
+                 legacy_path: typing.Optional[str] = None):
+        """
+        Initialize the database, nothing is opened until first use.
+        path -- the database file
+        flush_interval -- seconds writes may be held back to batch them
+        retry_interval -- seconds to wait before writing again after a failure
+        legacy_path -- a TinyDB JSON file to import new tables from
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.legacy_path = legacy_path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thingtalk-sqlite")
+        self._connection: typing.Optional[sqlite3.Connection] = None
+        self._tables: typing.Dict[str, "SQLiteTable"] = {}
+
+    def table(self, name: str) -> "SQLiteTable":
+        """Get the table of a collection."""
+        if name not in self._tables:
+            self._tables[name] = SQLiteTable(self, name)
+        return self._tables[name]
+
+    async def run(self, fn, *args):
+        """Run a blocking function on the database thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def connection(self) -> sqlite3.Connection:
+        """Get the connection, only call this on the database thread."""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        return self._connection
+
+    async def close(self):
+        """
+        Flush every table and close the connection, a shutdown handler.
+        Writes are held back for up to flush_interval, without this the
+        last ones are lost when the process exits. Using the database
+        afterwards opens it again.
+        """
+        for table in self._tables.values():
+            await table.flush()
+        if self._connection is not None:
+            await self.run(self._connection.close)
+            self._connection = None
+
+
+class SQLiteTable(Storage):
+    """A collection stored as (id PRIMARY KEY, data) rows of a SQLite table."""
+
+    def __init__(self, db: SQLiteDatabase, name: str):
+        self.db = db
+        self.name = name
+        self._cache: typing.Optional[typing.Dict[str, dict]] = None
+        self._loading: typing.Optional[asyncio.Future] = None
+        # doc id -> serialized document, None for a removal
+        self._pending: typing.Dict[str, typing.Optional[bytes]] = {}
+        self._flush_handle: typing.Optional[asyncio.TimerHandle] = None
+        self._flushing: typing.Optional[asyncio.Task] = None
+
+    async def all(self) -> typing.List[dict]:
+        cache = await self._load()
+        return [dict(doc) for doc in cache.values()]
+
+    async def get(self, doc_id: str) -> typing.Optional[dict]:
+        cache = await self._load()
+        doc = cache.get(doc_id)
+        return dict(doc) if doc is not None else None
+
+    async def insert(self, doc: dict) -> dict:
+        cache = await self._load()
+        doc = dict(doc)
+        cache[doc["id"]] = doc
+        self._write(doc["id"], doc)
+        return dict(doc)
+
+    async def update(self, doc_id: str, fields: dict) -> typing.Optional[dict]:
+        cache = await self._load()
+        doc = cache.get(doc_id)
+        if doc is None:
+            return None
+        doc = {**doc, **fields, "id": doc_id}
+        cache[doc_id] = doc
+        self._write(doc_id, doc)
+        return dict(doc)
+
+    async def remove(self, doc_id: str) -> bool:
+        cache = await self._load()
+        if cache.pop(doc_id, None) is None:
+            return False
+        self._write(doc_id, None)
+        return True
+
+    async def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending or self._flushing is not None:
+            if self._flushing is None:
+                self._flushing = asyncio.create_task(self._flush())
+            if not await asyncio.shield(self._flushing):
+                raise sqlite3.OperationalError(f"failed to write {self.name} to {self.db.path}")
+
+    def _write(self, doc_id: str, doc: typing.Optional[dict]):
+        self._pending[doc_id] = orjson.dumps(doc) if doc is not None else None
+        if self._flush_handle is None and self._flushing is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.db.flush_interval, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self._flush_handle = None
+        if self._flushing is None:
+            self._flushing = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> bool:
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, {}
+                try:
+                    await self.db.run(self._commit, batch)
+                except sqlite3.Error:
+                    logger.exception(f"failed to write {len(batch)} documents to {self.name}")
+                    # keep them for the next attempt, newer writes win
+                    self._pending = {**batch, **self._pending}
+                    if self._flush_handle is None:
+                        loop = asyncio.get_running_loop()
+                        self._flush_handle = loop.call_later(self.db.retry_interval, self._schedule_flush)
+                    return False
+            return True
+        finally:
+            self._flushing = None
+
+    async def _load(self) -> typing.Dict[str, dict]:
+        if self._cache is not None:
+            return self._cache
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self.db.run(self._read_all))
+        loading = self._loading
+        try:
+            rows = await asyncio.shield(loading)
+        except Exception:
+            # let the next request read again
+            if self._loading is loading:
+                self._loading = None
+            raise
+        if self._cache is None:
+            self._cache = {doc_id: orjson.loads(data) for doc_id, data in rows}
+        return self._cache
+
+    def _create(self, connection: sqlite3.Connection):
+        connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{self.name}" (id TEXT PRIMARY KEY, data BLOB NOT NULL)'
+        )
+
+    def _read_all(self):
+        connection = self.db.connection()
+        exists = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.name,)
+        ).fetchone()
+        if not exists:
+            legacy = read_tinydb_table(self.db.legacy_path, self.name) if self.db.legacy_path else []
+            with connection:
+                # the table only exists once the import succeeded
+                connection.execute("BEGIN")
+                self._create(connection)
+                connection.executemany(
+                    f'INSERT OR REPLACE INTO "{self.name}" (id, data) VALUES (?, ?)',
+                    [(doc["id"], orjson.dumps(doc)) for doc in legacy],
+                )
+            if legacy:
+                logger.info(f"imported {len(legacy)} {self.name} from {self.db.legacy_path}")
+        return connection.execute(f'SELECT id, data FROM "{self.name}"').fetchall()
+
+    def _commit(self, batch: typing.Dict[str, typing.Optional[bytes]]):
+        connection = self.db.connection()
+        with connection:
+            connection.executemany(
+                f'INSERT OR REPLACE INTO "{self.name}" (id, data) VALUES (?, ?)',
+                [(doc_id, data) for doc_id, data in batch.items() if data is not None],
+            )
+            connection.executemany(
+                f'DELETE FROM "{self.name}" WHERE id = ?',
+                [(doc_id,) for doc_id, data in batch.items() if data is None],
+            )
+
+
+_databases: typing.Dict[str, SQLiteDatabase] = {}
+
+
+def open_database(path: str, legacy_path: typing.Optional[str] = None) -> SQLiteDatabase:
+    """
+    Get the shared SQLiteDatabase of a file.
+    path -- the database file
+    legacy_path -- a TinyDB JSON file to import new tables from
+    """
+    if path not in _databases:
+        _databases[path] = SQLiteDatabase(path, legacy_path=legacy_path)
+    return _databases[path]
@@ -0,0 +1,134 @@
+"""
+Throttle and debounce for merged property updates.
+
+A Throttle collects `{property name: value}` dicts, keeping the most recent
+value of every property, and hands them on at most once per interval:
+
+    throttle -- leading: the first update after a quiet interval goes out at
+                once, trailing: whatever arrived meanwhile goes out when the
+                interval ends
+    debounce -- the interval restarts on every update, so a burst goes out
+                once it has been quiet for the interval
+
+Throttles are declared as a number of seconds, `0.2` is at most 5 per second,
+or as a dict `{"interval": 0.2, "leading": true, "trailing": true,
+"debounce": false}`.
+"""
+
+import asyncio
+import typing
+
+Data = typing.Dict[str, typing.Any]
+
+
+class Throttle:
+    """Rate limit a stream of property updates."""
+
+    __slots__ = ("emit", "interval", "leading", "trailing", "debounce", "spec", "_pending", "_timer")
+
+    def __init__(self,
+                 emit: typing.Callable[[Data], typing.Any],
+                 interval: float,
+                 leading: bool = True,
+                 trailing: bool = True,
+                 debounce: bool = False,
+                 spec: typing.Any = None):
+        """
+        Initialize the object.
+        emit -- called with the merged updates that go out
+        interval -- seconds between two emits
+        leading -- emit the first update of a burst at once
+        trailing -- emit the latest updates when the interval ends
+        debounce -- restart the interval on every update
+        spec -- the declaration this throttle was made from
+        """
+        if interval <= 0:
+            raise ValueError("throttle interval must be positive")
+        if not leading and not trailing:
+            raise ValueError("a throttle without leading and trailing never emits")
+        self.emit = emit
+        self.interval = interval
+        self.leading = leading
+        self.trailing = trailing
+        self.debounce = debounce
+        self.spec = spec
+        self._pending: typing.Optional[Data] = None
+        self._timer: typing.Optional[asyncio.TimerHandle] = None
+
+    @classmethod
+    def from_spec(cls, emit: typing.Callable[[Data], typing.Any], spec) -> "Throttle":
+        """
+        Make a throttle from its declaration.
+        emit -- called with the merged updates that go out
+        spec -- seconds, or a dict with interval, leading, trailing, debounce
+        """
+        if isinstance(spec, dict):
+            unknown = set(spec) - {"interval", "leading", "trailing", "debounce"}
+            if unknown:
+                raise ValueError(f"unknown throttle options {sorted(unknown)}")
+            return cls(
+                emit,
+                spec["interval"],
+                leading=spec.get("leading", True),
+                trailing=spec.get("trailing", True),
+                debounce=spec.get("debounce", False),
+                spec=spec,
+            )
+        return cls(emit, spec, spec=spec)
+
+    @property
+    def pending(self) -> Data:
+        """Get the updates waiting for the end of the interval."""
+        return dict(self._pending or {})
+
+    def push(self, data: Data):
+        """
+        Add updates, must be called on the loop.
+        data -- property name -> value
+        """
+        if self._pending is None:
+            self._pending = dict(data)
+        else:
+            self._pending.update(data)
+
+        if self._timer is None:
+            if self.leading:
+                self._release()
+            self._start()
+        elif self.debounce:
+            self._timer.cancel()
+            self._start()
+
+    def flush(self):
+        """Emit the waiting updates now and stop the timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._release()
+
+    def cancel(self):
+        """Drop the waiting updates and stop the timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = None
+
+    def _start(self):
+        self._timer = asyncio.get_running_loop().call_later(self.interval, self._expired)
+
+    def _expired(self):
+        self._timer = None
+        if self._pending is None:
+            return
+        if not self.trailing:
+            self._pending = None
+            return
+        self._release()
+        if not self.debounce:
+            # keep the rate bounded while updates keep coming
+            self._start()
+
+    def _release(self):
+        data, self._pending = self._pending, None
+        if data:
+            self.emit(data)